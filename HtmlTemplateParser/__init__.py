@@ -1,2 +1,6 @@
 from .attribute_parser import AttributeParser
-from .html_template_parser import Htp
+from .delimiters import Delimiter
+from .event_buffer import EventBuffer
+from .html_template_parser import Htp, LazyData, detect_dialects
+from .limits import BudgetExceeded, LimitExceeded
+from .tokens import Props, Token, TokenKind
@@ -5,32 +5,69 @@ Attributes are passed in as a complete string.
 AttributeParser(attributes).parse()
 """
 # pylint: disable=R0916
+import mmap
+import os
 import re
 
+from .limits import BLOCK_TAGS, check_budget, check_length, count_block, next_check
+from .patterns import find, run
+from .positions import LineIndex, wide_chars
+
+# tags and attributes are runs, see patterns.py, and the lookahead for the
+# closing delimiter fails an unterminated tag before \s* is backtracked
+# into, as in html_template_parser.template_constructs.
 curly_two = re.compile(
-    r"{{~?\>?\s*(.(?:(?!~?}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!~?}}).)*)~?}}"
+    r"{{(?=[\s\S]*?}})~?\>?\s*(."
+    + run(r"(?!~?}})[^\t\n\r\f \x00]")
+    + r")("
+    + run(r"(?!~?}})[\s\S]")
+    + r")~?}}"
 )
 curly_three = re.compile(r"{{{((?:(?!}}).)*?)}}}")
 curly_four = re.compile(
-    r"{{{{~?\s*(.(?:(?!~?}}}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!~?}}}}).)*)~?}}}}"
+    r"{{{{(?=[\s\S]*?}}}})~?\s*(."
+    + run(r"(?!~?}}}})[^\t\n\r\f \x00]")
+    + r")("
+    + run(r"(?!~?}}}})[\s\S]")
+    + r")~?}}}}"
 )
 curly_four_slash = re.compile(
-    r"{{{{~?/\s*(.(?:(?!~?}}}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!~?}}}}).)*)~?}}}}"
+    r"{{{{~?/(?=[\s\S]*?}}}})\s*(."
+    + run(r"(?!~?}}}})[^\t\n\r\f \x00]")
+    + r")("
+    + run(r"(?!~?}}}})[\s\S]")
+    + r")~?}}}}"
 )
 curly_hash = re.compile(r"{#((?:(?!#}).)*?)#}")
 at_star = re.compile(r"@\*((?:(?!\*@).)*?)\*@")
 curly_two_exclaim = re.compile(r"{{\!(?:--)?\s*((?:(?!}}).)*?)(?:--)?}}")
 curly_percent = re.compile(
-    r"{%-?\+?\s*(end)?(.(?:(?!-?\+?%}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!-?\+?%}).)*)-?\+?%}"
+    r"{%(?=[\s\S]*?%})-?\+?\s*(end)?(."
+    + run(r"(?!-?\+?%})[^\t\n\r\f \x00]")
+    + r")("
+    + run(r"(?!-?\+?%})[\s\S]")
+    + r")-?\+?%}"
 )
 curly_two_hash = re.compile(
-    r"{{~?#\>?\s*(.(?:(?!~?}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!~?}}).)*)~?}}"
+    r"{{~?#(?=[\s\S]*?}})\>?\s*(."
+    + run(r"(?!~?}})[^\t\n\r\f \x00]")
+    + r")("
+    + run(r"(?!~?}})[\s\S]")
+    + r")~?}}"
 )
 curly_two_slash = re.compile(
-    r"{{~?\/\s*(.(?:(?!~?}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!~?}}).)*)~?}}"
+    r"{{~?\/(?=[\s\S]*?}})\s*(."
+    + run(r"(?!~?}})[^\t\n\r\f \x00]")
+    + r")("
+    + run(r"(?!~?}})[\s\S]")
+    + r")~?}}"
 )
 slash_curly_two = re.compile(
-    r"\\{{\s*(.(?:(?!}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!}}).)*)}}"
+    r"\\{{(?=[\s\S]*?}})\s*(."
+    + run(r"(?!}})[^\t\n\r\f \x00]")
+    + r")("
+    + run(r"(?!}})[\s\S]")
+    + r")}}"
 )
 space = re.compile(r"\s+")
 space_equals = re.compile(r"\s*=")
@@ -46,46 +83,144 @@ class AttributeParser:
     p.close()
     """
 
-    def __init__(self):
-        """Set up class stuff."""
+    BLOCK_TAGS = BLOCK_TAGS
+
+    def __init__(
+        self,
+        *,
+        position_unit="codepoint",
+        max_steps=None,
+        deadline=None,
+        max_token_length=None,
+        max_attribute_length=None,
+        max_tokens=None,
+        max_depth=None,
+    ):
+        """Set up class stuff.
+
+        position_unit is the unit of the columns returned by getpos() and
+        of getoffset(): "codepoint" (the default), "utf-16" code units or
+        "utf-8" bytes.
+
+        max_steps and deadline are the budget of each parse, see Htp():
+        once it runs out, BudgetExceeded is raised with the offset of the
+        first element not handled.
+
+        max_attribute_length limits the length of the data, and
+        max_token_length, max_tokens and max_depth the template tags in
+        it, as for Htp(). Data over a limit raises LimitExceeded before
+        the handler of the element is called.
+        """
+        # pylint: disable=R0913
+        if position_unit not in wide_chars:
+            raise ValueError("unknown position unit %r" % position_unit)
+        self.position_unit = position_unit
+        self.max_steps = max_steps
+        self.deadline = deadline
+        self.max_token_length = max_token_length
+        self.max_attribute_length = max_attribute_length
+        self.max_tokens = max_tokens
+        self.max_depth = max_depth
         self.reset()
 
     def reset(self):
-        self.lineno = 1
-        self.offset = 0
         self.rawdata = ""
+        self._position = 0
+        self._line_index = None
 
     def feed(self, data):
         """Send attributes to the parser."""
         self.rawdata = data
+        self._position = 0
+        self._line_index = None
         self.parse()
 
+    def parse_file(self, path, encoding="utf-8"):
+        """Send the attributes in the file at path to the parser.
+
+        The file is memory-mapped and decoded straight from the mapping,
+        without reading it into bytes first. The text is parsed in one pass,
+        so it is decoded whole; it is the only copy made of the file.
+        Offsets are in code points of the text; position_unit="utf-8" gives
+        offsets into a UTF-8 file.
+        """
+        with open(path, "rb") as file:
+            if not os.fstat(file.fileno()).st_size:
+                self.feed("")
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                data = str(mapping, encoding)
+        self.feed(data)
+
     def updatepos(self, i, j):
         if i >= j:
             return j  # pragma: no cover
-        rawdata = self.rawdata
-        nlines = rawdata.count("\n", i, j)
-        if nlines:
-            self.lineno = self.lineno + nlines
-            pos = rawdata.rindex("\n", i, j)  # Should not fail
-            self.offset = j - (pos + 1)
-        else:
-            self.offset = self.offset + j - i
+        self._position = j
         return j
 
-    def getpos(self):
-        """Return current line number and offset."""
-        return self.lineno, self.offset
+    def getpos(self, offset=None):
+        """Return the line number and column of an offset in the data.
+
+        Without an offset, return the position of the current element.
+        The column is counted in position_unit.
+        """
+        if offset is None:
+            offset = self._position
+        return self._get_line_index().getpos(offset)
+
+    def getoffset(self, offset=None):
+        """Return an offset in the data, counted in position_unit.
+
+        Without an offset, return the offset of the current element.
+        """
+        if offset is None:
+            offset = self._position
+        return self._get_line_index().unit_offset(offset)
+
+    def _get_line_index(self):
+        # built on first use, the data is kept whole
+        if self._line_index is None:
+            self._line_index = LineIndex(self.position_unit)
+            self._line_index.add(self.rawdata, 0)
+        return self._line_index
+
+    @property
+    def lineno(self):
+        return self.getpos()[0]
+
+    @property
+    def offset(self):
+        return self.getpos()[1]
+
+    __element_start = None
 
     def get_element_text(self):
-        return self.__element_text
+        if self.__element_start is None:
+            return None
+        return self.rawdata[self.__element_start : self.__element_end]
+
+    def get_element_span(self):
+        """Return the (start, end) offsets of the element text, or None."""
+        if self.__element_start is None:
+            return None
+        return self.__element_start, self.__element_end
 
     def parse(self):
         rawdata = self.rawdata
+        self._found = {}
+        self._depth = 0
         i = 0
         n = len(rawdata)
+        check_length("max_attribute_length", self.max_attribute_length, 0, n)
+        # the budget is checked once the step count passes check
+        steps = 0
+        max_steps, deadline, max_tokens = self.max_steps, self.deadline, self.max_tokens
+        check = next_check(steps, max_steps, deadline, max_tokens)
 
         while i < n:
+            steps += 1
+            if steps > check:
+                check = check_budget(steps, max_steps, deadline, i, max_tokens)
             position = i
             startswith = rawdata.startswith
 
@@ -178,7 +313,7 @@ class AttributeParser:
                 k = self.parse_value_start(i)
                 i = self.updatepos(i, k)
 
-            elif space.match(rawdata[i]):
+            elif space.match(rawdata, i):
                 k = self.parse_space(i)
                 i = self.updatepos(i, k)
 
@@ -190,33 +325,51 @@ class AttributeParser:
             if position == i:  # pragma: no cover
                 assert 0, "should not get here."  # pragma: no cover
 
+    # Internal -- match pattern at i if its closing delimiter is ahead; an
+    # unterminated tag would scan to the end of the data at every try.
+    def _match(self, pattern, close, i):
+        if find(self.rawdata, close, i, self._found) < 0:
+            return None
+        match = pattern.match(self.rawdata, i)
+        if match and self.max_token_length is not None:
+            check_length("max_token_length", self.max_token_length, i, match.end())
+        return match
+
+    # Internal -- count a block opened (step 1) or closed (step -1) at i, for
+    # max_depth.
+    def _count_block(self, step, i):
+        if self.max_depth is not None:
+            self._depth = count_block(self._depth, step, self.max_depth, i)
+
     def parse_curly_perc(self, i):
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         props = []
 
-        match = curly_percent.match(rawdata, i)
+        match = self._match(curly_percent, "%}", i)
 
         if not match:
             return -1
 
-        self.__element_text = match.group()
+        j = match.end()
+        self.__element_start, self.__element_end = i, j
         tag = match.group(2)
         attributes = match.group(3).strip() if match.group(3) else None
 
-        if self.__element_text.startswith("{%-"):
+        if rawdata.startswith("{%-", i):
             props.append("spaceless-left-dash")
 
-        if self.__element_text.endswith("-%}"):
+        if rawdata.endswith("-%}", i, j):
             props.append("spaceless-right-dash")
 
-        if self.__element_text.startswith("{%+"):
+        if rawdata.startswith("{%+", i):
             props.append("spaceless-left-plus")
 
-        if self.__element_text.endswith("+%}"):
+        if rawdata.endswith("+%}", i, j):
             props.append("spaceless-right-plus")
 
-        j = match.end()
+        if tag.lower() in self.BLOCK_TAGS:
+            self._count_block(-1 if match.group(1) == "end" else 1, i)
 
         if match.group(1) == "end":
             if tag == "comment":
@@ -233,161 +386,155 @@ class AttributeParser:
 
     def parse_curly_hash(self, i):
         # django/jinja commment
-        self.__element_text = None
-        rawdata = self.rawdata
+        self.__element_start = None
 
-        match = curly_hash.match(rawdata, i)
+        match = self._match(curly_hash, "#}", i)
         if not match:
             return -1
-        self.__element_text = match.group()
+        j = match.end()
+        self.__element_start, self.__element_end = i, j
         self.handle_comment_curly_hash(match.group(1).strip())
 
-        j = match.end()
         return j
 
     def parse_curly_two_exclaim(self, i):
         # handlebars comment
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         props = []
-        match = curly_two_exclaim.match(rawdata, i)
+        match = self._match(curly_two_exclaim, "}}", i)
 
         if not match:
             return -1
 
-        self.__element_text = match.group()
+        j = match.end()
+        self.__element_start, self.__element_end = i, j
 
-        if self.__element_text.startswith("{{!--"):
+        if rawdata.startswith("{{!--", i):
             props.append("safe-left")
 
-        if self.__element_text.endswith("--}}"):
+        if rawdata.endswith("--}}", i, j):
             props.append("safe-right")
 
-        j = match.end()
-
         self.handle_comment_curly_two_exclaim(match.group(1), props)
         return j
 
     def parse_at_star(self, i):
-        self.__element_text = None
-        rawdata = self.rawdata
+        self.__element_start = None
 
-        match = at_star.match(rawdata, i)
+        match = self._match(at_star, "*@", i)
         if not match:
             return -1
 
         j = match.end()
-        self.__element_text = rawdata[i:j]
+        self.__element_start, self.__element_end = i, j
         self.handle_comment_at_star(match.group(1).strip())
 
         return j
 
     def parse_curly_two_hash(self, i):
         # handlebars/mustache loop {{#name attributes}}{{/name}}
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         props = []
-        match = curly_two_hash.match(rawdata, i)
+        match = self._match(curly_two_hash, "}}", i)
 
         if not match:
             return -1
 
-        self.__element_text = match.group()
+        j = match.end()
+        self.__element_start, self.__element_end = i, j
         tag = match.group(1)
         attributes = match.group(2).strip() if match.group(2) else None
 
-        if self.__element_text.startswith("{{~"):
+        if rawdata.startswith("{{~", i):
             props.append("spaceless-left-tilde")
 
-        if self.__element_text.startswith("{{#>"):
+        if rawdata.startswith("{{#>", i):
             props.append("partial")
 
-        if self.__element_text.endswith("~}}"):
+        if rawdata.endswith("~}}", i, j):
             props.append("spaceless-right-tilde")
 
-        j = match.end()
-
+        self._count_block(1, i)
         self.handle_starttag_curly_two_hash(tag, attributes, props)
 
         return j
 
     def parse_curly_two_slash(self, i):
         # handlebars/mustache endloop {{#name attributes}}{{/name}}
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         props = []
-        match = curly_two_slash.match(rawdata, i)
+        match = self._match(curly_two_slash, "}}", i)
 
         if not match:
             return -1
 
-        self.__element_text = match.group()
+        j = match.end()
+        self.__element_start, self.__element_end = i, j
         tag = match.group(1)
 
-        if self.__element_text.startswith("{{~"):
+        if rawdata.startswith("{{~", i):
             props.append("spaceless-left-tilde")
 
-        if self.__element_text.endswith("~}}"):
+        if rawdata.endswith("~}}", i, j):
             props.append("spaceless-right-tilde")
 
-        j = match.end()
-
+        self._count_block(-1, i)
         self.handle_endtag_curly_two_slash(tag, props)
 
         return j
 
     def parse_slash_curly_two(self, i):
-        rawdata = self.rawdata
-        self.__element_text = None
-        match = slash_curly_two.match(rawdata, i)
+        self.__element_start = None
+        match = self._match(slash_curly_two, "}}", i)
 
         if not match:
             return -1
 
         tag = match.group(1)
         attributes = match.group(2).strip()
-        self.__element_text = match.group()
         j = match.end()
-
+        self.__element_start, self.__element_end = i, j
         self.handle_slash_curly_two(tag, attributes)
         return j
 
     def parse_curly_four_slash(self, i):
         # handlebars raw close {{{{raw}}}}{{{{/raw}}}}
         rawdata = self.rawdata
-        self.__element_text = None
+        self.__element_start = None
         props = []
-        match = curly_four_slash.match(rawdata, i)
+        match = self._match(curly_four_slash, "}}}}", i)
         if not match:
             return -1
 
-        self.__element_text = match.group()
-        tag = match.group(1)
-
         j = match.end()
+        self.__element_start, self.__element_end = i, j
+        tag = match.group(1)
 
-        if self.__element_text.startswith("{{{{~"):
+        if rawdata.startswith("{{{{~", i):
             props.append("spaceless-left-tilde")
 
-        if self.__element_text.endswith("~}}}}"):
+        if rawdata.endswith("~}}}}", i, j):
             props.append("spaceless-right-tilde")
 
         attrs = match.group(2).strip()
 
+        self._count_block(-1, i)
         self.handle_endtag_curly_four_slash(tag, attrs, props)
         return j
 
     def parse_curly_three(self, i):
         # handlebars un-escaped html
-        rawdata = self.rawdata
-        self.__element_text = None
+        self.__element_start = None
 
-        match = curly_three.match(rawdata, i)
+        match = self._match(curly_three, "}}}", i)
         if not match:
             return -1
 
         j = match.end()
-        self.__element_text = match.group()
+        self.__element_start, self.__element_end = i, j
 
         self.handle_curly_three(match.group(1).strip())
 
@@ -396,57 +543,56 @@ class AttributeParser:
     def parse_curly_four(self, i):
         # handlebars raw open {{{{raw}}}}{{{{/raw}}}}
         rawdata = self.rawdata
-        self.__element_text = None
+        self.__element_start = None
         props = []
-        match = curly_four.match(rawdata, i)
+        match = self._match(curly_four, "}}}}", i)
 
         if not match:
             return -1
 
-        self.__element_text = match.group()
+        j = match.end()
+        self.__element_start, self.__element_end = i, j
         tag = match.group(1)
 
-        if self.__element_text.startswith("{{{{~"):
+        if rawdata.startswith("{{{{~", i):
             props.append("spaceless-left-tilde")
 
-        if self.__element_text.endswith("~}}}}"):
+        if rawdata.endswith("~}}}}", i, j):
             props.append("spaceless-right-tilde")
 
-        j = match.end()
-
         attrs = match.group(2).strip()
+        self._count_block(1, i)
         self.handle_starttag_curly_four(tag, attrs, props)
         return j
 
     def parse_curly_two(self, i):
         rawdata = self.rawdata
-        self.__element_text = None
+        self.__element_start = None
         props = []
-        match = curly_two.match(rawdata, i)
+        match = self._match(curly_two, "}}", i)
         if not match:
             return -1
 
-        self.__element_text = match.group()
+        j = match.end()
+        self.__element_start, self.__element_end = i, j
         tag = match.group(1).strip()
         attributes = match.group(2).strip()
-        if self.__element_text.startswith("{{~"):
+        if rawdata.startswith("{{~", i):
             props.append("spaceless-left-tilde")
 
-        if self.__element_text.startswith("{{>"):
+        if rawdata.startswith("{{>", i):
             props.append("partial")
 
-        if self.__element_text.endswith("~}}"):
+        if rawdata.endswith("~}}", i, j):
             props.append("spaceless-right-tilde")
 
-        j = match.end()
-
         self.handle_curly_two(tag, attributes, props)
 
         return j
 
     def parse_html(self, i):
         rawdata = self.rawdata
-        self.__element_text = None
+        self.__element_start = None
         props = []
         n = len(rawdata)
         j = i
@@ -458,19 +604,19 @@ class AttributeParser:
 
                 if (
                     startswith("{%", j)
-                    and curly_percent.match(rawdata, j)
+                    and self._match(curly_percent, "%}", j)
                     or startswith("{#", j)
-                    and curly_hash.match(rawdata, j)
+                    and self._match(curly_hash, "#}", j)
                     or startswith("{{", j)
-                    and curly_two.match(rawdata, j)
+                    and self._match(curly_two, "}}", j)
                     or startswith("@*", j)
-                    and at_star.match(rawdata, j)
+                    and self._match(at_star, "*@", j)
                     or startswith("\\{{", j)
-                    and slash_curly_two.match(rawdata, j)
+                    and self._match(slash_curly_two, "}}", j)
                 ):
                     break
 
-            if space_equals.match(rawdata[j:]):
+            if space_equals.match(rawdata, j):
                 props.append("has-value")
                 break
             elif space.match(c) or c in ['"', "'"]:
@@ -479,27 +625,25 @@ class AttributeParser:
             j += 1
 
         if rawdata[i:j].strip() != "":
-            self.__element_text = rawdata[i:j]
+            self.__element_start, self.__element_end = i, j
             self.handle_name(rawdata[i:j], props)
             return j
         return j + 1
 
     def parse_value_start(self, i):
-        rawdata = self.rawdata
-        self.__element_text = rawdata[i]
+        self.__element_start, self.__element_end = i, i + 1
         self.handle_value_start()
         return i + 1
 
     def parse_space(self, i):
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
 
         match = space.match(rawdata, i)
         if not match:
             return i
-        self.__element_text = match.group()
         j = match.end()
-
+        self.__element_start, self.__element_end = i, j
         self.handle_space(rawdata[i:j])
 
         return j
@@ -0,0 +1,88 @@
+"""Encoding of bytes input.
+
+encoding, bom_length = sniff_encoding(data)
+
+As in HTML, the encoding is taken from a byte order mark, or else from a
+<meta> tag in the first SNIFF_LENGTH bytes. Bytes input is scanned as it
+is, which needs an encoding where every byte below 0x80 is an ASCII
+character; scan_encoding() checks this.
+"""
+import codecs
+import re
+
+DEFAULT_ENCODING = "utf-8"
+
+# number of bytes searched for a <meta> tag
+SNIFF_LENGTH = 1024
+
+boms = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+# <meta charset="..."> and <meta http-equiv=... content="...; charset=...">
+meta_charset = re.compile(rb"""<meta\s[^>]*?charset\s*=\s*["']?\s*([-\w.:]+)""", re.I)
+
+# encodings with multi-byte characters that contain ASCII bytes
+unsafe_encodings = frozenset(
+    codecs.lookup(name).name
+    for name in (
+        "utf-7",
+        "utf-16",
+        "utf-16-le",
+        "utf-16-be",
+        "utf-32",
+        "utf-32-le",
+        "utf-32-be",
+        "big5",
+        "big5hkscs",
+        "cp932",
+        "cp949",
+        "cp950",
+        "gb18030",
+        "gbk",
+        "hz",
+        "iso2022-jp",
+        "iso2022-jp-1",
+        "iso2022-jp-2",
+        "iso2022-jp-2004",
+        "iso2022-jp-3",
+        "iso2022-jp-ext",
+        "iso2022-kr",
+        "johab",
+        "shift-jis",
+        "shift-jis-2004",
+        "shift-jisx0213",
+    )
+)
+
+
+def sniff_encoding(data):
+    """Return the encoding of the bytes data and the length of its BOM."""
+    for bom, encoding in boms:
+        if data.startswith(bom):
+            return encoding, len(bom)
+    match = meta_charset.search(data, 0, SNIFF_LENGTH)
+    if match:
+        try:
+            encoding = codecs.lookup(match.group(1).decode("ascii")).name
+        except LookupError:
+            return DEFAULT_ENCODING, 0
+        # a document that can be read as ASCII is not UTF-16, whatever it says
+        if encoding.startswith("utf-16"):
+            return DEFAULT_ENCODING, 0
+        return encoding, 0
+    return DEFAULT_ENCODING, 0
+
+
+def scan_encoding(encoding):
+    """Return the codec name of encoding if bytes in it can be scanned.
+
+    Raise LookupError for an unknown encoding and ValueError for one that
+    has ASCII bytes inside multi-byte characters.
+    """
+    name = codecs.lookup(encoding).name
+    if name in unsafe_encodings:
+        raise ValueError("%s input can not be scanned as bytes, decode it" % name)
+    return name
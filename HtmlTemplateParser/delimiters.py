@@ -0,0 +1,104 @@
+"""Template tags with custom delimiters, declared as data.
+
+go_action = Delimiter("go_action", "{{", "}}", {"-": "spaceless-%s-dash"})
+parser = Htp(dialects={"html"}, delimiters=[go_action])
+
+A delimiter is compiled into the scanner of the parsers that are given
+it, and tried before the built-in template tags. Other parsers scan as
+they would without it.
+"""
+import re
+
+from .patterns import run
+
+
+class Delimiter:
+    """A template tag from open to close, such as "[[ name attrs ]]".
+
+    name must be an identifier that is not the name of a built-in
+    construct, and open can't start with "<" or "&". modifiers map
+    strings that may follow open or come before close, such as "-", to a
+    prop; "%s" in the prop becomes "left" or "right". The text between
+    them is split, like that of {{ }}, into a tag, its first word, and
+    attrs.
+
+    The parser calls its handle_delimiter(name, tag, attrs, props), which
+    calls the method named handler, "handle_" + name by default, as
+    handler(tag, attrs, props).
+    """
+
+    __slots__ = ("name", "open", "close", "modifiers", "handler")
+
+    def __init__(self, name, open, close, modifiers=None, handler=None):  # noqa: A002
+        # pylint: disable=W0622
+        if not name.isidentifier():
+            raise ValueError("delimiter name %r is not an identifier" % name)
+        if not open or not close:
+            raise ValueError("delimiter %s needs an open and a close string" % name)
+        if open[0] in "<&":
+            raise ValueError("delimiter %s opens like markup: %r" % (name, open))
+        self.name = name
+        self.open = open
+        self.close = close
+        self.modifiers = dict(modifiers or {})
+        self.handler = handler or "handle_" + name
+
+    def _key(self):
+        return (
+            self.name,
+            self.open,
+            self.close,
+            tuple(sorted(self.modifiers.items())),
+            self.handler,
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, Delimiter):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "Delimiter(%r, %r, %r, %r, %r)" % (
+            self.name,
+            self.open,
+            self.close,
+            self.modifiers,
+            self.handler,
+        )
+
+    def construct(self):
+        """Return the (name, opening, body) of the tag, as in template_constructs."""
+        name = self.name
+        close = re.escape(self.close)
+        # longer modifiers first, so that "--" is not taken for "-"
+        modifiers = "|".join(
+            re.escape(modifier)
+            for modifier in sorted(self.modifiers, key=len, reverse=True)
+        )
+        if modifiers:
+            end = "(?:%s)?%s" % (modifiers, close)
+            left = "(?P<%s_left>%s)?" % (name, modifiers)
+            right = "(?P<%s_right>%s)?" % (name, modifiers)
+        else:
+            end, left, right = close, "", ""
+        body = (
+            r"(?=[\s\S]*?%s)%s\s*(?P<%s_tag>" % (close, left, name)
+            + run(r"(?!%s)[^\s\x00]" % end)
+            + r")(?P<%s_attrs>" % name
+            + run(r"(?!%s)[\s\S]" % end)
+            + r")%s%s" % (right, close)
+        )
+        return name, re.escape(self.open), body
+
+    def props(self, match):
+        """Return the props of the tag that match, of construct(), found."""
+        props = []
+        if self.modifiers:
+            for side in ("left", "right"):
+                modifier = match.group("%s_%s" % (self.name, side))
+                if modifier:
+                    props.append(self.modifiers[modifier].replace("%s", side))
+        return props
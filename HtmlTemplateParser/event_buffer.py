@@ -0,0 +1,103 @@
+"""Columnar token storage.
+
+buffer = EventBuffer()
+buffer.parse(template)
+token = buffer[0]
+"""
+from array import array
+
+from .html_template_parser import Htp
+from .tokens import Token, TokenKind
+
+# kinds whose tag is a name worth interning. The tag of the other kinds is
+# text of the document and is not stored.
+named_kinds = frozenset(
+    (
+        TokenKind.CHARREF,
+        TokenKind.ENTITYREF,
+        TokenKind.STARTTAG,
+        TokenKind.STARTENDTAG,
+        TokenKind.ENDTAG,
+        TokenKind.STARTTAG_CURLY_PERC,
+        TokenKind.ENDTAG_CURLY_PERC,
+        TokenKind.STARTTAG_CURLY_TWO_HASH,
+        TokenKind.ENDTAG_CURLY_TWO_SLASH,
+        TokenKind.STARTTAG_CURLY_FOUR,
+        TokenKind.ENDTAG_CURLY_FOUR_SLASH,
+        TokenKind.CURLY_TWO,
+        TokenKind.SLASH_CURLY_TWO,
+        TokenKind.DELIMITER,
+    )
+)
+
+
+class EventBuffer:
+    """Token sink for Htp.collect() that stores tokens in array columns.
+
+    Each token takes a kind byte, 64-bit start and end offsets, so a
+    document may be over 4 GiB, and the id of its tag name in tag_names. Names are stored once; tokens without a name,
+    such as data and comments, have id 0. Indexing the buffer returns a
+    Token without attrs and props, which can be read from the source
+    through the span.
+
+    A buffer can hold several documents: documents has the index of the
+    first token of each one, and offsets are relative to their document.
+    """
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.starts = array("Q")
+        self.ends = array("Q")
+        self.tag_ids = array("I")
+        self.tag_names = [None]
+        self.documents = array("I")
+        self._tag_ids = {}
+
+    def parse(
+        self,
+        source,
+        parser=Htp,
+        *,
+        convert_charrefs=True,
+        encoding=None,
+        **options,
+    ):
+        """Add the tokens of a document, a string or an iterable of chunks.
+
+        The document may also be bytes, see Htp() for encoding, and
+        options are further options of Htp(), as for Htp.iter_tokens(). If
+        BudgetExceeded is raised, the tokens before its offset have been
+        added.
+        """
+        self.documents.append(len(self.kinds))
+        parser.collect(
+            source,
+            self,
+            convert_charrefs=convert_charrefs,
+            encoding=encoding,
+            **options,
+        )
+
+    def add(self, kind, tag, _attrs, _props, start, end):
+        # pylint: disable=R0913,R0917
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+        tag_id = 0
+        if kind in named_kinds:
+            tag_id = self._tag_ids.get(tag)
+            if tag_id is None:
+                tag_id = self._tag_ids[tag] = len(self.tag_names)
+                self.tag_names.append(tag)
+        self.tag_ids.append(tag_id)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        return Token(
+            TokenKind(self.kinds[index]),
+            self.tag_names[self.tag_ids[index]],
+            start=self.starts[index],
+            end=self.ends[index],
+        )
@@ -9,20 +9,42 @@ See Python's license: https://github.com/python/cpython/blob/main/LICENSE
 
 
 - convert_charrefs option is always True.
-- feed cannot be passed a single char, but a full string
+- feed can be passed arbitrary chunks. Use streaming=True to get exactly
+  the events of a single feed, including the text between tags.
 
 """
 # pylint: disable=R0913
 
+import mmap
+import os
 import re
+from functools import lru_cache
 from html import unescape
+from itertools import combinations
+from typing import Callable, Optional, Tuple
 
 import _markupbase
 
-__all__ = ["Htp"]
+from .charset import SNIFF_LENGTH, scan_encoding, sniff_encoding
+from .delimiters import Delimiter
+from .limits import (
+    BLOCK_TAGS,
+    BudgetExceeded,
+    check_budget,
+    check_length,
+    count_block,
+    next_check,
+)
+from .patterns import find, run
+from .positions import LineIndex
+from .tokens import Props, Token, TokenKind, prop_names
+
+__all__ = ["Htp", "LazyData", "detect_dialects"]
 
-_declname_match = re.compile(r"[a-zA-Z][-_.a-zA-Z0-9]*\s*").match
-_declstringlit_match = re.compile(r'(\'[^\']*\'|"[^"]*")\s*').match
+_declname = re.compile(r"[a-zA-Z][-_.a-zA-Z0-9]*\s*")
+_declname_match = _declname.match
+_declstringlit = re.compile(r'(\'[^\']*\'|"[^"]*")\s*')
+_declstringlit_match = _declstringlit.match
 _commentclose = re.compile(r"--\s*>")
 _commentclosecurlyhash = re.compile(r"#}")
 _commentclosecurlyperc = re.compile(r"{%\s*endcomment\s*%}")
@@ -38,6 +60,20 @@ _msmarkedsectionclose = re.compile(r"]\s*>")
 # Regular expressions used for parsing
 
 interesting_normal = re.compile(r"[&<{@\\]")
+interesting_template = re.compile(r"<|{|@|\\{{")
+interesting_after_curly = re.compile(r"<|{|@")
+charref_end = re.compile(r"[\s;]")
+# a single character at the end of the buffer that may be the start of a
+# longer template delimiter once more data arrives.
+partial_template_open = re.compile(r"(?:{|@|\\{?)\Z")
+partial_slash_curly_two = re.compile(r"\\{?\Z")
+# a curly construct without a tag, such as "{{ }}", whose first "}" may still
+# begin the tag of a longer construct once more data arrives.
+bare_curly = re.compile(r"[\\{]+[~#/>\s]*}+")
+# quoted attribute values and template tags in a start tag may contain ">",
+# so while streaming a start tag is only final once each has a terminator.
+starttag_value_quote = re.compile(r"""=\s*(['"])""")
+starttag_template_spans = (("{%", "%}"), ("{{", "}}"), ("{#", "#}"))
 incomplete = re.compile("&[a-zA-Z#]")
 
 entityref = re.compile("&([a-zA-Z][-.a-zA-Z0-9]*)[^a-zA-Z0-9]")
@@ -59,6 +95,18 @@ commentclose = re.compile(r"--\s*>")
 tagfind_tolerant = re.compile(r"([a-zA-Z][^\t\n\r\f />\x00]*)(?:\s|/(?!>))*")
 
 
+# A template tag in a start tag ends at its closing delimiter, and is not
+# looked for past the next opening of its kind: each of many unterminated
+# openings is then only scanned up to the next one. The tags are runs, see
+# patterns.py, so an unterminated one is given back to the attribute in
+# linear time.
+starttag_templates = "|".join(
+    (
+        "{%" + run(r"(?!%}|{%).") + "%}",
+        "{{" + run(r"(?!}}|{{).") + "}}",
+        r"\\{{" + run(r"(?!}}|{{).") + "}}",
+    )
+)
 locatestarttagend_tolerant = re.compile(
     r"""
 <([a-zA-Z][^\t\n\r\f />\x00]*)       # tag name
@@ -68,19 +116,14 @@ locatestarttagend_tolerant = re.compile(
                 (?: '[^']*'                   # LITA-enclosed value
                   | "[^"]*"                   # LIT-enclosed value
                   | (?!['"])[^>\s]*           # bare value
-                  | {%(?:(?!%}).)*%}         # {% %}
-                  | {{(?:(?!}}).)*}}         # {{ }}
-                  | \\{{(?:(?!}}).)*}}       # \{{ }}
-                  | {#(?:(?!#}).)*#}         # {# #}
                 )
                 \s*                          # possibly followed by a space
             )?
             (?: \s
               | /(?!>)
-              | {%(?:(?!%}).)*%}         # {% %}
-              | {{(?:(?!}}).)*}}         # {{ }}
-              | \\{{(?:(?!}}).)*}}       # \{{ }}
-              | {#(?:(?!#}).)*#}         # {# #}
+              | """
+    + starttag_templates
+    + r"""
               | [^/>]
             )*
         )*
@@ -90,42 +133,589 @@ locatestarttagend_tolerant = re.compile(
     re.VERBOSE,
 )
 
-find_curly_percent = re.compile(
-    r"{%-?\+?\s*([a-zA-Z](?:(?!-?\+?%}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!-?\+?%}).)*)-?\+?%}"
-)
-find_curly_two = re.compile(
-    r"{{~?\>?\s*(.(?:(?!~?}}|\t|\n|\r|\f| |\x00|\|).)*)((?:\s|(?!~?}}).)*)~?}}"
-)
-find_curly_three = re.compile(r"{{{((?:(?!}}}).)*?)}}}")
-find_curly_four = re.compile(
-    r"{{{{~?\s*(.(?:(?!~?}}}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!~?}}}}).)*)~?}}}}"
-)
-find_curly_four_slash = re.compile(
-    r"{{{{~?/\s*(.(?:(?!~?}}}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!~?}}}}).)*)~?}}}}"
-)
-find_curly_two_hash = re.compile(
-    r"{{~?#\>?\s*(.(?:(?!~?}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!~?}}).)*)~?}}"
+# Template constructs are declared as (name, opening delimiter, body) in the
+# order goahead has to try them. Each is compiled on its own for the parse_*
+# methods and all are joined into template_scanner, where the body is
+# optional: a single match then tells goahead which construct starts at a
+# position and, if it is terminated, carries all of its groups. Group names
+# must be unique across constructs.
+#
+# Tag names and attributes are runs that can not be backtracked into, see
+# patterns.py, so an unterminated construct fails in linear time. Where the
+# first character of the tag may be given back by the spaces before it, a
+# lookahead for the closing delimiter fails a body without one up front.
+template_constructs = (
+    (
+        "endtag_curly_perc",
+        r"(?i:{%-?\s*end)",
+        r"(?i:(?P<endtag_curly_perc_tag>[a-zA-Z]"
+        + run(r"[-.a-zA-Z0-9:_]")
+        + r")(?P<endtag_curly_perc_attrs>"
+        # the attributes end before the spaces in front of the delimiter
+        + run(r"[^\s%-]|%(?!})|-(?!%})|[^\S\n]+(?!\s|-?%})") + r")\s*-?%})",
+    ),
+    (
+        "starttag_curly_perc",
+        r"{%",
+        r"-?\+?\s*(?P<starttag_curly_perc_tag>[a-zA-Z]"
+        + run(r"(?!-?\+?%})[^\t\n\r\f \x00]")
+        + r")(?P<starttag_curly_perc_attrs>"
+        + run(r"(?!-?\+?%})[\s\S]")
+        + r")-?\+?%}",
+    ),
+    (
+        "comment_curly_hash",
+        r"{\#",
+        r"(?P<comment_curly_hash_data>[\s\S]*?)\#}",
+    ),
+    (
+        "comment_curly_two_exlaim",
+        r"{{!",
+        r"(?:--)?(?P<comment_curly_two_exlaim_data>(?:(?!}}).)*?)}}",
+    ),
+    (
+        "comment_at_star",
+        r"@\*",
+        r"(?P<comment_at_star_data>[\s\S]*?)\*@",
+    ),
+    (
+        "starttag_curly_two_hash",
+        r"{{~?\#",
+        r"(?=[\s\S]*?}})\>?\s*(?P<starttag_curly_two_hash_tag>."
+        + run(r"(?!~?}})[^\t\n\r\f \x00]")
+        + r")(?P<starttag_curly_two_hash_attrs>"
+        + run(r"(?!~?}})[\s\S]")
+        + r")~?}}",
+    ),
+    (
+        "endtag_curly_two_slash",
+        r"{{~?/",
+        r"(?=[\s\S]*?}})\s*(?P<endtag_curly_two_slash_tag>."
+        + run(r"(?!~?}})[^\t\n\r\f \x00]")
+        + r")(?P<endtag_curly_two_slash_attrs>"
+        + run(r"(?!~?}})[\s\S]")
+        + r")~?}}",
+    ),
+    (
+        "endtag_curly_four",
+        r"{{{{~?/",
+        r"(?=[\s\S]*?}}}})\s*(?P<endtag_curly_four_tag>."
+        + run(r"(?!~?}}}})[^\t\n\r\f \x00]")
+        + r")(?P<endtag_curly_four_attrs>"
+        + run(r"(?!~?}}}})[\s\S]")
+        + r")~?}}}}",
+    ),
+    (
+        "starttag_curly_four",
+        r"{{{{",
+        r"(?=[\s\S]*?}}}})~?\s*(?P<starttag_curly_four_tag>."
+        + run(r"(?!~?}}}})[^\t\n\r\f \x00]")
+        + r")(?P<starttag_curly_four_attrs>"
+        + run(r"(?!~?}}}})[\s\S]")
+        + r")~?}}}}",
+    ),
+    (
+        "curly_three",
+        r"{{{",
+        r"(?P<curly_three_data>(?:(?!}}}).)*?)}}}",
+    ),
+    (
+        "slash_curly_two",
+        r"\\{{",
+        r"(?=[\s\S]*?}})\s*(?P<slash_curly_two_tag>."
+        + run(r"(?!}})[^\t\n\r\f \x00]")
+        + r")(?P<slash_curly_two_attrs>"
+        + run(r"(?!}})[\s\S]")
+        + r")}}",
+    ),
+    (
+        "curly_two",
+        r"{{",
+        r"(?=[\s\S]*?}})~?\>?\s*(?P<curly_two_tag>."
+        + run(r"(?!~?}})[^\t\n\r\f \x00|]")
+        + r")(?P<curly_two_attrs>"
+        + run(r"(?!~?}})[\s\S]")
+        + r")~?}}",
+    ),
 )
-find_slash_curly_two = re.compile(
-    r"\\{{\s*(.(?:(?!}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!}}).)*)}}"
+
+# a lone "{" is data up to the next delimiter; a lone "@" or "\" is a
+# single character of data.
+template_scanner = re.compile(
+    "|".join(r"(?P<%s>%s(?:%s)?)" % construct for construct in template_constructs)
+    + r"|(?P<curly>{)|(?P<char>[@\\])"
 )
-find_curly_two_exclaim = re.compile(r"{{\!(?:--)?((?:(?!}}).)*?)}}")
 
-find_curly_two_slash = re.compile(
-    r"{{~?\/\s*(.(?:(?!~?}}|\t|\n|\r|\f| |\x00).)*)((?:\s|(?!~?}}).)*)~?}}"
+# closing delimiter, and the opening delimiter to fall back to when the
+# closing one is missing, used to turn an unterminated construct into data.
+template_fallbacks = {
+    "endtag_curly_perc": ("%}", "{%"),
+    "starttag_curly_perc": ("%}", "{%"),
+    "comment_curly_hash": ("#}", "{#"),
+    "comment_curly_two_exlaim": ("}}", "{{!"),
+    "comment_at_star": ("*@", "@*"),
+    "starttag_curly_two_hash": ("}}}}", "{{#"),
+    "endtag_curly_two_slash": ("}}", "{{/"),
+    "endtag_curly_four": ("}}}}", "{{{{/"),
+    "starttag_curly_four": ("}}}}", "{{{{"),
+    "curly_three": ("}}", "{{"),
+    "slash_curly_two": ("}}", "{{"),
+    "curly_two": ("}}", "{{"),
+}
+
+# the closing delimiter each body ends with; once it is not in the rest of
+# the input, no construct of the kind can be terminated.
+template_closers = {
+    "endtag_curly_perc": "%}",
+    "starttag_curly_perc": "%}",
+    "comment_curly_hash": "#}",
+    "comment_curly_two_exlaim": "}}",
+    "comment_at_star": "*@",
+    "starttag_curly_two_hash": "}}",
+    "endtag_curly_two_slash": "}}",
+    "endtag_curly_four": "}}}}",
+    "starttag_curly_four": "}}}}",
+    "curly_three": "}}}",
+    "slash_curly_two": "}}",
+    "curly_two": "}}",
+}
+
+# the opening delimiters of template_scanner alone, which tell the construct
+# at a position without scanning its body.
+template_openings = re.compile(
+    "|".join(
+        r"(?P<%s>%s)" % (name, opening) for name, opening, _ in template_constructs
+    )
+    + r"|(?P<curly>{)|(?P<char>[@\\])"
 )
 
+# the template constructs of each dialect. A parser for some dialects only
+# scans for theirs; "html" has none.
+template_dialects = {
+    "django": (
+        "endtag_curly_perc",
+        "starttag_curly_perc",
+        "comment_curly_hash",
+        "curly_two",
+    ),
+    "handlebars": (
+        "comment_curly_two_exlaim",
+        "starttag_curly_two_hash",
+        "endtag_curly_two_slash",
+        "endtag_curly_four",
+        "starttag_curly_four",
+        "curly_three",
+        "slash_curly_two",
+        "curly_two",
+    ),
+    "mustache": (
+        "comment_curly_two_exlaim",
+        "starttag_curly_two_hash",
+        "endtag_curly_two_slash",
+        "curly_three",
+        "curly_two",
+    ),
+    "razor": ("comment_at_star",),
+    "html": (),
+}
+template_dialects["jinja"] = template_dialects["django"]
+
+
+def _dialect_patterns(names, delimiters=()):
+    # the patterns of goahead that look for the template constructs in names
+    # and the Delimiters in delimiters, built as the module level patterns are
+    # for all of the constructs
+    constructs = [delimiter.construct() for delimiter in delimiters] + [
+        c for c in template_constructs if c[0] in names
+    ]
+    at_star = "comment_at_star" in names
+    slash = "slash_curly_two" in names
+    curly = len(names) > at_star + slash  # the others start with "{"
+    starts = ["{"] * curly + ["@"] * at_star
+    chars = ""  # the first characters of delimiters that are not "{"
+    partial = []  # the delimiters that may be cut at the end of the buffer
+    for delimiter in delimiters:
+        first = delimiter.open[0]
+        if first not in starts:
+            starts.append(first)
+            chars += "" if first == "{" else first
+        partial.extend(delimiter.open[:k] for k in range(2, len(delimiter.open)))
+    starts = [re.escape(start) for start in starts]
+    partial = starts + [re.escape(prefix) for prefix in partial]
+    chars = re.escape(chars)
+    nothing = "(?!)"
+    if not constructs:
+        # plain html: goahead never gets to the scanners, nor builds them
+        scanner = openings = None
+    else:
+        scanner = "|".join(
+            [r"(?P<%s>%s(?:%s)?)" % construct for construct in constructs]
+            + [r"(?P<curly>{)|(?P<char>[@\\%s])" % chars]
+        )
+        openings = "|".join(
+            [r"(?P<%s>%s)" % (name, opening) for name, opening, _ in constructs]
+            + [r"(?P<curly>{)|(?P<char>[@\\%s])" % chars]
+        )
+    return {
+        "interesting_normal": "[&<%s%s]" % ("".join(starts), "\\\\" * slash),
+        "interesting_template": "|".join(["<"] + starts + [r"\\{{"] * slash),
+        "interesting_after_curly": "|".join(["<"] + starts),
+        "partial_template_open": "(?:%s)\\Z"
+        % ("|".join(partial + [r"\\{?"] * slash) or nothing),
+        "partial_slash_curly_two": r"\\{?\Z" if slash else nothing,
+        "template_scanner": scanner,
+        "template_openings": openings,
+    }
+
+
+_template_patterns = {
+    name: re.compile(opening + body) for name, opening, body in template_constructs
+}
+
+find_curly_percent = _template_patterns["starttag_curly_perc"]
+find_curly_two = _template_patterns["curly_two"]
+find_curly_three = _template_patterns["curly_three"]
+find_curly_four = _template_patterns["starttag_curly_four"]
+find_curly_four_slash = _template_patterns["endtag_curly_four"]
+find_curly_two_hash = _template_patterns["starttag_curly_two_hash"]
+find_slash_curly_two = _template_patterns["slash_curly_two"]
+find_curly_two_exclaim = _template_patterns["comment_curly_two_exlaim"]
+find_curly_two_slash = _template_patterns["endtag_curly_two_slash"]
+find_comment_curly_hash = _template_patterns["comment_curly_hash"]
+find_comment_at_star = _template_patterns["comment_at_star"]
+
 endendtag = re.compile(">")
 
 
 # the HTML 5 spec, section 8.1.2.2, doesn't allow spaces between
 # </ and the tag name, so maybe this should be fixed
 endtagfind = re.compile(r"</\s*([a-zA-Z][-.a-zA-Z0-9:_]*)\s*>")
-endtagfind_curly_perc = re.compile(
-    r"{%-?\s*end([a-zA-Z][-.a-zA-Z0-9:_]*)(.*?)\s*-?%}", re.I
+endtagfind_curly_perc = _template_patterns["endtag_curly_perc"]
+
+
+def _ascii_pattern(pattern):
+    # the pattern with ASCII classes and case folding, as bytes patterns have
+    return re.compile(pattern.pattern, pattern.flags & ~re.UNICODE | re.ASCII)
+
+
+class _Patterns:
+    """The patterns an Htp instance scans with.
+
+    Bytes input is scanned as latin-1 text, which has one character for
+    each byte, with the patterns compiled to match as they would on bytes.
+    A parser for some dialects gets the patterns of _dialect_patterns for
+    their template constructs, named in constructs, and for its Delimiters.
+    closers, fallbacks and attrs are template_closers, template_fallbacks
+    and _template_attrs with the entries of the delimiters.
+    """
+
+    # pylint: disable=R0903
+
+    def __init__(self, compile_pattern, flags, constructs=None, delimiters=()):
+        self.flags = flags
+        self.constructs = constructs
+        self.delimiters = {delimiter.name: delimiter for delimiter in delimiters}
+        self.closers = dict(template_closers)
+        self.fallbacks = dict(template_fallbacks)
+        self.attrs = dict(_template_attrs)
+        for delimiter in delimiters:
+            name = delimiter.name
+            self.closers[name] = delimiter.close
+            self.fallbacks[name] = (delimiter.close, delimiter.open)
+            self.attrs[name] = name + "_attrs"
+        patterns = {}
+        if constructs is not None:
+            patterns = _dialect_patterns(constructs, delimiters)
+        for name in (
+            "interesting_normal",
+            "interesting_template",
+            "interesting_after_curly",
+            "charref_end",
+            "partial_template_open",
+            "partial_slash_curly_two",
+            "bare_curly",
+            "starttag_value_quote",
+            "incomplete",
+            "entityref",
+            "charref",
+            "starttagopen",
+            "piclose",
+            "tagfind_tolerant",
+            "locatestarttagend_tolerant",
+            "template_scanner",
+            "template_openings",
+            "find_curly_percent",
+            "find_curly_two",
+            "find_curly_three",
+            "find_curly_four",
+            "find_curly_four_slash",
+            "find_curly_two_hash",
+            "find_slash_curly_two",
+            "find_curly_two_exclaim",
+            "find_curly_two_slash",
+            "find_comment_curly_hash",
+            "find_comment_at_star",
+            "endendtag",
+            "endtagfind",
+            "endtagfind_curly_perc",
+            "_commentclose",
+            "_markedsectionclose",
+            "_msmarkedsectionclose",
+            "_declname",
+            "_declstringlit",
+        ):
+            if name not in patterns:
+                setattr(self, name.lstrip("_"), compile_pattern(globals()[name]))
+        for name, pattern in patterns.items():
+            if pattern is not None:
+                pattern = compile_pattern(re.compile(pattern))
+            setattr(self, name, pattern)
+
+
+# the group of the attributes of each template construct that has them
+_template_attrs = {
+    name: name + "_attrs"
+    for name, _, _ in template_constructs
+    if name + "_attrs" in template_scanner.groupindex
+}
+
+# the handlers the parser of each template construct calls, and the group
+# that is None when the body of a construct did not match. Constructs none
+# of whose handlers are overridden are passed to Htp._skip_template.
+_template_handlers = {
+    "endtag_curly_perc": (
+        "handle_endtag_curly_perc",
+        "handle_endtag_comment_curly_perc",
+    ),
+    "starttag_curly_perc": (
+        "handle_starttag_curly_perc",
+        "handle_starttag_comment_curly_perc",
+    ),
+    "comment_curly_hash": ("handle_comment_curly_hash",),
+    "comment_curly_two_exlaim": ("handle_comment_curly_two_exlaim",),
+    "comment_at_star": ("handle_comment_at_star",),
+    "starttag_curly_two_hash": ("handle_starttag_curly_two_hash",),
+    "endtag_curly_two_slash": ("handle_endtag_curly_two_slash",),
+    "endtag_curly_four": ("handle_endtag_curly_four_slash",),
+    "starttag_curly_four": ("handle_starttag_curly_four",),
+    "curly_three": ("handle_curly_three",),
+    "slash_curly_two": ("handle_slash_curly_two",),
+    "curly_two": ("handle_curly_two",),
+}
+_template_bodies = {
+    name: name + ("_tag" if name + "_tag" in template_scanner.groupindex else "_data")
+    for name, _, _ in template_constructs
+}
+
+# the Props flags as ints, which combine quicker than the members of Props
+_SAFE_LEFT = int(Props.SAFE_LEFT)
+_SAFE_RIGHT = int(Props.SAFE_RIGHT)
+_SPACELESS_LEFT_TILDE = int(Props.SPACELESS_LEFT_TILDE)
+_PARTIAL = int(Props.PARTIAL)
+_SPACELESS_RIGHT_TILDE = int(Props.SPACELESS_RIGHT_TILDE)
+_SPACELESS_LEFT_DASH = int(Props.SPACELESS_LEFT_DASH)
+_SPACELESS_RIGHT_DASH = int(Props.SPACELESS_RIGHT_DASH)
+_SPACELESS_LEFT_PLUS = int(Props.SPACELESS_LEFT_PLUS)
+_SPACELESS_RIGHT_PLUS = int(Props.SPACELESS_RIGHT_PLUS)
+_IS_SELFCLOSING = int(Props.IS_SELFCLOSING)
+
+
+class _PropTable(dict):
+    # view(flags) by flags, an int, built on first use. A dict lookup is
+    # quicker than a call to an lru_cache.
+    def __init__(self, view):
+        super().__init__()
+        self.view = view
+
+    def __missing__(self, flags):
+        value = self[flags] = self.view(flags)
+        return value
+
+
+# the props handlers get for flags: a Props with PROP_FLAGS, else a new
+# list of their names. Tokens share the tuples of prop_names.
+_prop_flags = _PropTable(Props)
+_prop_tuples = _PropTable(prop_names)
+
+
+def _prop_list(flags):
+    return list(_prop_tuples[flags])
+
+
+# the template constructs whose parser sets lasttag
+_template_starttags = frozenset(
+    ("starttag_curly_perc", "starttag_curly_two_hash", "starttag_curly_four")
+)
+
+# the blocks opened (1) and closed (-1) by template constructs, for max_depth
+_template_blocks = {
+    "starttag_curly_perc": 1,
+    "endtag_curly_perc": -1,
+    "starttag_curly_two_hash": 1,
+    "endtag_curly_two_slash": -1,
+    "starttag_curly_four": 1,
+    "endtag_curly_four": -1,
+}
+
+# the characters after "<" that start a tag, a comment or a declaration
+_tag_second = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ/!?")
+
+
+@lru_cache(maxsize=None)
+def _cdata_end(elem, flags):
+    # the end tag of a cdata element, compiled once for each element
+    return re.compile(r"</\s*%s\s*>" % re.escape(elem), re.I | flags)
+
+
+_text_patterns = _Patterns(lambda pattern: pattern, 0)
+_bytes_patterns = _Patterns(_ascii_pattern, re.ASCII)
+
+
+@lru_cache(maxsize=None)
+def _dialects_patterns(dialects, delimiters, is_bytes):
+    # the patterns for text or bytes input in dialects, a frozenset, and the
+    # tuple of Delimiters, built once for each set of dialects and delimiters
+    if dialects is None:
+        if not delimiters:
+            return _bytes_patterns if is_bytes else _text_patterns
+        constructs = frozenset(name for name, _, _ in template_constructs)
+    else:
+        constructs = frozenset(
+            name for dialect in dialects for name in template_dialects[dialect]
+        )
+    if is_bytes:
+        return _Patterns(_ascii_pattern, re.ASCII, constructs, delimiters)
+    return _Patterns(lambda pattern: pattern, 0, constructs, delimiters)
+
+
+# the opening delimiters of the template constructs, for detect_dialects(),
+# which also finds those inside another, as the "{{" of "{{{". "{%" may
+# also open an endtag_curly_perc.
+_dialect_markers = (
+    ("{%", "starttag_curly_perc"),
+    ("{#", "comment_curly_hash"),
+    ("{{!", "comment_curly_two_exlaim"),
+    ("@*", "comment_at_star"),
+    ("{{#", "starttag_curly_two_hash"),
+    ("{{~#", "starttag_curly_two_hash"),
+    ("{{/", "endtag_curly_two_slash"),
+    ("{{~/", "endtag_curly_two_slash"),
+    ("{{{{", "starttag_curly_four"),
+    ("{{{", "curly_three"),
+    ("\\{{", "slash_curly_two"),
+    ("{{", "curly_two"),
+)
+
+# "{#" and "{%" after another "{", as in "{{#x}}", are inside the opening
+# delimiter of the construct the run of "{" starts, and only scanned if
+# that one is unterminated. _inner_markers finds the start of the run.
+_inner_constructs = frozenset(("comment_curly_hash", "starttag_curly_perc"))
+_inner_markers = re.compile(r"[\\{]{*(?={[#%])")
+
+# the sets of dialects detect_dialects() picks from, narrowest first, with
+# the constructs they parse. "django" stands for "jinja" too.
+_dialect_profiles = sorted(
+    (
+        (
+            frozenset(names),
+            frozenset(
+                construct for name in names for construct in template_dialects[name]
+            ),
+        )
+        for count in range(1, 4)
+        for names in combinations(
+            ("html", "razor", "django", "mustache", "handlebars"), count
+        )
+        if "html" not in names or count == 1
+    ),
+    key=lambda profile: (len(profile[1]), len(profile[0])),
 )
 
 
+def detect_dialects(text, complete=True):
+    """Return the narrowest set of dialects that parses text as all do.
+
+    text is searched for the delimiters of template tags, and the
+    result is a frozenset of names in template_dialects, such as
+    {"django"}, or {"html"} if there are none. text may be bytes, which
+    are searched as Htp scans them, as latin-1 text. If complete is False,
+    more text may follow, and a tag counts before its closing delimiter
+    has been seen.
+    """
+    if not isinstance(text, str):
+        text = str(text, "latin-1")
+    if "{" not in text and "@" not in text and "\\" not in text:
+        return _dialect_profiles[0][0]  # plain html
+    # a construct is only parsed if its closing delimiter is there too
+    found = {
+        kind
+        for marker, kind in _dialect_markers
+        if marker in text and (not complete or template_closers[kind] in text)
+    }
+    if (
+        not found.isdisjoint(_inner_constructs)
+        and text.count("{#") == text.count("{{#")
+        and text.count("{%") == text.count("{{%")
+    ):
+        # all are after another "{"
+        found -= _inner_constructs
+        # before the end, Htp waits for the rest of an unterminated construct
+        for match in _inner_markers.finditer(text) if complete else ():
+            if not _opens_through(text, match.start(), match.end()):
+                found |= _inner_constructs
+                break
+    return next(names for names, constructs in _dialect_profiles if found <= constructs)
+
+
+def _opens_through(text, i, j):
+    # whether the template construct at i is terminated and ends after j
+    kind = template_openings.match(text, i).lastgroup
+    if kind not in _template_patterns:
+        return False
+    match = _template_patterns[kind].match(text, i)
+    return match is not None and match.end() > j
+
+
+# what bytes.strip() removes, for the latin-1 text of bytes input
+_ascii_whitespace = " \t\n\r\x0b\x0c"
+
+
+class LazyData:
+    """Text passed to handle_data() by Htp(lazy_data=True).
+
+    raw is the text as it is in the document, or its bytes if the input
+    is bytes in encoding. str() returns the text with character references
+    converted, which is only done on first use.
+    """
+
+    __slots__ = ("raw", "convert", "encoding", "_text")
+
+    def __init__(self, raw, convert=True, encoding=None):
+        self.raw = raw
+        self.convert = convert
+        self.encoding = encoding
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            text = self.raw
+            if self.encoding is not None:
+                text = text.decode(self.encoding, "replace")
+            self._text = unescape(text) if self.convert and "&" in text else text
+        return self._text
+
+    def __eq__(self, other):
+        if isinstance(other, (LazyData, str)):
+            return str(self) == str(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __repr__(self):
+        return "LazyData(%r)" % self.raw
+
+
 class Htp(_markupbase.ParserBase):
     """Find tags and other markup and call handler functions.
 
@@ -145,48 +735,284 @@ class Htp(_markupbase.ParserBase):
     self.handle_entityref() or self.handle_charref() with the string
     containing respectively the named or numeric reference as the
     argument.
+
+    Handlers are looked up on the class when a parser is created. Events
+    whose handlers the class does not override are skipped without
+    building their arguments, so a handler assigned to an instance later
+    is not called for them.
     """
 
     CDATA_CONTENT_ELEMENTS = ("script", "style")
-
-    def __init__(self, *, convert_charrefs=True):
+    # cdata elements with character references in their text
+    RCDATA_CONTENT_ELEMENTS = ("textarea", "title")
+    # {% %} tags that open a block, for max_depth
+    BLOCK_TAGS = BLOCK_TAGS
+    # template tags with custom delimiters, see HtmlTemplateParser.delimiters
+    DELIMITERS: Tuple[Delimiter, ...] = ()
+    # tokens passed to handle_tokens() at a time
+    BATCH_SIZE = 512
+    # pass the props of tags to handlers as a Props value, not a list of
+    # strings. Those of delimiters stay lists.
+    PROP_FLAGS = False
+    _token_props = False
+
+    def __init_subclass__(cls, **kwargs):
+        # a class with a handle_tokens(batch) method gets its events as Tokens,
+        # added to a batch by the handlers of _TokenCollector
+        super().__init_subclass__(**kwargs)
+        if getattr(cls, "handle_tokens", None) is None:
+            return
+        overridden = [
+            name
+            for name in _token_handlers
+            if getattr(cls, name) is not getattr(Htp, name)
+            and getattr(cls, name) is not getattr(_TokenCollector, name)
+        ]
+        if overridden:
+            raise TypeError(
+                "%s defines handle_tokens() and %s"
+                % (cls.__name__, ", ".join(overridden))
+            )
+        for name in _token_handlers:
+            setattr(cls, name, getattr(_TokenCollector, name))
+        cls._add_token = Htp._add_batch_token
+        cls._token_props = True
+
+    def __init__(
+        self,
+        *,
+        convert_charrefs=True,
+        streaming=False,
+        lazy_data=False,
+        track_positions=True,
+        position_unit="codepoint",
+        encoding=None,
+        cdata_content_elements=None,
+        max_steps=None,
+        deadline=None,
+        max_token_length=None,
+        max_attribute_length=None,
+        max_tokens=None,
+        max_depth=None,
+        dialects=None,
+        delimiters=None,
+    ):
         """Initialize and reset this instance.
 
         If convert_charrefs is True (the default), all character references
         are automatically converted to the corresponding Unicode characters.
+
+        If lazy_data is True, handle_data() gets LazyData objects, which
+        keep the raw text and only convert character references when
+        str() is called on them.
+
+        If streaming is True, text at the end of the data passed to feed()
+        is held back until the next tag or close(), so feeding a document
+        in chunks of any size gives exactly the same events as feeding it
+        at once.
+
+        If track_positions is False, no line index is kept and getpos()
+        raises RuntimeError. get_element_span() still works.
+
+        position_unit is the unit of the columns returned by getpos() and
+        of getoffset(): "codepoint" (the default), "utf-16" code units or
+        "utf-8" bytes.
+
+        feed() also takes bytes-like data, which is scanned without
+        decoding it: offsets and columns are in bytes, and text is only
+        decoded for the handlers a subclass overrides and for
+        get_element_text(). encoding is the encoding of the bytes; if it
+        is None, it is taken from a byte order mark or a <meta> tag in the
+        first 1024 bytes, else UTF-8. Until 1024 bytes have arrived or
+        close() is called, feed() only keeps them.
+
+        cdata_content_elements are the elements whose text is not parsed
+        for tags, CDATA_CONTENT_ELEMENTS by default. In those that are
+        also in RCDATA_CONTENT_ELEMENTS, such as textarea and title,
+        character references are still converted.
+
+        max_steps and deadline stop a parse that takes too long: once it
+        has taken max_steps steps, one for each element and the text before
+        it, or time.monotonic() has passed deadline, feed() or close()
+        raises BudgetExceeded. The elements before its offset have been
+        handled and the rest is kept, see HtmlTemplateParser.limits. Steps
+        are counted from reset().
+
+        max_token_length, max_attribute_length, max_tokens and max_depth
+        limit untrusted input. The length of an element, or of the input
+        kept waiting for its end, is at most max_token_length, and that of
+        the attributes of a tag at most max_attribute_length. There are at
+        most max_tokens elements, not counting the text between them, and
+        blocks of template tags, such as {% if %} or {{#each}}, nest at
+        most max_depth deep; see BLOCK_TAGS. Input over a limit raises
+        LimitExceeded, before the handler of the element is called for
+        tags and template tags.
+
+        dialects are the names of the template languages to parse, in
+        template_dialects: "django" or "jinja", "handlebars", "mustache",
+        "razor" and "html", which has no template tags. The scanner then
+        only looks for their delimiters, and the others are text. All are
+        parsed by default. With dialects="auto", the input is searched for
+        delimiters as it is fed, see detect_dialects(), and dialects is the
+        narrowest set found so far: {"html"} until there are any.
+
+        delimiters are Delimiters of template tags to parse as well as those
+        of the dialects, DELIMITERS by default. They are tried before the
+        built-in tags, so one that opens with "{{" takes every tag that
+        starts with it; see handle_delimiter().
         """
+        # pylint: disable=R0914
+        self.auto_dialects = dialects == "auto"
+        if self.auto_dialects:
+            dialects = None
+        elif dialects is not None:
+            dialects = frozenset(dialects)
+            unknown = dialects.difference(template_dialects)
+            if unknown:
+                raise ValueError("unknown dialects %s" % ", ".join(sorted(unknown)))
+        self.dialects = dialects
+        if delimiters is None:
+            delimiters = self.DELIMITERS
+        self.delimiters = tuple(delimiters)
+        names = [delimiter.name for delimiter in self.delimiters]
+        for name in names:
+            if name in template_scanner.groupindex or names.count(name) > 1:
+                raise ValueError("delimiter name %s is taken" % name)
+        # the handlers to decode the arguments of, see _decode_handlers
+        self._text_handlers = tuple(
+            dict.fromkeys(
+                _text_handlers
+                + tuple(delimiter.handler for delimiter in self.delimiters)
+            )
+        )
+        # the handlers the class overrides. The events of the others are
+        # skipped without building their arguments; see _set_patterns.
+        self._handled = frozenset(
+            name
+            for name in self._text_handlers + ("handle_data",)
+            if getattr(type(self), name, None) is not getattr(Htp, name, None)
+        )
+        self._data_handled = "handle_data" in self._handled
+        self._starttags_handled = "handle_starttag" in self._handled
+        # handle_startendtag() calls handle_starttag() and handle_endtag()
+        self._startendtags_handled = not self._handled.isdisjoint(
+            ("handle_startendtag", "handle_starttag", "handle_endtag")
+        )
+        self._comments_handled = "handle_comment" in self._handled
+        # turns the Props flags of a tag into the props of its handler
+        if self._token_props:
+            self._props = _prop_tuples.__getitem__
+        elif self.PROP_FLAGS:
+            self._props = _prop_flags.__getitem__
+        else:
+            self._props = _prop_list
+        if encoding is not None:
+            encoding = scan_encoding(encoding)
         self.convert_charrefs = convert_charrefs
+        self.streaming = streaming
+        self.lazy_data = lazy_data
+        self.track_positions = track_positions
+        self.position_unit = position_unit
+        self.encoding = encoding
+        if cdata_content_elements is None:
+            cdata_content_elements = self.CDATA_CONTENT_ELEMENTS
+        self.cdata_content_elements = frozenset(
+            elem.lower() for elem in cdata_content_elements
+        )
+        self.max_steps = max_steps
+        self.deadline = deadline
+        self.max_token_length = max_token_length
+        self.max_attribute_length = max_attribute_length
+        self.max_tokens = max_tokens
+        self.max_depth = max_depth
         self.reset()
 
     def reset(self):
         """Reset this instance.  Loses all unprocessed data."""
-        self.lineno = 1
-        self.offset = 0
+        self._position = 0
+        self._line_index = None
+        if self.track_positions:
+            self._line_index = LineIndex(self.position_unit)
+        self._rawdata_offset = 0
         self.rawdata = ""
+        if getattr(self, "input_encoding", None) is not None:
+            # remove the decoding handlers, only touching __dict__ when
+            # there are any keeps attribute lookups fast
+            for name in self._text_handlers:
+                self.__dict__.pop(name, None)
+        # the encoding of bytes input, once it is known
+        self.input_encoding = None
+        self._sniff_buffer = b""
+        if self.auto_dialects:
+            self.dialects = detect_dialects("")
+        self._held = ""
+        self._whitespace = None
+        self._decoding_args = False
         self.lasttag = "???"
-        self.interesting = interesting_normal
         self.cdata_elem = None
-        _markupbase.ParserBase.reset(self)
+        self._set_patterns(_dialects_patterns(self.dialects, self.delimiters, False))
+        self._escapable = False
+        self._hold_tail = False
+        self._steps = 0
+        self._stopped = False
+        self.stop_offset = None
+        self._depth = 0
+        self._limited = False
+        # the tokens not yet passed to handle_tokens()
+        self._token_batch = []
+
+    def getpos(self, offset=None):
+        """Return the line number and column of an offset in the input.
+
+        Without an offset, return the position of the current element.
+        Offsets are those of get_element_span(), so getpos(span[1]) gives
+        the position of the end of an element. The column is counted in
+        position_unit.
+        """
+        if not self.track_positions:
+            raise RuntimeError("positions are not tracked, see track_positions")
+        if offset is None:
+            offset = self._position
+        return self._line_index.getpos(offset)
 
-    def getpos(self):
-        """Return current line number and offset."""
-        return self.lineno, self.offset
+    def getoffset(self, offset=None):
+        """Return an offset in the input, counted in position_unit.
 
-    # Internal -- update line number and offset.  This should be
-    # called for each piece of data exactly once, in order -- in other
-    # words the concatenation of all the input strings to this
-    # function should be exactly the entire input.
+        Without an offset, return the offset of the current element.
+        """
+        if not self.track_positions:
+            raise RuntimeError("positions are not tracked, see track_positions")
+        if offset is None:
+            offset = self._position
+        return self._line_index.unit_offset(offset)
+
+    @property
+    def lineno(self):
+        return self.getpos()[0]
+
+    @property
+    def offset(self):
+        return self.getpos()[1]
+
+    def stop(self):
+        """Stop parsing once the handler calling this returns.
+
+        Nothing more is handled until reset(): feed() and close() ignore
+        their input. stop_offset is then the offset in the input, as in
+        get_element_span(), of the rest of the input fed so far, which is
+        left in rawdata.
+        """
+        self._stopped = True
+
+    # Internal -- update the position.  This should be called for each
+    # piece of data exactly once, in order -- in other words the
+    # concatenation of all the input strings to this function should be
+    # exactly the entire input.  Line numbers are only looked up in the
+    # line index when getpos() is called.
     def updatepos(self, i, j):
         if i >= j:
             return j
-        rawdata = self.rawdata
-        nlines = rawdata.count("\n", i, j)
-        if nlines:
-            self.lineno = self.lineno + nlines
-            pos = rawdata.rindex("\n", i, j)  # Should not fail
-            self.offset = j - (pos + 1)
-        else:
-            self.offset = self.offset + j - i
+        self._position = self._rawdata_offset + j
         return j
 
     _decl_otherchars = ""
@@ -194,49 +1020,347 @@ class Htp(_markupbase.ParserBase):
     def feed(self, data):
         r"""Feed data to the parser.
 
-        Entire snippets should be fed as the
-        parser is more forgiving for poor attributes than a normal html
-        parser.
-
-        # don't do this:
-        # Call this as often as you want, with as little or as much text
-        # as you want (may include '\n').
+        Call this as often as you want, with as little or as much text
+        as you want (may include '\n'). Anything that may be the start of
+        an unfinished tag is kept until the next call or close().
         """
-        # self.rawdata = self.rawdata + data
-        self.rawdata = data
+        if self._stopped:
+            return
+        if not isinstance(data, str):
+            data = self._bytes_text(data)
+            if data is None:
+                return
+        elif self.input_encoding is not None or self._sniff_buffer:
+            raise TypeError("can't feed str after bytes")
+        self._feed_text(data)
+
+    # Internal -- add text to the buffer and handle what can be handled. With
+    # dialects="auto", characters at the end that may start a delimiter are
+    # held back until the next call, as they may tell another dialect.
+    def _feed_text(self, data, final=False):
+        if self.auto_dialects:
+            data = self._held + data
+            held = 0 if final else min(len(data) - len(data.rstrip("{@\\~")), 4)
+            data, self._held = data[: len(data) - held], data[len(data) - held :]
+        if self.track_positions:
+            self._line_index.add(data, self._rawdata_offset + len(self.rawdata))
+        self.rawdata = self.rawdata + data
+        if self.auto_dialects:
+            self._add_dialects(detect_dialects(self.rawdata, complete=False))
         self.goahead(0)
 
+    # Internal -- widen the dialects of Htp(dialects="auto") to those found in
+    # the text that is left to parse
+    def _add_dialects(self, dialects):
+        if dialects <= self.dialects:
+            return
+        dialects = dialects | self.dialects
+        if len(dialects) > 1:
+            dialects = dialects - {"html"}
+        self.dialects = dialects
+        self._set_patterns(
+            _dialects_patterns(
+                dialects, self.delimiters, self.input_encoding is not None
+            )
+        )
+
+    # Internal -- scan with patterns, and dispatch to the parsers of the
+    # template constructs they look for. Constructs whose handlers are not
+    # overridden go to _skip_template.
+    def _set_patterns(self, patterns):
+        self._patterns = patterns
+        if self.cdata_elem is None:
+            self.interesting = patterns.interesting_normal
+        handled = self._handled
+        self._template_parsers = {
+            name: getattr(self, "parse_" + name)
+            if not handled.isdisjoint(_template_handlers[name])
+            else self._skip_template
+            for name, _, _ in template_constructs
+            if patterns.constructs is None or name in patterns.constructs
+        }
+        for name, delimiter in patterns.delimiters.items():
+            self._template_parsers[name] = (
+                self.parse_delimiter
+                if "handle_delimiter" in handled or delimiter.handler in handled
+                else self._skip_template
+            )
+
     def close(self):
         """Handle any buffered data."""
-        self.goahead(1)
+        if not self._stopped:
+            if self._sniff_buffer:
+                self._feed_text(self._bytes_text(b"", final=True))
+            if self._held:
+                self._feed_text("", final=True)
+            if self.auto_dialects:
+                # unterminated constructs are text now, which may uncover others
+                self._add_dialects(detect_dialects(self.rawdata))
+            self.goahead(1)
+        if self._token_batch:
+            self._flush_tokens()
+
+    def parse_file(self, path, *, chunk_size=65536):
+        """Parse the file at path, as feed() with its bytes and close() would.
+
+        The file is memory-mapped and scanned as bytes, see Htp(), so offsets
+        are offsets into the file. The mapping is fed in chunks of chunk_size
+        bytes, in streaming mode whatever the parser's, so the file is never
+        copied whole and the events are those of a single feed.
+        """
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                    streaming = self.streaming
+                    self.streaming = True
+                    try:
+                        for i in range(0, size, chunk_size):
+                            if self._stopped:
+                                break
+                            self.feed(mapping[i : i + chunk_size])
+                    finally:
+                        self.streaming = streaming
+            else:
+                self.feed(b"")
+        self.close()
+
+    # Internal -- return bytes input as latin-1 text, which has a character
+    # for each byte. The first bytes are kept back until there are enough
+    # to find the encoding in, then the parser switches to bytes patterns.
+    def _bytes_text(self, data, final=False):
+        if self.input_encoding is None:
+            if self.rawdata or self._rawdata_offset:
+                raise TypeError("can't feed bytes after str")
+            if self._sniff_buffer:
+                data = self._sniff_buffer + data
+            if self.encoding is not None:
+                encoding, bom = self.encoding, 0
+            elif len(data) < SNIFF_LENGTH and not final:
+                self._sniff_buffer = bytes(data)
+                return None
+            else:
+                encoding, bom = sniff_encoding(bytes(data[:SNIFF_LENGTH]))
+            self.input_encoding = scan_encoding(encoding)
+            self._sniff_buffer = b""
+            self._rawdata_offset = bom
+            self._whitespace = _ascii_whitespace
+            self._set_patterns(_dialects_patterns(self.dialects, self.delimiters, True))
+            if self.track_positions:
+                # a code point of the latin-1 text is a byte of the input
+                self._line_index = LineIndex()
+            self._decode_handlers()
+            data = memoryview(data)[bom:]
+        return str(data, "latin-1")
+
+    # Internal -- make the handlers a subclass overrides get their text
+    # arguments decoded. A handler called from another handler is passed
+    # text that is already decoded.
+    def _decode_handlers(self):
+        decode = self._decode
+        for name in self._text_handlers:
+            if getattr(type(self), name, None) is getattr(Htp, name, None):
+                continue  # nothing reads the arguments
+            handler = getattr(self, name)
+
+            def decoding_handler(*args, handler=handler):
+                if self._decoding_args:
+                    return handler(*args)
+                self._decoding_args = True
+                try:
+                    return handler(
+                        *[decode(arg) if arg.__class__ is str else arg for arg in args]
+                    )
+                finally:
+                    self._decoding_args = False
+
+            setattr(self, name, decoding_handler)
+
+    # Internal -- decode latin-1 text of bytes input
+    def _decode(self, text):
+        if text.isascii():
+            return text
+        return text.encode("latin-1").decode(self.input_encoding, "replace")
+
+    @classmethod
+    def iter_tokens(
+        cls,
+        source,
+        *,
+        convert_charrefs=True,
+        chunk_size=65536,
+        encoding=None,
+        **options,
+    ):
+        """Parse source and yield its tokens instead of calling handlers.
+
+        source is a string or bytes, such as an mmap of a file, or an
+        iterable of chunks of either.
+        Tokens are Token objects, see HtmlTemplateParser.tokens; a start tag
+        closed with "/>" is a single STARTENDTAG token. The offsets of tokens
+        of bytes input are in bytes, see Htp() for encoding.
+
+        Tokens are produced as the input is consumed, so a consumer that
+        stops early does not pay for the rest of the document.
+
+        options are further options of Htp(), such as max_steps,
+        max_tokens or dialects. If the budget runs out, the tokens before it
+        are yielded and BudgetExceeded is raised.
+        """
+        tokens = _TokenList()
+        parser = _token_parser(cls)(
+            tokens, convert_charrefs=convert_charrefs, encoding=encoding, **options
+        )
+        chunks = source
+        if isinstance(source, _documents):
+            chunks = (
+                source[i : i + chunk_size] for i in range(0, len(source), chunk_size)
+            )
+        try:
+            for chunk in chunks:
+                parser.feed(chunk)
+                yield from tokens
+                tokens.clear()
+            parser.close()
+        except BudgetExceeded:
+            yield from tokens
+            raise
+        yield from tokens
+
+    @classmethod
+    def collect(
+        cls,
+        source,
+        sink,
+        *,
+        convert_charrefs=True,
+        encoding=None,
+        **options,
+    ):
+        """Parse all of source and pass its tokens to sink.
+
+        source and options are as for iter_tokens(). For each token
+        sink.add(kind, tag, attrs, props, start, end) is called with the
+        fields iter_tokens() would put in a Token. Returns sink. If the
+        budget runs out, the BudgetExceeded raised has sink as its events.
+        """
+        parser = _token_parser(cls)(
+            sink, convert_charrefs=convert_charrefs, encoding=encoding, **options
+        )
+        try:
+            for chunk in [source] if isinstance(source, _documents) else source:
+                parser.feed(chunk)
+            parser.close()
+        except BudgetExceeded as exc:
+            exc.events = sink
+            raise
+        return sink
 
-    __element_text = None
+    __element_start = None
 
     def get_element_text(self):
-        return self.__element_text
+        if self.__element_start is None:
+            return None
+        text = self.__element_rawdata[self.__element_start : self.__element_end]
+        if self.input_encoding is not None:
+            return self._decode(text)
+        return text
+
+    def get_element_span(self):
+        """Return the (start, end) offsets of the element text in the input.
+
+        Unlike get_element_text() this does not copy any text.
+        """
+        if self.__element_start is None:
+            return None
+        offset = self.__element_offset
+        return offset + self.__element_start, offset + self.__element_end
+
+    # Internal -- add a token of the current element to the batch of
+    # handle_tokens(), which is passed on once it has BATCH_SIZE tokens. This
+    # is the _add_token of the handlers of a class with handle_tokens().
+    def _add_batch_token(self, kind, tag, attrs=None, props=None):
+        offset = self.__element_offset
+        if props is not None:
+            props = tuple(props)
+        batch = self._token_batch
+        batch.append(
+            Token(
+                kind,
+                tag,
+                attrs,
+                props,
+                offset + self.__element_start,
+                offset + self.__element_end,
+            )
+        )
+        if len(batch) >= self.BATCH_SIZE:
+            self._flush_tokens()
+
+    # Internal -- pass the tokens added since the last batch to handle_tokens()
+    def _flush_tokens(self):
+        batch = self._token_batch
+        self._token_batch = []
+        # only called for subclasses that define handle_tokens()
+        self.handle_tokens(batch)  # pylint: disable=no-member
 
     def set_cdata_mode(self, elem):
         self.cdata_elem = elem.lower()
-        self.interesting = re.compile(r"</\s*%s\s*>" % self.cdata_elem, re.I)
+        self._escapable = self.cdata_elem in self.RCDATA_CONTENT_ELEMENTS
+        self.interesting = _cdata_end(self.cdata_elem, self._patterns.flags)
 
     def clear_cdata_mode(self):
-        self.interesting = interesting_normal
+        self.interesting = self._patterns.interesting_normal
         self.cdata_elem = None
 
     # Internal -- handle data as far as reasonable.  May leave state
     # and data to be processed by a subsequent call.  If 'end' is
     # true, force handling all data as if followed by EOF marker.
     def goahead(self, end):
+        # pylint: disable=R0914
         rawdata = self.rawdata
+        patterns = self._patterns
+        # element spans are relative to this buffer
+        self.__element_rawdata = rawdata
+        self.__element_offset = self._rawdata_offset
 
         i = 0
         n = len(rawdata)
+        # a "\" or "\{" at the end of the buffer may still become "\{{"
+        partial = None
+        if not end:
+            partial = patterns.partial_slash_curly_two.search(rawdata, n - 2)
+        search_end = partial.start() if partial else n
+        self._hold_tail = self.streaming and not end
+        # searches for closing delimiters, see patterns.find. Once a construct was
+        # found unterminated, later ones are only parsed if their closing
+        # delimiter is still ahead, rather than scanning to the end again.
+        found = {}
+        # the budget is checked once the step count passes check
+        steps = self._steps
+        check = next_check(steps, self.max_steps, self.deadline, self.max_tokens)
+        # elements are checked against the limits on their size
+        self._limited = limited = (
+            self.max_token_length is not None
+            or self.max_attribute_length is not None
+            or self.max_depth is not None
+        )
         while i < n:
+            if self._stopped:
+                break
+            steps += 1
+            if steps > check:
+                check = self._check_budget(steps, i)
             if self.convert_charrefs and not self.cdata_elem:
-                # j = rawdata.find('<', i)
-                start_match = re.search(r"<|{|@|\\{{", rawdata[i:])
-                j = start_match.start() + i if start_match else -1
+                start_match = patterns.interesting_template.search(
+                    rawdata, i, search_end
+                )
+                j = start_match.start() if start_match else -1
                 if j < 0:
+                    if partial or self.streaming and not end:
+                        # wait till we get all the text, or the rest of a
+                        # held "\" to report it with the text before it
+                        break
                     # if we can't find the next <, either we are at the end
                     # or there's more text incoming.  If the latter is True,
                     # we can't pass the text to handle_data in case we have
@@ -244,31 +1368,31 @@ class Htp(_markupbase.ParserBase):
                     # this is the case before proceeding by looking for an
                     # & near the end and see if it's followed by a space or ;.
                     amppos = rawdata.rfind("&", max(i, n - 34))
-                    if amppos >= 0 and not re.compile(r"[\s;]").search(rawdata, amppos):
+                    if amppos >= 0 and not patterns.charref_end.search(rawdata, amppos):
                         break  # wait till we get all the text
-                    j = n
+                    j = max(i, search_end)
             else:
                 match = self.interesting.search(rawdata, i)  # < or &
                 if match:
                     j = match.start()
                 else:
-                    if self.cdata_elem:
+                    if self.cdata_elem or self.streaming and not end:
                         break
                     j = n
             if i < j:
-                if self.convert_charrefs and not self.cdata_elem:
-                    self.__element_text = rawdata[i:j]
-                    self.handle_data(unescape(rawdata[i:j]))
-                else:
-                    self.__element_text = rawdata[i:j]
-                    self.handle_data(rawdata[i:j])
+                self._report_data(i, j)
+                if self._stopped:
+                    i = self.updatepos(i, j)
+                    break
             i = self.updatepos(i, j)
 
             if i == n:
                 break
             startswith = rawdata.startswith
             if startswith("<", i):
-                if starttagopen.match(rawdata, i):  # < + letter
+                if found and self._tag_unterminated(i, found):
+                    k = -1
+                elif patterns.starttagopen.match(rawdata, i):  # < + letter
                     k = self.parse_starttag(i)
                 elif startswith("</", i):
                     k = self.parse_endtag(i)
@@ -279,62 +1403,59 @@ class Htp(_markupbase.ParserBase):
                 elif startswith("<!", i):
                     k = self.parse_html_declaration(i)
                 elif (i + 1) < n:
-                    self.__element_text = rawdata[i]
-                    self.handle_data("<")
+                    self._report_data(i, i + 1)
                     k = i + 1
                 else:
                     break
 
+                if limited and k >= 0:
+                    self._check_length("max_token_length", i, k)
                 if k < 0:
                     if not end:
                         break
-                    k = rawdata.find(">", i + 1)
+                    k = find(rawdata, ">", i + 1, found)
                     if k < 0:
-                        k = rawdata.find("<", i + 1)
+                        k = find(rawdata, "<", i + 1, found)
                         if k < 0:
                             k = i + 1
                     else:
                         k += 1
 
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
+                    self._report_data(i, k)
                 i = self.updatepos(i, k)
             elif startswith("&#", i):
-                match = charref.match(rawdata, i)
+                match = patterns.charref.match(rawdata, i)
                 if match:
                     name = match.group()[2:-1]
-                    self.__element_text = rawdata[i : match.end()]
-                    self.handle_charref(name)
                     k = match.end()
                     if not startswith(";", k - 1):
                         k = k - 1
+                    self.__element_start, self.__element_end = i, k
+                    self.handle_charref(name)
                     i = self.updatepos(i, k)
                     continue
                 else:
-                    if ";" in rawdata[i:]:  # bail by consuming &#
-                        self.__element_text = rawdata[i : i + 2]
-                        self.handle_data(rawdata[i : i + 2])
+                    if find(rawdata, ";", i, found) >= 0:  # bail by consuming &#
+                        self._report_data(i, i + 2, convert=False)
                         i = self.updatepos(i, i + 2)
+                        continue
                     break
             elif startswith("&", i):
-                match = entityref.match(rawdata, i)
-                if match:
+                match = patterns.entityref.match(rawdata, i)
+                # the name may continue in the next chunk
+                if match and (end or match.end() < n):
                     name = match.group(1)
-                    self.__element_text = rawdata[i : match.end()]
-                    self.handle_entityref(name)
                     k = match.end()
                     if not startswith(";", k - 1):
                         k = k - 1
+                    self.__element_start, self.__element_end = i, k
+                    self.handle_entityref(name)
                     i = self.updatepos(i, k)
                     continue
-                match = incomplete.match(rawdata, i)
+                match = patterns.incomplete.match(rawdata, i)
                 if match:
                     # match.group() will contain at least 2 chars
-                    if end and match.group() == rawdata[i:]:
+                    if end and match.end() == n:
                         k = match.end()
                         if k <= i:
                             k = n
@@ -344,296 +1465,179 @@ class Htp(_markupbase.ParserBase):
                 elif (i + 1) < n:
                     # not the end of the buffer, and can't be confused
                     # with some other construct
-                    self.__element_text = rawdata[i]
-                    self.handle_data("&")
+                    self._report_data(i, i + 1)
                     i = self.updatepos(i, i + 1)
                 else:
                     break
-            elif startswith("{%", i):
-                if endtag_curly_perc.match(rawdata, i):
-                    k = self.parse_endtag_curly_perc(i)
-                elif starttagopen_curly_perc.match(rawdata, i):
-                    k = self.parse_starttag_curly_perc(i)
-
-                if k < 0:
-                    if not end:
-                        break
-                    k = rawdata.find("%}", i + 1)
-                    if k < 0:
-                        k = rawdata.find("{%", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-            elif startswith("{#", i):
-                k = self.parse_comment_curly_hash(i)
-
-                if k < 0:
-                    if not end:
-                        break
-                    k = rawdata.find("#}", i + 1)
-                    if k < 0:
-                        k = rawdata.find("{#", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-            elif startswith("{{!", i):
-                # {{! }} or {{!-- }}
-                # handlebarsjs comments
-                k = self.parse_comment_curly_two_exlaim(i)
-                if k < 0:
-                    if not end:
-                        break
-                    k = rawdata.find("}}", i + 1)
-                    if k < 0:
-                        k = rawdata.find("{{!", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-            elif startswith("@*", i):
-                k = self.parse_comment_at_star(i)
-
-                if k < 0:
-                    if not end:
-                        break
-                    k = rawdata.find("*@", i + 1)
-                    if k < 0:
-                        k = rawdata.find("@*", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-
-            elif startswith("{{#", i) or startswith("{{~#", i):
-                # {{# }}
-                k = self.parse_starttag_curly_two_hash(i)
-
-                if k < 0:
-                    if not end:
-                        break
-                    k = rawdata.find("}}}}", i + 1)
-                    if k < 0:
-                        k = rawdata.find("{{#", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-
-            elif startswith("{{/", i) or startswith("{{~/", i):
-                # {{/ }}
-                k = self.parse_endtag_curly_two_slash(i)
-                if k < 0:
-                    if not end:
-                        break
-                    k = rawdata.find("}}", i + 1)
-                    if k < 0:
-                        k = rawdata.find("{{/", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-
-            elif startswith("{{{{/", i) or startswith("{{{{~/", i):
-                # {{{{/ }}}} handlebars raw block
-                k = self.parse_endtag_curly_four(i)
-
-                if k < 0:
-                    if not end:
-                        break
-                    k = rawdata.find("}}}}", i + 1)
-                    if k < 0:
-                        k = rawdata.find("{{{{/", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-
-            elif startswith("{{{{", i):
-                # {{{{ }}}} handlebars raw block
-                k = self.parse_starttag_curly_four(i)
-
-                if k < 0:
-                    if not end:
-                        break
-                    k = rawdata.find("}}}}", i + 1)
-                    if k < 0:
-                        k = rawdata.find("{{{{", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-
-            elif startswith(r"{{{", i):
-                # handlebars un-escaped html
-                # {{{ stuff ... }}}
-                k = self.parse_curly_three(i)
-
-                if k < 0:
-                    if not end:
-                        break
-                    k = rawdata.find("}}", i + 1)
-                    if k < 0:
-                        k = rawdata.find("{{", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
+            else:
+                # template constructs, see template_constructs
+                if found:
+                    match = patterns.template_openings.match(rawdata, i)
+                    kind = match.lastgroup
+                    close = patterns.closers.get(kind)
+                    if close is None or find(rawdata, close, i, found) >= 0:
+                        match = patterns.template_scanner.match(rawdata, i)
                     else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-
-            elif startswith("\\{{", i):
-                # \{{ stuff ... }}
-                # handlebars/mustache inline raw block
-                k = self.parse_slash_curly_two(i)
-
-                if k < 0:
-                    if not end:
+                        match = None
+                else:
+                    match = patterns.template_scanner.match(rawdata, i)
+                    kind = match.lastgroup
+
+                if kind in ("curly", "char"):
+                    if not end and patterns.partial_template_open.match(rawdata, i):
+                        break  # may be the start of a longer delimiter
+
+                if kind == "curly":
+                    # need to handle any { statements here
+                    next_curly = patterns.interesting_after_curly.search(rawdata, i + 1)
+                    if next_curly:
+                        k = next_curly.start()
+                    elif self.streaming and not end:
                         break
-                    k = rawdata.find("}}", i + 1)
-                    if k < 0:
-                        k = rawdata.find("{{", i + 1)
-                        if k < 0:
-                            k = i + 1
-                    else:
-                        k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
                     else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-            elif startswith("{{", i):
-                # {{ stuff ... }}
-                k = self.parse_curly_two(i)
-
-                if k < 0:
+                        k = i + 1
+                elif kind == "char":
+                    self._report_data(i, i + 1)
+                    i = self.updatepos(i, i + 1)
+                    continue
+                else:
+                    if (
+                        self._hold_tail
+                        and match is not None
+                        and not self._template_is_final(i, kind, match)
+                    ):
+                        match = None
+                    if limited and match is not None:
+                        self._check_template(i, kind, match)
+                    k = -1 if match is None else self._template_parsers[kind](i, match)
+                    if k >= 0:
+                        i = self.updatepos(i, k)
+                        continue
                     if not end:
                         break
-                    k = rawdata.find("}}", i + 1)
+                    close, reopen = patterns.fallbacks[kind]
+                    k = find(rawdata, close, i + 1, found)
                     if k < 0:
-                        k = rawdata.find("{{", i + 1)
+                        k = find(rawdata, reopen, i + 1, found)
                         if k < 0:
                             k = i + 1
                     else:
                         k += 1
-                    if self.convert_charrefs and not self.cdata_elem:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(unescape(rawdata[i:k]))
-                    else:
-                        self.__element_text = rawdata[i:k]
-                        self.handle_data(rawdata[i:k])
-
-                i = self.updatepos(i, k)
-
-            # need to handle any { statements here
-            elif startswith("{", i):
-                next_curly = re.search(r"<|{|@", rawdata[i + 1 :])
-                k = next_curly.start() + i if next_curly else -1
-
-                if k < 0:
-                    k = i + 1
-                else:
-                    k += 1
 
-                if self.convert_charrefs and not self.cdata_elem:
-                    self.__element_text = rawdata[i:k]
-                    self.handle_data(unescape(rawdata[i:k]))
-                else:
-                    self.__element_text = rawdata[i:k]
-                    self.handle_data(rawdata[i:k])
+                self._report_data(i, k)
 
                 i = self.updatepos(i, k)
-
-            else:
-                assert 0, "interesting.search() lied"
         # end while
-        if end and i < n and not self.cdata_elem:
-            if self.convert_charrefs and not self.cdata_elem:
-                self.__element_text = rawdata[i:n]
-                self.handle_data(unescape(rawdata[i:n]))
-            else:
-                self.__element_text = rawdata[i:n]
-                self.handle_data(rawdata[i:n])
+        self._steps = steps
+        if end and i < n and not self.cdata_elem and not self._stopped:
+            self._report_data(i, n)
             i = self.updatepos(i, n)
+        self._rawdata_offset += i
         self.rawdata = rawdata[i:]
+        if self._stopped:
+            self.stop_offset = self._rawdata_offset
+        elif limited and self._element_held():
+            # the start of an element, waiting for its end
+            self._check_length("max_token_length", 0, len(self.rawdata))
+
+    # Internal -- check whether the rawdata kept for the next feed starts
+    # with an element waiting for its end, rather than with text waiting for
+    # the next tag.
+    def _element_held(self):
+        rawdata = self.rawdata
+        if rawdata.startswith("<"):
+            return True
+        openings = self._patterns.template_openings
+        if openings is None:
+            return False
+        match = openings.match(rawdata)
+        return match is not None and match.lastgroup not in ("curly", "char")
+
+    # Internal -- raise BudgetExceeded if step number steps, at rawdata offset
+    # i, is over the budget, keeping rawdata[i:] for a later call. Otherwise
+    # return the step count after which to check again.
+    def _check_budget(self, steps, i):
+        try:
+            return check_budget(
+                steps,
+                self.max_steps,
+                self.deadline,
+                self._rawdata_offset + i,
+                self.max_tokens,
+            )
+        except BudgetExceeded:
+            self._steps = steps - 1
+            self._rawdata_offset += i
+            self.rawdata = self.rawdata[i:]
+            raise
+
+    # Internal -- raise LimitExceeded if rawdata[i:j] is longer than the limit
+    def _check_length(self, limit, i, j):
+        offset = self._rawdata_offset
+        check_length(limit, getattr(self, limit), offset + i, offset + j)
+
+    # Internal -- check the template construct match at i against the limits
+    # before it is handled, and count the blocks it opens and closes.
+    def _check_template(self, i, kind, match):
+        self._check_length("max_token_length", i, match.end())
+        attrs = self._patterns.attrs.get(kind)
+        if attrs is not None and match.start(attrs) >= 0:
+            length = match.end(attrs) - match.start(attrs)
+            self._check_length("max_attribute_length", i, i + length)
+        step = _template_blocks.get(kind)
+        if step is None or self.max_depth is None:
+            return
+        tag = match.group(kind + "_tag")
+        if tag is None:
+            return
+        if kind.endswith("curly_perc") and tag.lower() not in self.BLOCK_TAGS:
+            return
+        self._depth = count_block(
+            self._depth, step, self.max_depth, self._rawdata_offset + i
+        )
+
+    # Internal -- return True if the tag or declaration at i can't be
+    # terminated, as the rest of rawdata has no ">". A start tag may also
+    # end at a "\x00", and a marked section is left to its parser.
+    def _tag_unterminated(self, i, found):
+        rawdata = self.rawdata
+        return (
+            rawdata[i + 1 : i + 2] in _tag_second
+            and not rawdata.startswith("<![", i)
+            and find(rawdata, ">", i, found) < 0
+            and find(rawdata, "\x00", i, found) < 0
+        )
+
+    # Internal -- call handle_data with rawdata[i:j]. Character references are
+    # converted if convert_charrefs is set, outside of cdata elements. Bytes
+    # input is decoded before references are converted.
+    def _report_data(self, i, j, convert=True):
+        self.__element_start, self.__element_end = i, j
+        if not self._data_handled:
+            return
+        data = self.rawdata[i:j]
+        convert = (
+            convert
+            and self.convert_charrefs
+            and (not self.cdata_elem or self._escapable)
+        )
+        if self.lazy_data:
+            if self.input_encoding is None:
+                data = LazyData(data, convert)
+            else:
+                data = LazyData(data.encode("latin-1"), convert, self.input_encoding)
+        else:
+            if self.input_encoding is not None:
+                data = self._decode(data)
+            if convert and "&" in data:
+                data = unescape(data)
+        self.handle_data(data)
 
     # Internal -- parse html declarations, return length or -1 if not terminated
     # See w3.org/TR/html5/tokenization.html#markup-declaration-open-state
     # See also parse_declaration in _markupbase
     def parse_html_declaration(self, i):
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         assert rawdata[i : i + 2] == "<!", (
             "unexpected call to " "parse_html_declaration()"
@@ -648,7 +1652,7 @@ class Htp(_markupbase.ParserBase):
             gtpos = rawdata.find(">", i + 9)
             if gtpos == -1:
                 return -1
-            self.__element_text = rawdata[i : gtpos + 1]
+            self.__element_start, self.__element_end = i, gtpos + 1
             self.handle_decl(rawdata[i + 2 : gtpos])
             return gtpos + 1
         else:
@@ -657,7 +1661,7 @@ class Htp(_markupbase.ParserBase):
     # Internal -- parse bogus comment, return length or -1 if not terminated
     # see http://www.w3.org/TR/html5/tokenization.html#bogus-comment-state
     def parse_bogus_comment(self, i, report=1):
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         assert rawdata[i : i + 2] in ("<!", "</"), (
             "unexpected call to " "parse_comment()"
@@ -666,21 +1670,21 @@ class Htp(_markupbase.ParserBase):
         if pos == -1:
             return -1
         if report:
+            self.__element_start, self.__element_end = i, pos + 1
             self.handle_comment(rawdata[i + 2 : pos])
-            self.__element_text = rawdata[i:pos]
         return pos + 1
 
     # Internal -- parse processing instr, return end or -1 if not terminated
     def parse_pi(self, i):
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         assert rawdata[i : i + 2] == "<?", "unexpected call to parse_pi()"
-        match = piclose.search(rawdata, i + 2)  # >
+        match = self._patterns.piclose.search(rawdata, i + 2)  # >
         if not match:
             return -1
         j = match.start()
         e = match.end()
-        self.__element_text = rawdata[i:e]
+        self.__element_start, self.__element_end = i, e
 
         self.handle_pi(rawdata[i + 2 : j])
 
@@ -688,19 +1692,21 @@ class Htp(_markupbase.ParserBase):
 
     # Internal -- handle starttag, return end or -1 if not terminated
     def parse_starttag(self, i):
-        self.__element_text = None
+        self.__element_start = None
         endpos = self.check_for_whole_start_tag(i)
 
         if endpos < 0:
             return endpos
+        if self._hold_tail and not self._starttag_is_final(i, endpos):
+            return -1
         rawdata = self.rawdata
 
-        self.__element_text = rawdata[i:endpos]
+        self.__element_start, self.__element_end = i, endpos
+        if self._limited:
+            self._check_length("max_token_length", i, endpos)
 
         # Now parse the data between i+1 and j into a tag and attrs
-        props = []
-
-        match = locatestarttagend_tolerant.match(rawdata, i)
+        match = self._patterns.locatestarttagend_tolerant.match(rawdata, i)
 
         assert match, "unexpected call to parse_starttag()"
         k = match.end()
@@ -708,223 +1714,295 @@ class Htp(_markupbase.ParserBase):
         tag = match.group(1)
         self.lasttag = tag.lower()
 
-        end = rawdata[k:endpos].strip()
+        end = rawdata[k:endpos].strip(self._whitespace)
+
+        if not self._limited and (
+            (end == ">" and not self._starttags_handled)
+            or (end == "/>" and not self._startendtags_handled)
+        ):
+            # nothing reads the attributes
+            if end == ">" and self.lasttag in self.cdata_content_elements:
+                self.set_cdata_mode(tag)
+            return endpos
 
         # just grab all attributes to a string
         # where they can be processed after using the attribute-parser
-        attrs = rawdata[i + 1 + len(tag) : endpos - len(end)].strip()
+        attrs = rawdata[i + 1 + len(tag) : endpos - len(end)]
+        attrs = attrs.strip(self._whitespace)
+        if self._limited:
+            self._check_length("max_attribute_length", i, i + len(attrs))
 
         k = endpos - 1
 
         if end not in (">", "/>"):
-            lineno, offset = self.getpos()
-            if "\n" in self.__element_text:
-                lineno = lineno + self.__element_text.count("\n")
-                offset = len(self.__element_text) - self.__element_text.rfind("\n")
-            else:
-                offset = offset + len(self.__element_text)
-            self.__element_text = rawdata[i:endpos]
-            self.handle_data(rawdata[i:endpos])
+            self._report_data(i, endpos, convert=False)
             return endpos
         if end.endswith("/>"):
             # XHTML-style empty tag: <span attr="value" />
-            props.append("is-selfclosing")
-            self.handle_startendtag(tag, attrs, props)
+            self.handle_startendtag(tag, attrs, self._props(_IS_SELFCLOSING))
         else:
-            self.handle_starttag(tag, attrs, props)
-            if tag.lower() in self.CDATA_CONTENT_ELEMENTS:
-                self.set_cdata_mode(tag.lower())
+            self.handle_starttag(tag, attrs, self._props(0))
+            if tag.lower() in self.cdata_content_elements:
+                self.set_cdata_mode(tag)
         return endpos
 
-    def parse_starttag_curly_two_hash(self, i):
-        self.__element_text = None
+    def parse_starttag_curly_two_hash(self, i, match=None):
+        self.__element_start = None
         rawdata = self.rawdata
 
-        match = find_curly_two_hash.match(rawdata, i)
-        if not match:
+        match = match or self._patterns.find_curly_two_hash.match(rawdata, i)
+        if not match or match.group("starttag_curly_two_hash_tag") is None:
             return -1
 
         endpos = match.end()
 
-        self.__element_text = rawdata[i:endpos]
+        self.__element_start, self.__element_end = i, endpos
 
-        props = []
+        flags = 0
 
-        if self.__element_text.startswith("{{~"):
-            props.append("spaceless-left-tilde")
+        if rawdata.startswith("{{~", i):
+            flags |= _SPACELESS_LEFT_TILDE
 
-        if self.__element_text.startswith("{{#>"):
-            props.append("partial")
+        if rawdata.startswith("{{#>", i):
+            flags |= _PARTIAL
 
-        if self.__element_text.endswith("~}}"):
-            props.append("spaceless-right-tilde")
+        if rawdata.endswith("~}}", i, endpos):
+            flags |= _SPACELESS_RIGHT_TILDE
 
-        attrs = match.group(2).strip()
+        props = self._props(flags)
 
-        tag = match.group(1)
+        attrs = match.group("starttag_curly_two_hash_attrs").strip(self._whitespace)
+
+        tag = match.group("starttag_curly_two_hash_tag")
 
         self.lasttag = tag.lower()
 
-        self.handle_starttag_curly_two_hash(tag.strip(), attrs, props)
+        self.handle_starttag_curly_two_hash(tag.strip(self._whitespace), attrs, props)
 
         return endpos
 
-    def parse_starttag_curly_four(self, i):
-        self.__element_text = None
+    def parse_starttag_curly_four(self, i, match=None):
+        self.__element_start = None
         rawdata = self.rawdata
 
-        match = find_curly_four.match(rawdata, i)
-
-        if not match:
+        match = match or self._patterns.find_curly_four.match(rawdata, i)
+        if not match or match.group("starttag_curly_four_tag") is None:
             return -1
+
         endpos = match.end()
 
-        if endpos < 0:
-            return endpos
+        self.__element_start, self.__element_end = i, endpos
 
-        self.__element_text = rawdata[i:endpos]
+        flags = 0
 
-        props = []
+        if rawdata.startswith("{{{{~", i):
+            flags |= _SPACELESS_LEFT_TILDE
 
-        if self.__element_text.startswith("{{{{~"):
-            props.append("spaceless-left-tilde")
+        if rawdata.endswith("~}}}}", i, endpos):
+            flags |= _SPACELESS_RIGHT_TILDE
 
-        if self.__element_text.endswith("~}}}}"):
-            props.append("spaceless-right-tilde")
+        props = self._props(flags)
 
-        attrs = match.group(2).strip()
+        attrs = match.group("starttag_curly_four_attrs").strip(self._whitespace)
 
-        tag = match.group(1)
+        tag = match.group("starttag_curly_four_tag")
         self.lasttag = tag.lower()
 
-        self.handle_starttag_curly_four(tag.strip(), attrs, props)
+        self.handle_starttag_curly_four(tag.strip(self._whitespace), attrs, props)
 
         return endpos
 
     # Internal -- handle starttag, return end or -1 if not terminated
-    def parse_starttag_curly_perc(self, i):
-        self.__element_text = None
+    def parse_starttag_curly_perc(self, i, match=None):
+        self.__element_start = None
 
         rawdata = self.rawdata
-        match = find_curly_percent.match(rawdata, i)
-
-        if not match:
+        match = match or self._patterns.find_curly_percent.match(rawdata, i)
+        if not match or match.group("starttag_curly_perc_tag") is None:
             return -1
 
         endpos = match.end()
 
-        props = []
+        flags = 0
 
-        self.__element_text = rawdata[i:endpos]
+        self.__element_start, self.__element_end = i, endpos
 
-        if self.__element_text.startswith("{%-"):
-            props.append("spaceless-left-dash")
+        if rawdata.startswith("{%-", i):
+            flags |= _SPACELESS_LEFT_DASH
 
-        if self.__element_text.endswith("-%}"):
-            props.append("spaceless-right-dash")
+        if rawdata.endswith("-%}", i, endpos):
+            flags |= _SPACELESS_RIGHT_DASH
 
-        if self.__element_text.startswith("{%+"):
-            props.append("spaceless-left-plus")
+        if rawdata.startswith("{%+", i):
+            flags |= _SPACELESS_LEFT_PLUS
 
-        if self.__element_text.endswith("+%}"):
-            props.append("spaceless-right-plus")
+        if rawdata.endswith("+%}", i, endpos):
+            flags |= _SPACELESS_RIGHT_PLUS
 
-        tag = match.group(1)
+        props = self._props(flags)
+
+        tag = match.group("starttag_curly_perc_tag")
         self.lasttag = tag.lower()
-        attrs = match.group(2).strip()
+        attrs = match.group("starttag_curly_perc_attrs").strip(self._whitespace)
 
-        if tag.strip() == "comment":
-            self.handle_starttag_comment_curly_perc(tag.strip(), attrs, props)
+        if tag.strip(self._whitespace) == "comment":
+            self.handle_starttag_comment_curly_perc(
+                tag.strip(self._whitespace), attrs, props
+            )
         else:
-            self.handle_starttag_curly_perc(tag.strip(), attrs, props)
-        if tag in self.CDATA_CONTENT_ELEMENTS:
+            self.handle_starttag_curly_perc(tag.strip(self._whitespace), attrs, props)
+        if tag in self.cdata_content_elements:
             self.set_cdata_mode(tag)
 
         return endpos
 
-    def parse_slash_curly_two(self, i):
-        self.__element_text = None
+    def parse_slash_curly_two(self, i, match=None):
+        self.__element_start = None
         rawdata = self.rawdata
-        match = find_slash_curly_two.match(rawdata, i)
 
-        if not match:
+        match = match or self._patterns.find_slash_curly_two.match(rawdata, i)
+        if not match or match.group("slash_curly_two_tag") is None:
             return -1
 
         endpos = match.end()
 
-        attrs = match.group(2).strip()
+        attrs = match.group("slash_curly_two_attrs").strip(self._whitespace)
 
-        tag = match.group(1)
+        tag = match.group("slash_curly_two_tag")
 
-        self.__element_text = rawdata[i:endpos]
+        self.__element_start, self.__element_end = i, endpos
 
-        self.handle_slash_curly_two(tag.strip(), attrs)
+        self.handle_slash_curly_two(tag.strip(self._whitespace), attrs)
 
         return endpos
 
-    def parse_curly_two(self, i):
-        self.__element_text = None
+    def parse_curly_two(self, i, match=None):
+        self.__element_start = None
         rawdata = self.rawdata
 
-        match = find_curly_two.match(rawdata, i)
-
-        if not match:
+        match = match or self._patterns.find_curly_two.match(rawdata, i)
+        if not match or match.group("curly_two_tag") is None:
             return -1
 
         endpos = match.end()
 
-        attrs = match.group(2).strip()
+        attrs = match.group("curly_two_attrs").strip(self._whitespace)
 
-        tag = match.group(1)
+        tag = match.group("curly_two_tag")
         tag_text = match.group()
-        props = []
+        flags = 0
 
-        self.__element_text = rawdata[i:endpos]
+        self.__element_start, self.__element_end = i, endpos
 
         if tag_text.startswith("{{!--"):
-            props.append("safe-left")
+            flags |= _SAFE_LEFT
 
         if tag_text.endswith("--}}"):
-            props.append("safe-right")
+            flags |= _SAFE_RIGHT
 
         if tag_text.startswith("{{~"):
-            props.append("spaceless-left-tilde")
+            flags |= _SPACELESS_LEFT_TILDE
 
         if tag_text.startswith("{{>"):
-            props.append("partial")
+            flags |= _PARTIAL
 
         if tag_text.endswith("~}}"):
-            props.append("spaceless-right-tilde")
+            flags |= _SPACELESS_RIGHT_TILDE
 
-        self.handle_curly_two(tag.strip(), attrs, props)
+        props = self._props(flags)
+
+        self.handle_curly_two(tag.strip(self._whitespace), attrs, props)
 
         return endpos
 
-    def parse_curly_three(self, i):
-        self.__element_text = None
+    def parse_curly_three(self, i, match=None):
+        self.__element_start = None
         rawdata = self.rawdata
 
-        match = find_curly_three.match(rawdata, i)
+        match = match or self._patterns.find_curly_three.match(rawdata, i)
+        if not match or match.group("curly_three_data") is None:
+            return -1
 
-        if not match:
+        endpos = match.end()
+
+        data = match.group("curly_three_data")
+
+        self.__element_start, self.__element_end = i, endpos
+
+        self.handle_curly_three(data.strip(self._whitespace))
+
+        return endpos
+
+    def parse_delimiter(self, i, match):
+        self.__element_start = None
+        name = match.lastgroup
+        tag = match.group(name + "_tag")
+        if tag is None:
             return -1
 
         endpos = match.end()
 
-        data = match.group(1)
+        delimiter = self._patterns.delimiters[name]
+        attrs = match.group(name + "_attrs").strip(self._whitespace)
+
+        self.__element_start, self.__element_end = i, endpos
 
-        self.__element_text = rawdata[i:endpos]
+        self.handle_delimiter(name, tag, attrs, delimiter.props(match))
 
-        self.handle_curly_three(data.strip())
+        return endpos
 
+    # Internal -- parse the template construct that match found at i, of a
+    # kind none of whose handlers are overridden. Only the state the parser of
+    # the kind keeps is updated, and no handler is called.
+    def _skip_template(self, i, match):
+        kind = match.lastgroup
+        tag = match.group(_template_bodies.get(kind, kind + "_tag"))
+        if tag is None:
+            return -1
+        endpos = match.end()
+        self.__element_start, self.__element_end = i, endpos
+        if kind in _template_starttags:
+            self.lasttag = tag.lower()
+            if kind == "starttag_curly_perc" and tag in self.cdata_content_elements:
+                self.set_cdata_mode(tag)
+        elif kind == "endtag_curly_perc":
+            self.clear_cdata_mode()
         return endpos
 
+    # Internal -- check that data which has not arrived yet cannot extend the
+    # template construct matched at i. The tag of a curly construct may start
+    # with "}": "{{ }}" at the end of the data has an empty tag, but is the
+    # start of the tag "}}{" in "{{ }}{ }}". Only needed while streaming.
+    def _template_is_final(self, i, kind, match):
+        patterns = self._patterns
+        j = match.end()
+        if not patterns.bare_curly.fullmatch(self.rawdata, i, j):
+            return True
+        longer = patterns.template_scanner.match(
+            self.rawdata[i:j] + patterns.closers[kind]
+        )
+        return longer.lastgroup == kind and longer.end() == j - i
+
+    # Internal -- check that data which has not arrived yet cannot extend the
+    # start tag in rawdata[i:j]. Only needed while streaming.
+    def _starttag_is_final(self, i, j):
+        rawdata = self.rawdata
+        for match in self._patterns.starttag_value_quote.finditer(rawdata, i, j):
+            if rawdata.find(match.group(1), match.end()) < 0:
+                return False
+        for opener, closer in starttag_template_spans:
+            k = rawdata.rfind(opener, i, j)
+            if rawdata.find(closer, k + 2) < 0 <= k:
+                if rawdata.find("\n", k) < 0:
+                    return False
+        return True
+
     # Internal -- check to see if we have a complete starttag; return end
     # or -1 if incomplete.
     def check_for_whole_start_tag(self, i):
         rawdata = self.rawdata
 
-        m = locatestarttagend_tolerant.match(rawdata, i)
+        m = self._patterns.locatestarttagend_tolerant.match(rawdata, i)
 
         if m:
             j = m.end()
@@ -945,6 +2023,9 @@ class Htp(_markupbase.ParserBase):
             if next == "-":
                 if rawdata.startswith("-%}", j):
                     return j + 3
+                if len(rawdata) - j < 3 and "-%}".startswith(rawdata[j:]):
+                    # buffer boundary
+                    return -1
             if next == "%":
                 if rawdata.startswith("%}", j):
                     return j + 2
@@ -972,22 +2053,21 @@ class Htp(_markupbase.ParserBase):
 
     # Internal -- parse endtag, return end or -1 if incomplete
     def parse_endtag(self, i):
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         assert rawdata[i : i + 2] == "</", "unexpected call to parse_endtag"
-        match = endendtag.search(rawdata, i + 1)  # >
+        match = self._patterns.endendtag.search(rawdata, i + 1)  # >
         if not match:
             return -1
         gtpos = match.end()
-        match = endtagfind.match(rawdata, i)  # </ + tag + >
+        match = self._patterns.endtagfind.match(rawdata, i)  # </ + tag + >
 
         if not match:
             if self.cdata_elem is not None:
-                self.__element_text = rawdata[i:gtpos]
-                self.handle_data(rawdata[i:gtpos])
+                self._report_data(i, gtpos, convert=False)
                 return gtpos
             # find the name: w3.org/TR/html5/tokenization.html#tag-name-state
-            namematch = tagfind_tolerant.match(rawdata, i + 2)
+            namematch = self._patterns.tagfind_tolerant.match(rawdata, i + 2)
             if not namematch:
                 # w3.org/TR/html5/tokenization.html#end-tag-open-state
                 if rawdata[i : i + 3] == "</>":
@@ -1000,15 +2080,15 @@ class Htp(_markupbase.ParserBase):
             # </tag attr=">">, but looking for > after the name should cover
             # most of the cases and is much simpler
             gtpos = rawdata.find(">", namematch.end())
+            self.__element_start, self.__element_end = i, gtpos + 1
             self.handle_endtag(tagname)
             return gtpos + 1
 
-        self.__element_text = rawdata[i:gtpos]
+        self.__element_start, self.__element_end = i, gtpos
         elem = match.group(1)  # script or style
         if self.cdata_elem is not None:
             if elem.lower() != self.cdata_elem:
-                self.__element_text = rawdata[i:gtpos]
-                self.handle_data(rawdata[i:gtpos])
+                self._report_data(i, gtpos, convert=False)
                 return gtpos
 
         self.handle_endtag(elem)
@@ -1016,29 +2096,30 @@ class Htp(_markupbase.ParserBase):
         return gtpos
 
     # Internal -- parse endtag, return end or -1 if incomplete
-    def parse_endtag_curly_perc(self, i):
-        self.__element_text = None
+    def parse_endtag_curly_perc(self, i, match=None):
+        self.__element_start = None
         rawdata = self.rawdata
-        props = []
+        flags = 0
 
-        if rawdata[i:].startswith("{%-"):
-            props.append("spaceless-left-dash")
+        if rawdata.startswith("{%-", i):
+            flags |= _SPACELESS_LEFT_DASH
 
         assert rawdata[i : i + 2] == "{%", "unexpected call to parse_endtag"
 
-        match = endtagfind_curly_perc.match(rawdata, i)
-
-        if not match:
+        match = match or self._patterns.endtagfind_curly_perc.match(rawdata, i)
+        if not match or match.group("endtag_curly_perc_tag") is None:
             return -1
 
-        if rawdata[i:].endswith("-%}"):
-            props.append("spaceless-right-dash")
-
-        attrs = match.group(2).strip()
         j = match.end()
-        # match = endtagfind_curly_perc.match(rawdata, i)  # </ + tag + >
-        self.__element_text = rawdata[i:j]
-        tag = match.group(1)  # script or style
+
+        if rawdata.startswith("-%}", j - 3):
+            flags |= _SPACELESS_RIGHT_DASH
+
+        props = self._props(flags)
+
+        attrs = match.group("endtag_curly_perc_attrs").strip(self._whitespace)
+        self.__element_start, self.__element_end = i, j
+        tag = match.group("endtag_curly_perc_tag")  # script or style
 
         if tag == "comment":
             self.handle_endtag_comment_curly_perc(tag, props)
@@ -1047,60 +2128,60 @@ class Htp(_markupbase.ParserBase):
         self.clear_cdata_mode()
         return j
 
-    def parse_endtag_curly_two_slash(self, i):
-        self.__element_text = None
+    def parse_endtag_curly_two_slash(self, i, match=None):
+        self.__element_start = None
 
         rawdata = self.rawdata
-        match = find_curly_two_slash.match(rawdata, i)
-
-        if not match:
+        match = match or self._patterns.find_curly_two_slash.match(rawdata, i)
+        if not match or match.group("endtag_curly_two_slash_tag") is None:
             return -1
 
         endpos = match.end()
 
-        props = []
+        flags = 0
 
         tag_text = match.group()
-        tag = match.group(1)
-        self.__element_text = rawdata[i:endpos]
+        tag = match.group("endtag_curly_two_slash_tag")
+        self.__element_start, self.__element_end = i, endpos
 
         if tag_text.startswith("{{~"):
-            props.append("spaceless-left-tilde")
+            flags |= _SPACELESS_LEFT_TILDE
 
         if tag_text.endswith("~}}"):
-            props.append("spaceless-right-tilde")
+            flags |= _SPACELESS_RIGHT_TILDE
+
+        props = self._props(flags)
 
         self.handle_endtag_curly_two_slash(tag, props)
 
         return endpos
 
-    def parse_endtag_curly_four(self, i):
-        self.__element_text = None
+    def parse_endtag_curly_four(self, i, match=None):
+        self.__element_start = None
         rawdata = self.rawdata
 
-        match = find_curly_four_slash.match(rawdata, i)
-
-        if not match:
+        match = match or self._patterns.find_curly_four_slash.match(rawdata, i)
+        if not match or match.group("endtag_curly_four_tag") is None:
             return -1
-        endpos = match.end()
 
-        if endpos < 0:
-            return endpos
+        endpos = match.end()
 
         tag_text = match.group()
-        tag = match.group(1)
-        props = []
-        self.__element_text = rawdata[i:endpos]
+        tag = match.group("endtag_curly_four_tag")
+        flags = 0
+        self.__element_start, self.__element_end = i, endpos
 
         if tag_text.startswith("{{{{~"):
-            props.append("spaceless-left-tilde")
+            flags |= _SPACELESS_LEFT_TILDE
 
         if tag_text.endswith("~}}}}"):
-            props.append("spaceless-right-tilde")
+            flags |= _SPACELESS_RIGHT_TILDE
+
+        props = self._props(flags)
 
-        attrs = match.group(2).strip()
+        attrs = match.group("endtag_curly_four_attrs").strip(self._whitespace)
 
-        self.handle_endtag_curly_four_slash(tag.strip(), attrs, props)
+        self.handle_endtag_curly_four_slash(tag.strip(self._whitespace), attrs, props)
 
         return endpos
 
@@ -1116,7 +2197,7 @@ class Htp(_markupbase.ParserBase):
         # name in the following list: ENTITY, DOCTYPE, ELEMENT,
         # ATTLIST, NOTATION, SHORTREF, USEMAP,
         # LINKTYPE, LINK, IDLINK, USELINK, SYSTEM
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         j = i + 2
         assert rawdata[i:j] == "<!", "unexpected call to parse_declaration"
@@ -1150,18 +2231,18 @@ class Htp(_markupbase.ParserBase):
                 # end of declaration syntax
                 data = rawdata[i + 2 : j]
                 if decltype == "doctype":
-                    self.__element_text = rawdata[i:j]
+                    self.__element_start, self.__element_end = i, j + 1
                     self.handle_decl(data)
                 else:
                     # According to the HTML5 specs sections "8.2.4.44 Bogus
                     # comment state" and "8.2.4.45 Markup declaration open
                     # state", a comment token should be emitted.
                     # Calling unknown_decl provides more flexibility though.
-                    self.__element_text = rawdata[i:j]
+                    self.__element_start, self.__element_end = i, j + 1
                     self.unknown_decl(data)
                 return j + 1
             if c in "\"'":
-                m = _declstringlit_match(rawdata, j)
+                m = self._patterns.declstringlit.match(rawdata, j)
                 if not m:
                     return -1  # incomplete
                 j = m.end()
@@ -1192,7 +2273,7 @@ class Htp(_markupbase.ParserBase):
     # Internal -- parse a marked section
     # Override this to handle MS-word extension syntax <![if word]>content<![endif]>
     def parse_marked_section(self, i, report=1):
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
 
         assert rawdata[i : i + 3] == "<![", "unexpected call to parse_marked_section()"
@@ -1201,10 +2282,10 @@ class Htp(_markupbase.ParserBase):
             return j
         if sectName.lower() in {"temp", "cdata", "ignore", "include", "rcdata"}:
             # look for standard ]]> ending
-            match = _markedsectionclose.search(rawdata, i + 3)
+            match = self._patterns.markedsectionclose.search(rawdata, i + 3)
         elif sectName.lower() in {"if", "else", "endif"}:
             # look for MS Office ]> ending
-            match = _msmarkedsectionclose.search(rawdata, i + 3)
+            match = self._patterns.msmarkedsectionclose.search(rawdata, i + 3)
         else:
             raise AssertionError(
                 "unknown status keyword %r in marked section" % rawdata[i + 3 : j]
@@ -1213,87 +2294,88 @@ class Htp(_markupbase.ParserBase):
             return -1
         if report:
             j = match.start(0)
-            self.__element_text = rawdata[i : match.end(0)]
+            self.__element_start, self.__element_end = i, match.end(0)
             self.unknown_decl(rawdata[i + 3 : j])
         return match.end(0)
 
     # Internal -- parse comment <!-- -->, return length or -1 if not terminated
     def parse_comment(self, i, report=1):
-        self.__element_text = None
+        self.__element_start = None
         rawdata = self.rawdata
         if rawdata[i : i + 4] != "<!--":
             raise AssertionError("unexpected call to parse_comment()")
-        match = _commentclose.search(rawdata, i + 4)
+        match = self._patterns.commentclose.search(rawdata, i + 4)
         if not match:
             return -1
-        if report:
+        if report and self._comments_handled:
             j = match.start(0)
-            self.__element_text = rawdata[i : match.end()]
+            self.__element_start, self.__element_end = i, match.end()
             self.handle_comment(rawdata[i + 4 : j])
 
         return match.end(0)
 
     # Internal -- parse comment {# #}, return length or -1 if not terminated
-    def parse_comment_curly_hash(self, i, report=1):
-        self.__element_text = None
+    def parse_comment_curly_hash(self, i, match=None, report=1):
+        self.__element_start = None
         rawdata = self.rawdata
         if rawdata[i : i + 2] != "{#":
             raise AssertionError("unexpected call to parse_comment_curly_hash()")
-        match = _commentclosecurlyhash.search(rawdata, i + 2)
-        if not match:
+        match = match or self._patterns.find_comment_curly_hash.match(rawdata, i)
+        if not match or match.group("comment_curly_hash_data") is None:
             return -1
         if report:
-            j = match.start(0)
-            self.__element_text = rawdata[i : match.end()]
-            self.handle_comment_curly_hash(rawdata[i + 2 : j])
-        return match.end(0)
+            self.__element_start, self.__element_end = i, match.end()
+            self.handle_comment_curly_hash(match.group("comment_curly_hash_data"))
+        return match.end()
 
     # Internal -- parse comment {{! }} or {{!-- }}, return length or -1 if not terminated
-    def parse_comment_curly_two_exlaim(self, i):
-        self.__element_text = None
+    def parse_comment_curly_two_exlaim(self, i, match=None):
+        self.__element_start = None
         rawdata = self.rawdata
         if rawdata[i : i + 3] != "{{!":
             raise AssertionError("unexpected call to parse_comment_curly_two_exlaim()")
-        match = find_curly_two_exclaim.search(rawdata, i)
-
-        if not match:
+        match = match or self._patterns.find_curly_two_exclaim.match(rawdata, i)
+        if not match or match.group("comment_curly_two_exlaim_data") is None:
             return -1
 
         tag_text = match.group()
-        props = []
+        flags = 0
         if tag_text.startswith("{{!--"):
-            props.append("safe-left")
+            flags |= _SAFE_LEFT
 
         if tag_text.endswith("--}}"):
-            props.append("safe-right")
+            flags |= _SAFE_RIGHT
 
         if tag_text.startswith("{{~"):
-            props.append("spaceless-left-tilde")
+            flags |= _SPACELESS_LEFT_TILDE
 
         if tag_text.endswith("~}}"):
-            props.append("spaceless-right-tilde")
+            flags |= _SPACELESS_RIGHT_TILDE
+
+        props = self._props(flags)
 
         j = match.end()
 
-        self.__element_text = rawdata[i:j]
+        self.__element_start, self.__element_end = i, j
 
-        self.handle_comment_curly_two_exlaim(match.group(1), props)
+        self.handle_comment_curly_two_exlaim(
+            match.group("comment_curly_two_exlaim_data"), props
+        )
         return j
 
     # Internal -- parse comment @* *@ , return length or -1 if not terminated
-    def parse_comment_at_star(self, i, report=1):
-        self.__element_text = None
+    def parse_comment_at_star(self, i, match=None, report=1):
+        self.__element_start = None
         rawdata = self.rawdata
         if rawdata[i : i + 2] != "@*":
             raise AssertionError("unexpected call to parse_comment_at_star()")
-        match = _commentcloseatstar.search(rawdata, i + 2)
-        if not match:
+        match = match or self._patterns.find_comment_at_star.match(rawdata, i)
+        if not match or match.group("comment_at_star_data") is None:
             return -1
         if report:
-            j = match.start(0)
-            self.handle_comment_at_star(rawdata[i + 2 : j])
-            self.__element_text = rawdata[i : match.end()]
-        return match.end(0)
+            self.__element_start, self.__element_end = i, match.end()
+            self.handle_comment_at_star(match.group("comment_at_star_data"))
+        return match.end()
 
     # Internal -- scan past the internal subset in a <!DOCTYPE declaration,
     # returning the index just past any whitespace following the trailing ']'.
@@ -1373,8 +2455,9 @@ class Htp(_markupbase.ParserBase):
             return -1
         # style content model; just skip until '>'
         rawdata = self.rawdata
-        if ">" in rawdata[j:]:
-            return rawdata.find(">", j) + 1
+        k = rawdata.find(">", j)
+        if k >= 0:
+            return k + 1
         return -1
 
     # Internal -- scan past <!ATTLIST declarations
@@ -1397,13 +2480,13 @@ class Htp(_markupbase.ParserBase):
                 return -1
             if c == "(":
                 # an enumerated type; look for ')'
-                if ")" in rawdata[j:]:
-                    j = rawdata.find(")", j) + 1
-                else:
+                k = rawdata.find(")", j)
+                if k < 0:
                     return -1
+                j = k + 1
                 while rawdata[j : j + 1].isspace():
                     j = j + 1
-                if not rawdata[j:]:
+                if j >= len(rawdata):
                     # end of buffer, incomplete
                     return -1
             else:
@@ -1412,7 +2495,7 @@ class Htp(_markupbase.ParserBase):
             if not c:
                 return -1
             if c in "'\"":
-                m = _declstringlit_match(rawdata, j)
+                m = self._patterns.declstringlit.match(rawdata, j)
                 if m:
                     j = m.end()
                 else:
@@ -1421,7 +2504,7 @@ class Htp(_markupbase.ParserBase):
                 if not c:
                     return -1
             if c == "#":
-                if rawdata[j:] == "#":
+                if j + 1 == len(rawdata):
                     # end of buffer
                     return -1
                 name, j = self._scan_name(j + 1, declstartpos)
@@ -1448,7 +2531,7 @@ class Htp(_markupbase.ParserBase):
             if c == ">":
                 return j + 1
             if c in "'\"":
-                m = _declstringlit_match(rawdata, j)
+                m = self._patterns.declstringlit.match(rawdata, j)
                 if not m:
                     return -1
                 j = m.end()
@@ -1480,7 +2563,7 @@ class Htp(_markupbase.ParserBase):
             if not c:
                 return -1
             if c in "'\"":
-                m = _declstringlit_match(rawdata, j)
+                m = self._patterns.declstringlit.match(rawdata, j)
                 if m:
                     j = m.end()
                 else:
@@ -1499,10 +2582,10 @@ class Htp(_markupbase.ParserBase):
         n = len(rawdata)
         if i == n:
             return None, -1
-        m = _declname_match(rawdata, i)
+        m = self._patterns.declname.match(rawdata, i)
         if m:
             s = m.group()
-            name = s.strip()
+            name = s.strip(self._whitespace)
             if (i + len(s)) == n:
                 return None, -1  # end of buffer
             return name, m.end()
@@ -1577,6 +2660,12 @@ class Htp(_markupbase.ParserBase):
         # handlebars un-escaped html
         pass
 
+    def handle_delimiter(self, name, tag, attrs, props):
+        # a tag of the Delimiter name, passed on to its handler
+        handler = getattr(self, self._patterns.delimiters[name].handler, None)
+        if handler is not None:
+            handler(tag, attrs, props)
+
     def handle_comment(self, data):
         # comment <!-- -->
         pass
@@ -1608,3 +2697,135 @@ class Htp(_markupbase.ParserBase):
     def handle_pi(self, data):
         # handle processing instruction
         pass
+
+
+# handlers that are passed text of the input, except handle_data, which is
+# passed its text by _report_data
+_text_handlers = tuple(
+    name for name in vars(Htp) if name.startswith("handle_") and name != "handle_data"
+) + ("unknown_decl",)
+
+# the handlers that _TokenCollector turns into tokens
+_token_handlers = _text_handlers + ("handle_data",)
+
+# a whole document, rather than an iterable of chunks
+_documents = (str, bytes, bytearray, memoryview, mmap.mmap)
+
+
+class _TokenList(list):
+    # token sink of iter_tokens()
+    def add(self, kind, tag, attrs, props, start, end):
+        # pylint: disable=R0917
+        if props is not None:
+            props = tuple(props)
+        self.append(Token(kind, tag, attrs, props, start, end))
+
+
+class _TokenCollector:
+    """Mixin for Htp that passes its events to a token sink."""
+
+    # the tokens go to the sink, not to handle_tokens() of the parser class
+    handle_tokens = None
+    # tokens get props as the cached tuples of their names
+    _token_props = True
+    # provided by Htp, which follows the mixin in the bases
+    get_element_span: Callable[[], Optional[Tuple[int, int]]]
+
+    def __init__(self, sink, *, convert_charrefs=True, encoding=None, **options):
+        self.token_sink = sink
+        super().__init__(
+            convert_charrefs=convert_charrefs,
+            streaming=True,
+            track_positions=False,
+            encoding=encoding,
+            **options,
+        )
+
+    def _add_token(self, kind, tag, attrs=None, props=None):
+        start, end = self.get_element_span()
+        self.token_sink.add(kind, tag, attrs, props, start, end)
+
+    def unknown_decl(self, data):
+        self._add_token(TokenKind.UNKNOWN_DECL, data)
+
+    def handle_startendtag(self, tag, attrs, props):
+        self._add_token(TokenKind.STARTENDTAG, tag, attrs, props)
+
+    def handle_starttag(self, tag, attrs, props):
+        self._add_token(TokenKind.STARTTAG, tag, attrs, props)
+
+    def handle_endtag(self, tag):
+        self._add_token(TokenKind.ENDTAG, tag)
+
+    def handle_starttag_curly_perc(self, tag, attrs, props):
+        self._add_token(TokenKind.STARTTAG_CURLY_PERC, tag, attrs, props)
+
+    def handle_endtag_curly_perc(self, tag, attrs, props):
+        self._add_token(TokenKind.ENDTAG_CURLY_PERC, tag, attrs, props)
+
+    def handle_starttag_curly_two_hash(self, tag, attrs, props):
+        self._add_token(TokenKind.STARTTAG_CURLY_TWO_HASH, tag, attrs, props)
+
+    def handle_endtag_curly_two_slash(self, tag, props):
+        self._add_token(TokenKind.ENDTAG_CURLY_TWO_SLASH, tag, props=props)
+
+    def handle_starttag_curly_four(self, tag, attrs, props):
+        self._add_token(TokenKind.STARTTAG_CURLY_FOUR, tag, attrs, props)
+
+    def handle_endtag_curly_four_slash(self, tag, attrs, props):
+        self._add_token(TokenKind.ENDTAG_CURLY_FOUR_SLASH, tag, attrs, props)
+
+    def handle_charref(self, name):
+        self._add_token(TokenKind.CHARREF, name)
+
+    def handle_entityref(self, name):
+        self._add_token(TokenKind.ENTITYREF, name)
+
+    def handle_data(self, data):
+        self._add_token(TokenKind.DATA, data)
+
+    def handle_curly_two(self, data, attrs, props):
+        self._add_token(TokenKind.CURLY_TWO, data, attrs, props)
+
+    def handle_slash_curly_two(self, data, attrs):
+        self._add_token(TokenKind.SLASH_CURLY_TWO, data, attrs)
+
+    def handle_curly_three(self, data):
+        self._add_token(TokenKind.CURLY_THREE, data)
+
+    def handle_delimiter(self, name, tag, attrs, props):
+        self._add_token(TokenKind.DELIMITER, tag, attrs, [name] + props)
+
+    def handle_comment(self, data):
+        self._add_token(TokenKind.COMMENT, data)
+
+    def handle_comment_curly_hash(self, data):
+        self._add_token(TokenKind.COMMENT_CURLY_HASH, data)
+
+    def handle_starttag_comment_curly_perc(self, data, attrs, props):
+        self._add_token(TokenKind.STARTTAG_COMMENT_CURLY_PERC, data, attrs, props)
+
+    def handle_endtag_comment_curly_perc(self, data, props):
+        self._add_token(TokenKind.ENDTAG_COMMENT_CURLY_PERC, data, props=props)
+
+    def handle_comment_curly_two_exlaim(self, data, props):
+        self._add_token(TokenKind.COMMENT_CURLY_TWO_EXLAIM, data, props=props)
+
+    def handle_comment_at_star(self, data):
+        self._add_token(TokenKind.COMMENT_AT_STAR, data)
+
+    def handle_decl(self, decl):
+        self._add_token(TokenKind.DECL, decl)
+
+    def handle_pi(self, data):
+        self._add_token(TokenKind.PI, data)
+
+
+@lru_cache(maxsize=None)
+def _token_parser(cls):
+    # a parser class with the parsing rules of cls and the token handlers
+    class TokenParser(_TokenCollector, cls):
+        """Parser of iter_tokens() and collect()."""
+
+    TokenParser.__name__ = TokenParser.__qualname__ = cls.__name__
+    return TokenParser
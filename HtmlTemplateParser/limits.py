@@ -0,0 +1,130 @@
+"""Budgets that stop a parse taking too long, and limits on its input.
+
+parser = Htp(max_steps=100000, deadline=time.monotonic() + 0.05)
+parser = Htp(max_token_length=65536, max_tokens=100000, max_depth=64)
+"""
+import sys
+import time
+
+# steps between two looks at the clock
+CLOCK_INTERVAL = 64
+
+# template tags that open a block closed by "end" + tag, counted for
+# max_depth. Handlebars blocks {{#x}} and {{{{x}}}} always count.
+BLOCK_TAGS = frozenset(
+    (
+        "apply",
+        "autoescape",
+        "block",
+        "blocktrans",
+        "blocktranslate",
+        "call",
+        "capture",
+        "case",
+        "comment",
+        "embed",
+        "filter",
+        "for",
+        "if",
+        "ifchanged",
+        "ifequal",
+        "ifnotequal",
+        "macro",
+        "raw",
+        "spaceless",
+        "tablerow",
+        "trans",
+        "unless",
+        "verbatim",
+        "while",
+        "with",
+    )
+)
+
+
+class BudgetExceeded(Exception):  # noqa: N818
+    """The deadline or the step budget of a parse ran out.
+
+    Parsing stops before the element at offset, an offset in the input as
+    in get_element_span(); everything before it was handled. reason is
+    "max_steps" or "deadline".
+
+    events are the tokens emitted before, as far as the parser keeps
+    them: the sink of Htp.collect(). Htp.iter_tokens() yields its tokens
+    before raising, and handlers have been called for theirs, so events
+    is None for those.
+    """
+
+    def __init__(self, reason, offset, events=None):
+        super().__init__(reason, offset, events)
+        self.reason = reason
+        self.offset = offset
+        self.events = events
+
+    def __str__(self):
+        return "%s ran out at offset %d" % (self.reason, self.offset)
+
+
+class LimitExceeded(ValueError):
+    """The input is over one of the limits of the parser.
+
+    limit is the name of the option, such as "max_token_length", and value
+    its value. offset is the offset in the input, as in
+    get_element_span(), of the element that is over it; getpos(offset)
+    gives its line and column. The parser has to be reset after this.
+    """
+
+    def __init__(self, limit, value, offset):
+        super().__init__(limit, value, offset)
+        self.limit = limit
+        self.value = value
+        self.offset = offset
+
+    def __str__(self):
+        return "%s of %d exceeded at offset %d" % (self.limit, self.value, self.offset)
+
+
+def next_check(steps, max_steps, deadline, max_tokens=None):
+    """Return the step count after which the budget is checked next."""
+    check = sys.maxsize
+    if max_steps is not None:
+        check = max_steps
+    if max_tokens is not None:
+        check = min(check, max_tokens)
+    if deadline is not None:
+        check = min(check, steps + CLOCK_INTERVAL)
+    return check
+
+
+def check_budget(steps, max_steps, deadline, offset, max_tokens=None):
+    """Raise BudgetExceeded if step number steps is over the budget.
+
+    LimitExceeded is raised if it is over max_tokens, as a step handles
+    one element. Otherwise return the step count after which to check
+    again.
+    """
+    if max_tokens is not None and steps > max_tokens:
+        raise LimitExceeded("max_tokens", max_tokens, offset)
+    if max_steps is not None and steps > max_steps:
+        raise BudgetExceeded("max_steps", offset)
+    if deadline is not None and time.monotonic() >= deadline:
+        raise BudgetExceeded("deadline", offset)
+    return next_check(steps, max_steps, deadline, max_tokens)
+
+
+def check_length(limit, value, start, end):
+    """Raise LimitExceeded if the text from start to end is over value."""
+    if value is not None and end - start > value:
+        raise LimitExceeded(limit, value, start)
+
+
+def count_block(depth, step, max_depth, offset):
+    """Return depth after a block opens (step 1) or closes (step -1) at offset.
+
+    Raise LimitExceeded if it is over max_depth. An end without a start
+    is ignored.
+    """
+    depth = max(depth + step, 0)
+    if depth > max_depth:
+        raise LimitExceeded("max_depth", max_depth, offset)
+    return depth
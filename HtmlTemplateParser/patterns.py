@@ -0,0 +1,42 @@
+r"""Building blocks for the template patterns, and searches for their ends.
+
+Template tags are scanned with runs like (?:(?!%}).)* that stop at the
+closing delimiter. When a tag is not closed, re backtracks into every run
+of the failed match, which takes exponential time where two runs can take
+the same characters. A run built with run() is never backtracked into.
+
+An item must match in at most one way at any position, like
+(?!%})[\s\S], so that the run only ever stops where the plain * would.
+"""
+import sys
+
+if sys.version_info >= (3, 11):
+
+    def run(item):
+        """Return a pattern for the longest run of item, as a possessive *."""
+        return "(?:%s)*+" % item
+
+else:
+
+    def run(item):
+        """Return a pattern for the longest run of item.
+
+        A shorter run is followed by another item, so the lookahead fails
+        as soon as a failed match backtracks into the run.
+        """
+        return "(?:%s)*(?!%s)" % (item, item)
+
+
+def find(data, sub, start, found):
+    """Return data.find(sub, start), reusing the last search for sub.
+
+    found maps sub to the start and result of its last search in data. An
+    unterminated tag is retried at every later opening of its kind, and
+    with found these searches at rising offsets scan data once.
+    """
+    last = found.get(sub)
+    if last is not None and last[0] <= start and (last[1] < 0 or start <= last[1]):
+        return last[1]
+    pos = data.find(sub, start)
+    found[sub] = (start, pos)
+    return pos
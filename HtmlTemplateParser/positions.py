@@ -0,0 +1,78 @@
+"""Line index for parser positions.
+
+index = LineIndex("utf-16")
+index.add(text, 0)
+index.getpos(offset)
+
+Offsets passed in are code point offsets into the text. Columns and
+converted offsets are in the unit of the index: "codepoint", "utf-16"
+(code units) or "utf-8" (bytes).
+"""
+import re
+from bisect import bisect_right
+
+line_end = re.compile("\n")
+
+# runs of characters that take more than one unit. The number of the
+# matching group is the number of extra units each character takes.
+wide_chars = {
+    "codepoint": None,
+    "utf-16": re.compile(r"([\U00010000-\U0010ffff]+)"),
+    "utf-8": re.compile(
+        r"([\x80-\u07ff]+)|([\u0800-\uffff]+)|([\U00010000-\U0010ffff]+)"
+    ),
+}
+
+
+class LineIndex:
+    """Line starts and wide character runs of a text that is added in order.
+
+    Both are recorded once when text is added, so a lookup is a bisect and
+    does not scan the text again.
+    """
+
+    def __init__(self, unit="codepoint"):
+        if unit not in wide_chars:
+            raise ValueError("unknown position unit %r" % unit)
+        self.unit = unit
+        self.line_starts = [0]
+        self._wide_chars = wide_chars[unit]
+        self._run_starts = []
+        self._run_ends = []
+        self._run_widths = []
+        # extra units before each run
+        self._run_extra = []
+        self._extra = 0
+
+    def add(self, data, start):
+        """Index data, which begins at offset start of the text."""
+        self.line_starts.extend(
+            [start + match.end() for match in line_end.finditer(data)]
+        )
+        if self._wide_chars is None:
+            return
+        for match in self._wide_chars.finditer(data):
+            width = match.lastindex
+            self._run_starts.append(start + match.start())
+            self._run_ends.append(start + match.end())
+            self._run_widths.append(width)
+            self._run_extra.append(self._extra)
+            self._extra += width * (match.end() - match.start())
+
+    def unit_offset(self, offset):
+        """Return a code point offset converted to the unit of the index."""
+        run = bisect_right(self._run_starts, offset) - 1
+        if run < 0:
+            return offset
+        run_start = self._run_starts[run]
+        wide = min(offset, self._run_ends[run]) - run_start
+        return offset + self._run_extra[run] + wide * self._run_widths[run]
+
+    def getpos(self, offset):
+        """Return the line number and column of a code point offset."""
+        line_starts = self.line_starts
+        lineno = bisect_right(line_starts, offset)
+        line_start = line_starts[lineno - 1]
+        if self._wide_chars is None:
+            return lineno, offset - line_start
+        return lineno, self.unit_offset(offset) - self.unit_offset(line_start)
@@ -0,0 +1,125 @@
+"""Tokens produced by Htp.iter_tokens(), and the props of template tags.
+
+Token(kind, tag, attrs, props, start, end)
+"""
+from enum import IntEnum, IntFlag
+from functools import lru_cache
+
+
+class TokenKind(IntEnum):
+    """Kind of a token, one for each handle_* method of Htp.
+
+    The lower case name of a kind is the handler name without "handle_".
+    """
+
+    DATA = 0
+    CHARREF = 1
+    ENTITYREF = 2
+    STARTTAG = 3
+    STARTENDTAG = 4
+    ENDTAG = 5
+    STARTTAG_CURLY_PERC = 6
+    ENDTAG_CURLY_PERC = 7
+    STARTTAG_CURLY_TWO_HASH = 8
+    ENDTAG_CURLY_TWO_SLASH = 9
+    STARTTAG_CURLY_FOUR = 10
+    ENDTAG_CURLY_FOUR_SLASH = 11
+    CURLY_TWO = 12
+    SLASH_CURLY_TWO = 13
+    CURLY_THREE = 14
+    COMMENT = 15
+    COMMENT_CURLY_HASH = 16
+    STARTTAG_COMMENT_CURLY_PERC = 17
+    ENDTAG_COMMENT_CURLY_PERC = 18
+    COMMENT_CURLY_TWO_EXLAIM = 19
+    COMMENT_AT_STAR = 20
+    DECL = 21
+    PI = 22
+    UNKNOWN_DECL = 23
+    DELIMITER = 24
+
+
+class Props(IntFlag):
+    """Modifiers of a tag, such as the "-" of "{%- if %}".
+
+    Handlers of a parser with PROP_FLAGS get props as a Props value.
+    Others get the list of names(), the lower case names of the flags
+    with "-" for "_", in the order of the flags.
+    """
+
+    SAFE_LEFT = 1
+    SAFE_RIGHT = 2
+    SPACELESS_LEFT_TILDE = 4
+    PARTIAL = 8
+    SPACELESS_RIGHT_TILDE = 16
+    SPACELESS_LEFT_DASH = 32
+    SPACELESS_RIGHT_DASH = 64
+    SPACELESS_LEFT_PLUS = 128
+    SPACELESS_RIGHT_PLUS = 256
+    IS_SELFCLOSING = 512
+
+    def names(self):
+        """Return the props as a list of strings, such as ["partial"]."""
+        return list(prop_names(self))
+
+
+@lru_cache(maxsize=None)
+def prop_names(flags):
+    """Return the tuple of the names of the Props in flags, an int."""
+    return tuple(prop.name.lower().replace("_", "-") for prop in Props if flags & prop)
+
+
+class Token:
+    """A single parsed element.
+
+    tag is the first argument the handler would get, attrs and props are
+    None when the handler has no such argument. props is a tuple; that of
+    a DELIMITER token starts with the name of its Delimiter. start and end
+    are the offsets of the element text in the whole input; the length is
+    stored instead of end, as it is usually a cached small int.
+
+    Iterating a token gives (kind, tag, attrs, props, (start, end)).
+    """
+
+    __slots__ = ("kind", "tag", "attrs", "props", "start", "length")
+
+    def __init__(self, kind, tag, attrs=None, props=None, start=0, end=0):
+        # pylint: disable=R0913,R0917
+        self.kind = kind
+        self.tag = tag
+        self.attrs = attrs
+        self.props = props
+        self.start = start
+        self.length = end - start
+
+    @property
+    def end(self):
+        return self.start + self.length
+
+    @property
+    def span(self):
+        return self.start, self.end
+
+    def _astuple(self):
+        return self.kind, self.tag, self.attrs, self.props, self.start, self.length
+
+    def __iter__(self):
+        return iter((self.kind, self.tag, self.attrs, self.props, self.span))
+
+    def __eq__(self, other):
+        if not isinstance(other, Token):
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    def __hash__(self):
+        return hash(self._astuple())
+
+    def __repr__(self):
+        return "Token(%s, %r, %r, %r, %d, %d)" % (
+            self.kind.name,
+            self.tag,
+            self.attrs,
+            self.props,
+            self.start,
+            self.end,
+        )
@@ -1,7 +1,9 @@
 """Tests for AttributeParser."""
 # pylint: disable=C0115
 
+import os
 import pprint
+import tempfile
 import unittest
 
 from HtmlTemplateParser import AttributeParser
@@ -540,3 +542,60 @@ class AttributeCaseBase(TestCaseBase):
                 ("name", "}", []),
             ],
         )
+
+    def test_element_span(self):
+        source = 'class="a {{ b }}" {% if c %}'
+        spans = []
+
+        class SpanCollector(AttributeParser):
+            def handle_curly_two(self, tag, attrs, props):
+                spans.append((self.get_element_span(), self.get_element_text()))
+
+            handle_starttag_curly_perc = handle_curly_two
+
+        SpanCollector().feed(source)
+        self.assertEqual(
+            spans, [((9, 16), "{{ b }}"), ((18, len(source)), "{% if c %}")]
+        )
+
+    def test_getpos(self):
+        positions = []
+
+        class PositionCollector(AttributeParser):
+            def handle_curly_two(self, tag, attrs, props):
+                positions.append(self.getpos())
+
+        parser = PositionCollector()
+        parser.feed('class="a\n  {{ b }}"\n{{ c }}')
+        self.assertEqual(positions, [(2, 2), (3, 0)])
+        self.assertEqual(parser.getpos(9), (2, 0))
+
+    def test_position_units(self):
+        positions = []
+
+        class PositionCollector(AttributeParser):
+            def handle_curly_two(self, tag, attrs, props):
+                positions.append((self.getpos(), self.getoffset()))
+
+        for unit in ("codepoint", "utf-16", "utf-8"):
+            PositionCollector(position_unit=unit).feed('title="\U0001f600é" {{ b }}')
+        self.assertEqual(positions, [((1, 11), 11), ((1, 12), 12), ((1, 15), 15)])
+
+    def test_parse_file(self):
+        source = 'title="café" {{ b }}\r\n{% if c %}'
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "attributes.txt")
+            with open(path, "wb") as file:
+                file.write(source.encode())
+            parser = self.get_collector()
+            parser.parse_file(path)
+            expected = self.get_collector()
+            expected.feed(source)
+            self.assertEqual(parser.get_events(), expected.get_events())
+            self.assertNotEqual(expected.get_events(), [])
+
+            with open(path, "wb"):
+                pass
+            parser = self.get_collector()
+            parser.parse_file(path)
+            self.assertEqual(parser.get_events(), [])
@@ -0,0 +1,370 @@
+"""Performance regression tests for Htp and AttributeParser.
+
+The parser is timed on a small document and on the same document
+repeated GROWTH times. A linear tokenizer slows down by about GROWTH;
+the checks leave headroom for noisy machines but still catch a scan
+that copies the remaining buffer on every token.
+
+Memory tests compare the size of collected tokens, as measured by
+tracemalloc.
+
+Timings depend on the load of the machine, so the timed tests only run
+when HTP_BENCH is set:
+
+    HTP_BENCH=1 python -m pytest tests/test_benchmark.py
+"""
+# pylint: disable=C0115
+
+import gc
+import os
+import time
+import tracemalloc
+import unittest
+
+from HtmlTemplateParser import AttributeParser, Delimiter, EventBuffer, Htp
+
+TEMPLATE_UNIT = (
+    '<div class="a {{ b }}">{% if x %}text &amp; more {x} {{ y|z }}'
+    "{%- endif %}</div>{# c #}@* d *@\\{{ e }}{{#each f}}{{/each}}\n"
+)
+
+# inline scripts and styles switch the scanner to cdata mode and back
+SCRIPT_UNIT = "<p>a</p><script>if (a < b) x = '</p>';</script><style>p {}</style>\n"
+
+# markup of one template language, with text that another one would scan
+DIALECT_UNITS = {
+    "jinja": '<a href="{{ x.url }}">{% if x %}{{ x.name }}{% endif %}</a>{# c #}\n',
+    "handlebars": "<li>{{#each a}}{{ b }} {{{ c }}}{{/each}}{{! d }}</li>\n",
+    "razor": '<div class="@Model.Css">@Model.Name {x}</div>@* c *@\n',
+    "html": '<p class="a">text { not a template } user@example.com &amp;</p>\n',
+}
+
+ATTRIBUTE_UNIT = 'class="a {{ b }}" id=x {% if y %}data-z="1"{% endif %} '
+
+# (head, unit) of unterminated tags, which a backtracking pattern scans in
+# exponential time
+UNTERMINATED = (
+    ("<div ", "a "),
+    ("<div {% ", "b "),
+    ("<div a={{ ", "b "),
+    ("<v ", "{{"),
+    ("<v ", "{% "),
+    ("<v ", "\\{{ "),
+    ("<v {{", " "),
+    ("{% if ", "x "),
+    ("{% if", " "),
+    ("{% endif ", "x "),
+    ("{% endif", " "),
+    ("{{ x ", "y "),
+    ("{{ x", " "),
+    ("{{", " "),
+    ("{{#x ", "y "),
+    ("{{/x ", "y "),
+    ("{{{{x ", "y "),
+    ("{{{{/x ", "y "),
+    ("\\{{ x ", "y "),
+    ("{{! x ", "y "),
+)
+
+# the input is grown by this factor between the two timed runs
+GROWTH = 8
+
+# allowed growth in run time, relative to a perfectly linear scan
+MAX_SLOWDOWN = 1.5
+
+# marks a timed test, which is skipped unless HTP_BENCH is set
+benchmark = unittest.skipUnless(
+    os.environ.get("HTP_BENCH"), "timed benchmark, set HTP_BENCH=1 to run it"
+)
+
+
+def best_time(func, data, repeat=5):
+    """Return the fastest of several runs of func(data)."""
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(data)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def speedup(baseline, candidate, data, repeat=7):
+    """Return how many times faster candidate(data) runs than baseline(data).
+
+    Runs are interleaved so both functions see the same machine load.
+    """
+    best_baseline = best_candidate = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            baseline(data)
+            best_baseline = min(best_baseline, time.perf_counter() - start)
+            start = time.perf_counter()
+            candidate(data)
+            best_candidate = min(best_candidate, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best_baseline / best_candidate
+
+
+def traced_size(func, data):
+    """Return the memory still allocated after running func(data)."""
+    tracemalloc.start()
+    try:
+        # the result is kept alive while the memory is read
+        result = func(data)
+        size = tracemalloc.get_traced_memory()[0]
+        del result
+        return size
+    finally:
+        tracemalloc.stop()
+
+
+def parse_htp(data):
+    parser = Htp()
+    parser.feed(data)
+    parser.close()
+
+
+def parse_htp_untracked(data):
+    parser = Htp(track_positions=False)
+    parser.feed(data)
+    parser.close()
+
+
+def parse_htp_dialect(dialect):
+    def parse(data):
+        parser = Htp(dialects=dialect if dialect == "auto" else {dialect})
+        parser.feed(data)
+        parser.close()
+
+    return parse
+
+
+SQUARE = Delimiter("square", "[[", "]]", {"-": "trim-%s"})
+
+
+def parse_htp_square(data):
+    parser = Htp(delimiters=[SQUARE])
+    parser.feed(data)
+    parser.close()
+
+
+class TemplateTagParser(Htp):
+    # reads {% %} tags only, as many subclasses read a few kinds of events
+    def handle_starttag_curly_perc(self, tag, attrs, props):
+        pass
+
+
+# the same parser with every other handler overridden as well, so that the
+# arguments of all events are built
+ListeningParser = type(
+    "ListeningParser",
+    (TemplateTagParser,),
+    {
+        name: lambda self, *args: None
+        for name in dir(Htp)
+        if name.startswith("handle_") and name != "handle_starttag_curly_perc"
+    },
+)
+
+
+def parse_with(cls):
+    def parse(data):
+        parser = cls()
+        parser.feed(data)
+        parser.close()
+
+    return parse
+
+
+class BatchParser(Htp):
+    def reset(self):
+        super().reset()
+        self.tokens = []
+
+    def handle_tokens(self, batch):
+        self.tokens.extend(batch)
+
+
+def parse_batches(data):
+    parser = BatchParser()
+    parser.feed(data)
+    parser.close()
+    return parser.tokens
+
+
+def parse_attributes(data):
+    AttributeParser().feed(data)
+
+
+@benchmark
+class LinearScalingTestCase(unittest.TestCase):
+    def _check_linear(self, func, unit, count, head=""):
+        small = best_time(func, head + unit * count)
+        large = best_time(func, head + unit * count * GROWTH)
+
+        self.assertLess(
+            large / small,
+            GROWTH * MAX_SLOWDOWN,
+            "run time grew super-linearly: %.4fs -> %.4fs" % (small, large),
+        )
+
+    def test_htp_linear(self):
+        self._check_linear(parse_htp, TEMPLATE_UNIT, 1000)
+
+    def test_htp_linear_single_line(self):
+        self._check_linear(parse_htp, TEMPLATE_UNIT.replace("\n", " "), 1000)
+
+    def test_htp_linear_scripts(self):
+        self._check_linear(parse_htp, SCRIPT_UNIT, 1000)
+
+    def test_attribute_parser_linear(self):
+        self._check_linear(parse_attributes, ATTRIBUTE_UNIT, 500)
+
+    def test_htp_linear_unterminated(self):
+        for head, unit in UNTERMINATED:
+            with self.subTest(head=head, unit=unit):
+                self._check_linear(parse_htp, unit, 5000, head)
+
+    def test_delimiter_linear_unterminated(self):
+        for head, unit in (("[[- x ", "y "), ("[[", " "), ("[[ x", "]")):
+            with self.subTest(head=head, unit=unit):
+                self._check_linear(parse_htp_square, unit, 5000, head)
+
+    def test_attribute_parser_linear_unterminated(self):
+        for head, unit in UNTERMINATED:
+            with self.subTest(head=head, unit=unit):
+                self._check_linear(parse_attributes, unit, 400, head)
+
+
+@benchmark
+class PositionTrackingTestCase(unittest.TestCase):
+    # positions cost a line index entry per newline, and nothing per token
+    def test_newline_heavy(self):
+        data = (TEMPLATE_UNIT + "text\n" * 20) * 1000
+        gain = speedup(parse_htp, parse_htp_untracked, data)
+        self.assertGreater(gain, 1.0, "no gain without positions: %.3f" % gain)
+
+    def test_newline_light(self):
+        data = TEMPLATE_UNIT.replace("\n", " ") * 1000
+        gain = speedup(parse_htp, parse_htp_untracked, data)
+        self.assertGreater(gain, 0.8, "slower without positions: %.3f" % gain)
+
+
+@benchmark
+class DialectTestCase(unittest.TestCase):
+    # plain html skips the template scanner; a template language saves the
+    # alternatives of the others, which is small next to the handlers
+    def test_html(self):
+        data = DIALECT_UNITS["html"] * 3000
+        gain = speedup(parse_htp, parse_htp_dialect("html"), data)
+        self.assertGreater(gain, 1.3, "no gain for plain html: %.3f" % gain)
+
+    def test_template_dialects(self):
+        for dialect in ("jinja", "handlebars", "razor"):
+            with self.subTest(dialect=dialect):
+                data = DIALECT_UNITS[dialect] * 3000
+                gain = speedup(parse_htp, parse_htp_dialect(dialect), data)
+                self.assertGreater(gain, 0.8, "slower for %s: %.3f" % (dialect, gain))
+
+    # the prescan costs a few substring searches over the input
+    def test_auto(self):
+        data = DIALECT_UNITS["html"] * 3000
+        gain = speedup(parse_htp, parse_htp_dialect("auto"), data)
+        self.assertGreater(gain, 1.3, "no gain for plain html: %.3f" % gain)
+        for dialect in ("jinja", "handlebars", "razor"):
+            with self.subTest(dialect=dialect):
+                data = DIALECT_UNITS[dialect] * 3000
+                auto = parse_htp_dialect("auto")
+                gain = speedup(parse_htp_dialect(dialect), auto, data)
+                self.assertGreater(gain, 0.8, "slower for %s: %.3f" % (dialect, gain))
+
+
+@benchmark
+class DelimiterTestCase(unittest.TestCase):
+    # a delimiter is one more alternative of the scanner, which documents
+    # without its opening character never try
+    def test_unused(self):
+        for dialect in ("jinja", "html"):
+            with self.subTest(dialect=dialect):
+                data = DIALECT_UNITS[dialect] * 3000
+                gain = speedup(parse_htp, parse_htp_square, data)
+                self.assertGreater(gain, 0.8, "slower for %s: %.3f" % (dialect, gain))
+
+
+@benchmark
+class HandledEventsTestCase(unittest.TestCase):
+    # events without an overridden handler are skipped without building
+    # their arguments
+    def test_unhandled_events(self):
+        data = TEMPLATE_UNIT * 2000
+        gain = speedup(parse_with(ListeningParser), parse_with(TemplateTagParser), data)
+        self.assertGreater(gain, 1.1, "no gain for unhandled events: %.3f" % gain)
+
+
+@benchmark
+class BatchedTokensTestCase(unittest.TestCase):
+    # handle_tokens receives the tokens iter_tokens would yield, in lists
+    def test_batches(self):
+        data = TEMPLATE_UNIT * 2000
+        gain = speedup(collect_tokens, parse_batches, data)
+        self.assertGreater(gain, 0.8, "slower in batches: %.3f" % gain)
+
+
+def collect_tokens(data):
+    return list(Htp.iter_tokens(data))
+
+
+def collect_tuples(data):
+    # the same information as a Token, in the tuples event collectors use
+    names = {}
+    return [
+        (
+            names.setdefault(kind, kind.name.lower()),
+            tag,
+            attrs,
+            None if props is None else list(props),
+            span,
+        )
+        for kind, tag, attrs, props, span in Htp.iter_tokens(data)
+    ]
+
+
+def collect_columns(data):
+    buffer = EventBuffer()
+    buffer.parse(data)
+    return buffer
+
+
+class MemoryTestCase(unittest.TestCase):
+    def test_tokens_smaller_than_tuples(self):
+        data = TEMPLATE_UNIT * 1000
+        tokens = traced_size(collect_tokens, data)
+        tuples = traced_size(collect_tuples, data)
+
+        self.assertLess(
+            tokens,
+            tuples * 0.75,
+            "tokens use %d bytes, tuples %d bytes" % (tokens, tuples),
+        )
+
+    def test_event_buffer_smaller_than_tokens(self):
+        data = TEMPLATE_UNIT * 1000
+        columns = traced_size(collect_columns, data)
+        tokens = traced_size(collect_tokens, data)
+
+        self.assertLess(
+            columns,
+            tokens * 0.2,
+            "EventBuffer uses %d bytes, tokens %d bytes" % (columns, tokens),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
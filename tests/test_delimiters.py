@@ -0,0 +1,162 @@
+"""Tests for template tags with custom delimiters."""
+# pylint: disable=C0115
+
+import unittest
+
+from HtmlTemplateParser import Delimiter, EventBuffer, Htp, TokenKind
+
+GO_ACTION = Delimiter("go_action", "{{", "}}", {"-": "spaceless-%s-dash"})
+SQUARE = Delimiter("square", "[[", "]]", {"-": "trim-%s", "--": "strip-%s"})
+
+GO_SOURCE = "<ul>{{- range .Items }}<li>{{ .Name }} {x}</li>{{ end -}}</ul>"
+SQUARE_SOURCE = '<p a="[[ b ]]">[[-- if c -]][x] [[ ]]{% if d %}[[e</p>'
+
+
+def tokens(source, delimiters, **options):
+    return [
+        tuple(token)
+        for token in Htp.iter_tokens(source, delimiters=delimiters, **options)
+    ]
+
+
+class SquareParser(Htp):
+    DELIMITERS = (SQUARE,)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.events = []
+
+    def handle_square(self, tag, attrs, props):
+        self.events.append((tag, attrs, props, self.get_element_span()))
+
+
+class DelimiterTestCase(unittest.TestCase):
+    def test_go(self):
+        self.assertEqual(
+            tokens(GO_SOURCE, [GO_ACTION], dialects={"html"}),
+            [
+                (TokenKind.STARTTAG, "ul", "", (), (0, 4)),
+                (
+                    TokenKind.DELIMITER,
+                    "range",
+                    ".Items",
+                    ("go_action", "spaceless-left-dash"),
+                    (4, 23),
+                ),
+                (TokenKind.STARTTAG, "li", "", (), (23, 27)),
+                (TokenKind.DELIMITER, ".Name", "", ("go_action",), (27, 38)),
+                (TokenKind.DATA, " ", None, None, (38, 39)),
+                (TokenKind.DATA, "{x}", None, None, (39, 42)),
+                (TokenKind.ENDTAG, "li", None, None, (42, 47)),
+                (
+                    TokenKind.DELIMITER,
+                    "end",
+                    "",
+                    ("go_action", "spaceless-right-dash"),
+                    (47, 57),
+                ),
+                (TokenKind.ENDTAG, "ul", None, None, (57, 62)),
+            ],
+        )
+
+    def test_before_builtin(self):
+        # a delimiter is tried before the built-in tags it overlaps with
+        kinds = [kind for kind, *_ in tokens("{{ a }}{{#b}}{% c %}", [GO_ACTION])]
+        self.assertEqual(
+            kinds,
+            [TokenKind.DELIMITER, TokenKind.DELIMITER, TokenKind.STARTTAG_CURLY_PERC],
+        )
+
+    def test_square(self):
+        self.assertEqual(
+            tokens(SQUARE_SOURCE, [SQUARE]),
+            [
+                (TokenKind.STARTTAG, "p", 'a="[[ b ]]"', (), (0, 15)),
+                (
+                    TokenKind.DELIMITER,
+                    "if",
+                    "c",
+                    ("square", "strip-left", "trim-right"),
+                    (15, 28),
+                ),
+                (TokenKind.DATA, "[", None, None, (28, 29)),
+                (TokenKind.DATA, "x] ", None, None, (29, 32)),
+                (TokenKind.DELIMITER, "", "", ("square",), (32, 37)),
+                (TokenKind.STARTTAG_CURLY_PERC, "if", "d", (), (37, 47)),
+                (TokenKind.DATA, "[", None, None, (47, 48)),
+                (TokenKind.DATA, "[", None, None, (48, 49)),
+                (TokenKind.DATA, "e", None, None, (49, 50)),
+                (TokenKind.ENDTAG, "p", None, None, (50, 54)),
+            ],
+        )
+
+    def test_handler(self):
+        parser = SquareParser()
+        parser.feed(SQUARE_SOURCE)
+        parser.close()
+        self.assertEqual(
+            parser.events,
+            [
+                ("if", "c", ["strip-left", "trim-right"], (15, 28)),
+                ("", "", [], (32, 37)),
+            ],
+        )
+
+        parser = SquareParser()
+        parser.feed("[[ ä b ]]".encode())
+        parser.close()
+        self.assertEqual(parser.events, [("ä", "b", [], (0, 10))])
+
+    def test_chunks(self):
+        for delimiters in ([SQUARE], [GO_ACTION], [SQUARE, GO_ACTION]):
+            with self.subTest(delimiters=delimiters):
+                for source in (SQUARE_SOURCE, GO_SOURCE):
+                    self.assertEqual(
+                        tokens(source, delimiters),
+                        tokens(source, delimiters, chunk_size=1),
+                    )
+
+    def test_unterminated(self):
+        # as with the built-in tags, the opening is data one character at a time
+        self.assertEqual(
+            tokens("[[- a", [SQUARE]),
+            [
+                (TokenKind.DATA, "[", None, None, (0, 1)),
+                (TokenKind.DATA, "[", None, None, (1, 2)),
+                (TokenKind.DATA, "- a", None, None, (2, 5)),
+            ],
+        )
+
+    def test_default(self):
+        self.assertEqual(SquareParser().delimiters, (SQUARE,))
+        self.assertEqual(SquareParser(delimiters=()).delimiters, ())
+        self.assertEqual(Htp().delimiters, ())
+
+    def test_event_buffer(self):
+        buffer = EventBuffer()
+        buffer.parse(SQUARE_SOURCE, delimiters=[SQUARE])
+        self.assertEqual(buffer[1].kind, TokenKind.DELIMITER)
+        self.assertEqual(buffer[1].tag, "if")
+
+    def test_invalid(self):
+        for args in (
+            ("a-b", "[[", "]]"),
+            ("square", "", "]]"),
+            ("square", "<%", "%>"),
+        ):
+            with self.subTest(args=args), self.assertRaises(ValueError):
+                Delimiter(*args)
+        for name in ("curly_two", "char"):
+            with self.subTest(name=name), self.assertRaises(ValueError):
+                Htp(delimiters=[Delimiter(name, "[[", "]]")])
+        with self.assertRaises(ValueError):
+            Htp(delimiters=[SQUARE, GO_ACTION, SQUARE])
+
+    def test_equal(self):
+        self.assertEqual(SQUARE, Delimiter("square", "[[", "]]", SQUARE.modifiers))
+        self.assertNotEqual(SQUARE, Delimiter("square", "[[", "]]"))
+        self.assertEqual(len({SQUARE, GO_ACTION, SQUARE}), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
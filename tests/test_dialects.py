@@ -0,0 +1,178 @@
+"""Tests for the dialect profiles of Htp."""
+# pylint: disable=C0115
+
+import unittest
+
+from HtmlTemplateParser import Htp, TokenKind, detect_dialects
+from HtmlTemplateParser.html_template_parser import template_dialects
+
+SOURCE = '<p a="{{ b }}">@* c *@{{#x}}{% if y %}{{ z }}{{/x}}</p>'
+
+FULL_SOURCE = (
+    '<div class="a {{ b }}">{% if x %}text &amp; more {x} {{ y|z }}'
+    "{%- endif %}</div>{# c #}@* d *@\\{{ e }}{{#each f}}{{/each}}"
+    "{{{ g }}}{{! h }}{{{{raw}}}}{{{{/raw}}}}\n"
+)
+
+
+def kinds(source, dialects):
+    return [
+        (token.kind, token.start, token.end)
+        for token in Htp.iter_tokens(source, dialects=dialects)
+    ]
+
+
+class DialectTestCase(unittest.TestCase):
+    def test_jinja(self):
+        self.assertEqual(
+            kinds(SOURCE, {"jinja"}),
+            [
+                (TokenKind.STARTTAG, 0, 15),
+                (TokenKind.DATA, 15, 22),
+                (TokenKind.CURLY_TWO, 22, 28),
+                (TokenKind.STARTTAG_CURLY_PERC, 28, 38),
+                (TokenKind.CURLY_TWO, 38, 45),
+                (TokenKind.CURLY_TWO, 45, 51),
+                (TokenKind.ENDTAG, 51, 55),
+            ],
+        )
+        self.assertEqual(kinds(SOURCE, {"jinja"}), kinds(SOURCE, {"django"}))
+
+    def test_handlebars(self):
+        self.assertEqual(
+            kinds(SOURCE, {"handlebars"}),
+            [
+                (TokenKind.STARTTAG, 0, 15),
+                (TokenKind.DATA, 15, 22),
+                (TokenKind.STARTTAG_CURLY_TWO_HASH, 22, 28),
+                (TokenKind.DATA, 28, 38),
+                (TokenKind.CURLY_TWO, 38, 45),
+                (TokenKind.ENDTAG_CURLY_TWO_SLASH, 45, 51),
+                (TokenKind.ENDTAG, 51, 55),
+            ],
+        )
+        self.assertEqual(kinds(SOURCE, {"handlebars"}), kinds(SOURCE, {"mustache"}))
+
+    def test_razor(self):
+        self.assertEqual(
+            kinds(SOURCE, {"razor"}),
+            [
+                (TokenKind.STARTTAG, 0, 15),
+                (TokenKind.COMMENT_AT_STAR, 15, 22),
+                (TokenKind.DATA, 22, 51),
+                (TokenKind.ENDTAG, 51, 55),
+            ],
+        )
+        self.assertEqual(kinds(SOURCE.encode(), {"razor"}), kinds(SOURCE, {"razor"}))
+
+    def test_html(self):
+        self.assertEqual(
+            kinds(SOURCE, {"html"}),
+            [
+                (TokenKind.STARTTAG, 0, 15),
+                (TokenKind.DATA, 15, 51),
+                (TokenKind.ENDTAG, 51, 55),
+            ],
+        )
+
+    def test_html_scanners(self):
+        # plain html neither builds nor uses the template scanners
+        for source in (FULL_SOURCE, FULL_SOURCE.encode()):
+            with self.subTest(source=type(source)):
+                parser = Htp(dialects={"html"})
+                parser.feed(source)
+                parser.close()
+                patterns = parser._patterns  # pylint: disable=protected-access
+                self.assertIsNone(patterns.template_scanner)
+                self.assertIsNone(patterns.template_openings)
+                self.assertEqual(
+                    {kind for kind, _, _ in kinds(source, {"html"})},
+                    {TokenKind.STARTTAG, TokenKind.DATA, TokenKind.ENDTAG},
+                )
+
+    def test_union(self):
+        self.assertEqual(
+            kinds(SOURCE, {"jinja", "razor"}),
+            [
+                (TokenKind.STARTTAG, 0, 15),
+                (TokenKind.COMMENT_AT_STAR, 15, 22),
+                (TokenKind.CURLY_TWO, 22, 28),
+                (TokenKind.STARTTAG_CURLY_PERC, 28, 38),
+                (TokenKind.CURLY_TWO, 38, 45),
+                (TokenKind.CURLY_TWO, 45, 51),
+                (TokenKind.ENDTAG, 51, 55),
+            ],
+        )
+        # all dialects together scan like the default parser
+        every = set(template_dialects)
+        self.assertEqual(kinds(FULL_SOURCE, every), kinds(FULL_SOURCE, None))
+
+    def test_chunks(self):
+        for dialect in template_dialects:
+            with self.subTest(dialect=dialect):
+                whole = Htp.iter_tokens(FULL_SOURCE, dialects={dialect})
+                chunks = Htp.iter_tokens(FULL_SOURCE, chunk_size=7, dialects={dialect})
+                self.assertEqual(list(whole), list(chunks))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            Htp(dialects={"erb"})
+
+
+class DetectTestCase(unittest.TestCase):
+    def test_detect(self):
+        for source, dialects in (
+            ("<p>a { b } c@d.e \\x</p>", {"html"}),
+            ("{{ a }}{# b #}", {"django"}),
+            ("{{#a}}{{! b }}{{{ c }}}{{~/a}}", {"mustache"}),
+            ("{{{{raw}}}}{{{{/raw}}}}", {"handlebars"}),
+            ("\\{{ a }}", {"handlebars"}),
+            ("@* a *@ b@c", {"razor"}),
+            ("{% if a %}@* b *@{% endif %}", {"django", "razor"}),
+            (b"{{#a}}{{/a}}", {"mustache"}),
+        ):
+            with self.subTest(source=source):
+                self.assertEqual(detect_dialects(source), dialects)
+
+    def test_inner_delimiters(self):
+        # the "{#" of "{{#" is only a delimiter if "{{#" is unterminated
+        self.assertEqual(detect_dialects("{{#a}}b #}"), {"mustache"})
+        self.assertEqual(detect_dialects("{{#a b #}"), {"django"})
+        self.assertEqual(detect_dialects("{{{% a %}}}"), {"mustache"})
+        # and unterminated constructs are text
+        self.assertEqual(detect_dialects("{{ a"), {"html"})
+        self.assertEqual(detect_dialects("{{ a", complete=False), {"django"})
+
+    def test_auto(self):
+        for dialect, source in (
+            ("django", '<p a="{{ b }}">{% if c %}{{ d }}{# e #}{% endif %}</p>'),
+            ("handlebars", "<p>{{{{raw}}}}{{#a}}{{/a}}{{{{/raw}}}}</p>"),
+            ("razor", "<p>@* a *@ {b} c@d</p>"),
+            ("html", "<p>a { b }</p>"),
+        ):
+            with self.subTest(dialect=dialect):
+                parser = Htp(dialects="auto")
+                self.assertEqual(parser.dialects, {"html"})
+                parser.feed(source)
+                parser.close()
+                self.assertEqual(parser.dialects, {dialect})
+                self.assertEqual(kinds(source, "auto"), kinds(source, {dialect}))
+                parser.reset()
+                self.assertEqual(parser.dialects, {"html"})
+
+    def test_auto_widens(self):
+        # delimiters split between two chunks are found
+        parser = Htp(dialects="auto")
+        parser.feed("<p>a {")
+        self.assertEqual(parser.dialects, {"html"})
+        parser.feed("{ b }} @")
+        self.assertEqual(parser.dialects, {"django"})
+        parser.feed("* c *@</p>")
+        parser.close()
+        self.assertEqual(parser.dialects, {"django", "razor"})
+        chunks = [FULL_SOURCE[i : i + 3] for i in range(0, len(FULL_SOURCE), 3)]
+        self.assertEqual(kinds(chunks, "auto"), kinds(chunks, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
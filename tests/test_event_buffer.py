@@ -0,0 +1,60 @@
+"""Tests for EventBuffer."""
+# pylint: disable=C0115
+
+import unittest
+
+from HtmlTemplateParser import EventBuffer, Htp, Token, TokenKind
+
+SOURCE = '<div class="a">{% if x %}text{{ y }}{% endif %}<br/></div>'
+
+
+class EventBufferTestCase(unittest.TestCase):
+    def test_matches_tokens(self):
+        buffer = EventBuffer()
+        buffer.parse(SOURCE)
+        tokens = list(Htp.iter_tokens(SOURCE))
+
+        self.assertEqual(len(buffer), len(tokens))
+        for stored, token in zip(buffer, tokens):
+            self.assertEqual(
+                (stored.kind, stored.start, stored.end),
+                (token.kind, token.start, token.end),
+            )
+            if stored.kind != TokenKind.DATA:
+                self.assertEqual(stored.tag, token.tag)
+        self.assertEqual(buffer[-1], Token(TokenKind.ENDTAG, "div", start=52, end=58))
+
+    def test_data_not_stored(self):
+        buffer = EventBuffer()
+        buffer.parse("<p>text</p>")
+        self.assertEqual(buffer[1], Token(TokenKind.DATA, None, start=3, end=7))
+
+    def test_large_offsets(self):
+        # offsets past 4 GiB, as from a memory-mapped file
+        buffer = EventBuffer()
+        buffer.add(TokenKind.DATA, None, None, None, 2**32, 2**32 + 5)
+        self.assertEqual(buffer[0].span, (2**32, 2**32 + 5))
+
+    def test_documents(self):
+        buffer = EventBuffer()
+        buffer.parse("<p>a</p>")
+        buffer.parse(["<p>", "b", "</p>"])
+
+        self.assertEqual(list(buffer.documents), [0, 3])
+        self.assertEqual(buffer[3].span, (0, 3))
+        self.assertEqual(buffer.tag_names, [None, "p"])
+        self.assertEqual(list(buffer.tag_ids), [1, 0, 1, 1, 0, 1])
+
+    def test_parser_class(self):
+        class Parser(Htp):
+            CDATA_CONTENT_ELEMENTS = ("pre",)
+
+        buffer = EventBuffer()
+        buffer.parse("<pre><b></pre>", Parser)
+        self.assertEqual(
+            list(buffer.kinds), [TokenKind.STARTTAG, TokenKind.DATA, TokenKind.ENDTAG]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,284 @@
+"""Performance cliff fuzzing for Htp and AttributeParser.
+
+Seed templates are read from fuzz_seeds.json. Each mutant of a seed is
+parsed repeated a few times and repeated GROWTH times as often; if the time
+per input byte grows by more than MAX_GROWTH, the mutant is shrunk to a small
+input that still does so and saved to a temporary directory. Reproducers
+copied from there to REPRODUCER_DIR are checked again on every run, so a
+fixed cliff stays fixed. By default they are checked without timing, by
+the characters the searches for closing delimiters scan per input byte,
+which grows with the input where an unterminated construct is searched past
+again and again; under HTP_BENCH they are also timed.
+
+The fuzzing is seeded and offline, but timed, so it only runs when HTP_BENCH
+is set. HTP_FUZZ_ITERATIONS and HTP_FUZZ_SEED give a longer or a different run:
+
+    HTP_BENCH=1 HTP_FUZZ_ITERATIONS=2000 python -m pytest tests/test_fuzz.py
+"""
+# pylint: disable=C0115
+
+import gc
+import glob
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from HtmlTemplateParser import AttributeParser, Htp, patterns
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SEED_FILE = os.path.join(HERE, "fuzz_seeds.json")
+
+REPRODUCER_DIR = os.path.join(HERE, "fuzz_reproducers")
+
+ITERATIONS = int(os.environ.get("HTP_FUZZ_ITERATIONS", "60"))
+
+SEED = int(os.environ.get("HTP_FUZZ_SEED", "0"))
+
+# the repeated input is grown by this factor between the two runs
+GROWTH = 8
+
+# allowed growth of the time per byte; a quadratic scan grows by GROWTH
+MAX_GROWTH = 3
+
+benchmark = unittest.skipUnless(
+    os.environ.get("HTP_BENCH"), "timed fuzzing, set HTP_BENCH=1 to run it"
+)
+
+# pieces inserted by mutations, the delimiters the scanners look for
+DELIMITERS = (
+    "<",
+    ">",
+    "</",
+    "/>",
+    "<!--",
+    "-->",
+    "<!",
+    "<?",
+    "<![CDATA[",
+    "]]>",
+    "{",
+    "}",
+    "{{",
+    "}}",
+    "{{{",
+    "}}}",
+    "{{{{",
+    "}}}}",
+    "{%",
+    "%}",
+    "{%-",
+    "-%}",
+    "{% end",
+    "{#",
+    "#}",
+    "{{!",
+    "{{#",
+    "{{/",
+    "\\{{",
+    "@*",
+    "*@",
+    "&",
+    "&#",
+    "=",
+    "'",
+    '"',
+    "~",
+    " ",
+    "\n",
+    "<script>",
+    "</script>",
+)
+
+
+def seed_templates():
+    """Return the templates of SEED_FILE."""
+    with open(SEED_FILE, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def mutate(rnd, text):
+    """Return text with a few random edits."""
+    for _ in range(rnd.randint(1, 3)):
+        i = rnd.randint(0, len(text))
+        j = min(len(text), i + rnd.randint(1, 8))
+        edit = rnd.randrange(4)
+        if edit == 0:
+            text = text[:i] + text[j:]
+        elif edit == 1:
+            text = text[:i] + rnd.choice(DELIMITERS) + text[i:]
+        elif edit == 2:
+            text = text[:i] + text[i:j] * rnd.randint(2, 4) + text[i:]
+        else:
+            k = rnd.randint(0, len(text))
+            text = text[:i] + text[k : k + j - i] + text[j:]
+    return text
+
+
+def parse_htp(data, **options):
+    parser = Htp(**options)
+    parser.feed(data)
+    parser.close()
+
+
+def parse_attributes(data, **options):
+    AttributeParser(**options).feed(data)
+
+
+# (parser, bytes of the smaller repeated input)
+PARSERS = {
+    "htp": (parse_htp, 2000),
+    "attributes": (parse_attributes, 500),
+}
+
+
+def scanned_per_byte(func, data):
+    """Return the characters searched by find() per byte in func(data)."""
+    scanned = 0
+
+    def counting_find(data, sub, start, found):
+        nonlocal scanned
+        last = found.get(sub)
+        pos = patterns.find(data, sub, start, found)
+        if found.get(sub) is not last:
+            scanned += (pos if pos >= 0 else len(data)) - start
+        return pos
+
+    with mock.patch(
+        "HtmlTemplateParser.html_template_parser.find", counting_find
+    ), mock.patch("HtmlTemplateParser.attribute_parser.find", counting_find):
+        func(data, max_steps=len(data) + 1)
+    return scanned / max(len(data), 1)
+
+
+def time_per_byte(func, data, repeat):
+    """Return the fastest time per byte of several runs of func(data)."""
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(data)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best / max(len(data), 1)
+
+
+def growth(func, unit, size, repeat=1):
+    """Return how much the time per byte grows as unit is repeated more."""
+    count = max(1, size // max(len(unit), 1))
+    small = time_per_byte(func, unit * count, repeat)
+    large = time_per_byte(func, unit * count * GROWTH, repeat)
+    return large / max(small, 1e-9)
+
+
+def is_cliff(func, unit, size):
+    # a single run screens the input, the best of three confirms it
+    try:
+        return (
+            growth(func, unit, size) > MAX_GROWTH
+            and growth(func, unit, size, repeat=3) > MAX_GROWTH
+        )
+    except AssertionError:
+        # malformed declarations are rejected, as in html.parser
+        return False
+
+
+def shrink(func, unit, size):
+    """Return a short part of unit that still grows super-linearly."""
+    chunk = len(unit) // 2
+    while chunk:
+        i = 0
+        while i < len(unit):
+            candidate = unit[:i] + unit[i + chunk :]
+            if candidate and is_cliff(func, candidate, size):
+                unit = candidate
+            else:
+                i += chunk
+        chunk //= 2
+    return unit
+
+
+def save_reproducer(name, unit):
+    """Write unit to a new temporary directory and return the path."""
+    digest = hashlib.sha256(unit.encode("utf-8", "surrogatepass")).hexdigest()[:12]
+    path = os.path.join(
+        tempfile.mkdtemp(prefix="htp-fuzz-"), "%s-%s.txt" % (name, digest)
+    )
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        file.write(unit)
+    return path
+
+
+def saved_reproducers(name):
+    for path in sorted(glob.glob(os.path.join(REPRODUCER_DIR, name + "-*.txt"))):
+        with open(path, encoding="utf-8", newline="") as file:
+            yield path, file.read()
+
+
+@benchmark
+class FuzzTestCase(unittest.TestCase):
+    def _check_cliff(self, name, unit, path=None):
+        func, size = PARSERS[name]
+        if not is_cliff(func, unit, size):
+            return
+        if path is None:
+            unit = shrink(func, unit, size)
+            path = save_reproducer(name, unit)
+        self.fail(
+            "time per byte grows %.1f times as %r is repeated %d times as often"
+            ", reproducer in %s, copy it to %s to keep it"
+            % (growth(func, unit, size, repeat=3), unit, GROWTH, path, REPRODUCER_DIR)
+        )
+
+    def _fuzz(self, name):
+        for path, unit in saved_reproducers(name):
+            with self.subTest(reproducer=path):
+                self._check_cliff(name, unit, path)
+
+        rnd = random.Random(SEED)
+        seeds = seed_templates()
+        for _ in range(ITERATIONS):
+            unit = mutate(rnd, rnd.choice(seeds))
+            with self.subTest(unit=unit):
+                self._check_cliff(name, unit)
+
+    def test_htp(self):
+        self._fuzz("htp")
+
+    def test_attribute_parser(self):
+        self._fuzz("attributes")
+
+
+class ReproducerTestCase(unittest.TestCase):
+    # the saved cliffs, in a step per byte and one to close, and searched
+    # as often per byte as the input grows
+    def test_reproducers(self):
+        for name, (func, size) in PARSERS.items():
+            for path, unit in saved_reproducers(name):
+                with self.subTest(reproducer=path):
+                    count = size // len(unit)
+                    small = scanned_per_byte(func, unit * count)
+                    large = scanned_per_byte(func, unit * count * GROWTH)
+                    self.assertLessEqual(large, max(small, 1) * MAX_GROWTH)
+
+    def test_reproducers_found(self):
+        self.assertTrue(list(saved_reproducers("htp")))
+        self.assertTrue(list(saved_reproducers("attributes")))
+
+
+class SeedTestCase(unittest.TestCase):
+    def test_seeds(self):
+        seeds = seed_templates()
+        self.assertIn("{% for x in range(0,10) %}{% endfor %}", seeds)
+        self.assertTrue(all(isinstance(seed, str) and seed for seed in seeds))
+
+
+if __name__ == "__main__":
+    unittest.main()
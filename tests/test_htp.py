@@ -12,8 +12,9 @@ https://github.com/python/cpython/blob/f4c03484da59049eb62a9bf7777b963e2267d187/
 
 import pprint
 import unittest
+from unittest import mock
 
-from HtmlTemplateParser import Htp
+from HtmlTemplateParser import Htp, LazyData
 
 
 class EventCollector(Htp):
@@ -468,6 +469,43 @@ text
 
         self._run_check(html, expected)
 
+    def test_cdata_content_elements(self):
+        collector = EventCollector(
+            cdata_content_elements=("script", "style", "textarea", "Title")
+        )
+        self._run_check(
+            "<textarea><b>&amp;</b></textarea><title>{{ x }}</title>"
+            "<script>&amp;</script>",
+            [
+                ("starttag", "textarea", "", []),
+                ("data", "<b>&</b>"),
+                ("endtag", "textarea"),
+                ("starttag", "title", "", []),
+                ("data", "{{ x }}"),
+                ("endtag", "title"),
+                ("starttag", "script", "", []),
+                ("data", "&amp;"),
+                ("endtag", "script"),
+            ],
+            collector=collector,
+        )
+        self._run_check(
+            "<textarea><b></b></textarea>",
+            [
+                ("starttag", "textarea", "", []),
+                ("starttag", "b", "", []),
+                ("endtag", "b"),
+                ("endtag", "textarea"),
+            ],
+        )
+
+    def test_cdata_end_reused(self):
+        parser = Htp()
+        parser.feed("<script>")
+        interesting = parser.interesting
+        parser.feed("</script><SCRIPT>")
+        self.assertIs(parser.interesting, interesting)
+
     def test_cdata_with_closing_tags(self):
         # see issue #13358
         # make sure that Htp calls handle_data only once for each CDATA.
@@ -592,6 +630,40 @@ text
         ]
         self._run_check(html, expected)
 
+    def test_curly_tag_from_leading_space(self):
+        # without a tag before the delimiter, the tag is the last character
+        # before it
+        self._run_check("{{ }}", [("curly_two", "", "", [])])
+        self._run_check("{{\n }}", [("curly_two", "", "", [])])
+        self._run_check(
+            "{{~}}",
+            [
+                (
+                    "curly_two",
+                    "~",
+                    "",
+                    ["spaceless-left-tilde", "spaceless-right-tilde"],
+                )
+            ],
+        )
+        self._run_check("{% endif x  %}", [("endtag_curly_perc", "if", "x", [])])
+
+    def test_lone_template_chars(self):
+        self._run_check(
+            "me@example.com \\n",
+            [("data", "me@example.com \\n")],
+        )
+        self._run_check("@", [("data", "@")])
+
+    def test_unterminated_curly_two_exclaim(self):
+        # a broken comment must not swallow text up to a later comment
+        html = "{{! a\n}}{{! b }}"
+        expected = [
+            ("data", "{{! a\n}}"),
+            ("comment_curly_exlaim", " b ", []),
+        ]
+        self._run_check(html, expected)
+
     def test_condcoms(self):
         html = (
             "<!--[if IE & !(lte IE 8)]>aren't<![endif]-->"
@@ -706,6 +778,58 @@ text
         self._run_check("<a$b  >", [("starttag", "a$b", "", [])])
         self._run_check("<a$b  />", [("startendtag", "a$b", "", ["is-selfclosing"])])
 
+    def test_trailing_backslash(self):
+        # a "\" held for a "\{{" in the next feed is reported with the text
+        for source, events in (
+            ("a\\\\", [("data", "a\\\\")]),
+            ("x \\{", [("data", "x \\"), ("data", "{")]),
+        ):
+            parser = EventCollector()
+            parser.feed(source)
+            parser.close()
+            self.assertEqual(parser.events, events)
+
+    def test_unterminated_template_in_starttag(self):
+        # an unclosed template tag in a start tag is not looked for past the
+        # next opening of its kind, so the start tag ends before it
+        self._run_check(
+            '<p a="{{  if y>@* c *@{{#x}}{% if y %}{{ z }}{{/x}}</p>',
+            [
+                ("starttag", "p", 'a="{{  if y', []),
+                ("comment_at_star", " c "),
+                ("starttag_curly_two_hash", "x", "", []),
+                ("starttag_curly_perc", "if", "y", []),
+                ("curly_two", "z", "", []),
+                ("curly_two_slash", "x", []),
+                ("endtag", "p"),
+            ],
+        )
+        self._run_check(
+            '<div class="a"{%->{{{% if x %}text{{ y }}{% endif %}<br/></div>',
+            [
+                ("starttag", "div", 'class="a"{%-', []),
+                ("data", "{{{% if x %}text{{ y }}"),
+                ("endtag_curly_perc", "if", "", []),
+                ("startendtag", "br", "", ["is-selfclosing"]),
+                ("endtag", "div"),
+            ],
+        )
+        self._run_check(
+            '<a b="c"{%<!-->{% if d %}{{ e|f }b',
+            [
+                ("starttag", "a", 'b="c"{%<!--', []),
+                ("starttag_curly_perc", "if", "d", []),
+                ("data", "{{ e|f }b"),
+            ],
+        )
+        self._run_check(
+            "<p title<p t{{!itle=a>{{ b }}",
+            [
+                ("starttag", "p", "title<p t{{!itle=a", []),
+                ("curly_two", "b", "", []),
+            ],
+        )
+
     def test_slashes_in_starttag(self):
         self._run_check(
             '<a foo="var"/>', [("startendtag", "a", 'foo="var"', ["is-selfclosing"])]
@@ -1196,6 +1320,232 @@ text
             ],
         )
 
+    def test_lazy_data(self):
+        collector = EventCollector(lazy_data=True)
+        collector.feed("a &amp; b<p>c</p><script>&amp;</script>")
+        collector.close()
+        data = [event[1] for event in collector.events if event[0] == "data"]
+
+        self.assertTrue(all(isinstance(value, LazyData) for value in data))
+        self.assertEqual([value.raw for value in data], ["a &amp; b", "c", "&amp;"])
+        self.assertEqual([str(value) for value in data], ["a & b", "c", "&amp;"])
+        self.assertEqual(data[0], "a & b")
+
+        collector = EventCollector(convert_charrefs=False, lazy_data=True)
+        collector.feed("a &amp b ")
+        collector.close()
+        self.assertEqual(str(collector.events[0][1]), "a ")
+
+
+class StreamingTestCase(TestCaseBase):
+    # every construct whose delimiters can be split between two feeds
+    source = (
+        "<div class=\"a>b {{ c }}\" id='d'>text &amp; more"
+        "{%- if x -%}{{ y|z }}{%- endif -%}{# c #}{{! d }}"
+        "@* e *@\\{{ f }}{{{ g }}}{{#each h}}{{/each}}"
+        "<!-- i --><br/>{x} me@example.com</div>"
+    )
+
+    def get_collector(self):
+        return EventCollector(convert_charrefs=False, streaming=True)
+
+    def _split_events(self, size):
+        parser = self.get_collector()
+        for i in range(0, len(self.source), size):
+            parser.feed(self.source[i : i + size])
+        parser.close()
+        return parser.events
+
+    def test_chunk_sizes(self):
+        expected = self._split_events(len(self.source))
+        self.assertIn(
+            (
+                "endtag_curly_perc",
+                "if",
+                "",
+                ["spaceless-left-dash", "spaceless-right-dash"],
+            ),
+            expected,
+        )
+        for size in range(1, 32):
+            with self.subTest(size=size):
+                self.assertEqual(self._split_events(size), expected)
+
+    def test_tag_takes_closer(self):
+        # the tag of a curly construct may begin with the "}" of what looks
+        # like its end, so that end is held back until the rest arrives
+        for source, expected in (
+            (
+                "{{~}}#if test {# wow #} }}",
+                [("curly_two", "}}#if", "test {# wow #}", ["spaceless-left-tilde"])],
+            ),
+            ("{{ }}{ }}-", [("curly_two", "}}{", "", []), ("data", "-")]),
+        ):
+            for i in range(1, len(source)):
+                with self.subTest(source=source, i=i):
+                    self._run_check([source[:i], source[i:]], expected)
+
+    def test_feed_accumulates(self):
+        self._run_check(
+            ["{", "% if x %", "}a<", "b c='>'", ">"],
+            [
+                ("starttag_curly_perc", "if", "x", []),
+                ("data", "a"),
+                ("starttag", "b", "c='>'", []),
+            ],
+        )
+
+    def test_streaming_keeps_data_runs(self):
+        parser = self.get_collector()
+        parser.feed("some ")
+        parser.feed("text{{ x }}")
+        self.assertEqual(
+            parser.events, [("data", "some text"), ("curly_two", "x", "", [])]
+        )
+        parser.feed(" tail")
+        self.assertEqual(len(parser.events), 2)
+        parser.close()
+        self.assertEqual(parser.events[-1], ("data", " tail"))
+
+
+class EventCollectorStop(EventCollector):
+    # stops at the first starttag_curly_perc whose tag is not "load"
+    def handle_starttag_curly_perc(self, tag, attrs, props):
+        EventCollector.handle_starttag_curly_perc(self, tag, attrs, props)
+        if tag != "load":
+            self.stop()
+
+
+class StopTestCase(TestCaseBase):
+    source = "{% load a %}\n{% load b %}\n{% block c %}<p>text</p>{% endblock %}"
+
+    def test_stop(self):
+        parser = EventCollectorStop(convert_charrefs=False)
+        parser.feed(self.source)
+        self.assertEqual(
+            parser.get_events(),
+            [
+                ("starttag_curly_perc", "load", "a", []),
+                ("data", "\n"),
+                ("starttag_curly_perc", "load", "b", []),
+                ("data", "\n"),
+                ("starttag_curly_perc", "block", "c", []),
+            ],
+        )
+        self.assertEqual(parser.stop_offset, 39)
+        self.assertEqual(parser.rawdata, self.source[39:])
+
+        # nothing is handled or kept after stop()
+        parser.feed("<b>more</b>")
+        parser.close()
+        self.assertEqual(len(parser.events), 5)
+        self.assertEqual(parser.stop_offset, 39)
+        self.assertEqual(parser.rawdata, self.source[39:])
+
+    def test_stop_bytes(self):
+        parser = EventCollectorStop(convert_charrefs=False, track_positions=True)
+        # the encoding is sniffed, and the source parsed, on close()
+        parser.feed(self.source.encode())
+        parser.close()
+        parser.feed(b"\n" * 100)
+        parser.close()
+        self.assertEqual(parser.rawdata, self.source[39:])
+        self.assertEqual(parser.getpos(parser.stop_offset), (3, 13))
+
+    def test_stop_in_data(self):
+        class Collector(EventCollector):
+            def handle_data(self, data):
+                EventCollector.handle_data(self, data)
+                self.stop()
+
+        parser = Collector(convert_charrefs=False)
+        parser.feed("text<p>")
+        parser.close()
+        self.assertEqual(parser.get_events(), [("data", "text")])
+        self.assertEqual(parser.stop_offset, 4)
+
+    def test_reset(self):
+        parser = EventCollectorStop(convert_charrefs=False)
+        parser.feed(self.source)
+        parser.reset()
+        self.assertIsNone(parser.stop_offset)
+        parser.feed("<p>")
+        self.assertEqual(parser.events[-1], ("starttag", "p", "", []))
+
+    def test_not_stopped(self):
+        parser = EventCollector(convert_charrefs=False)
+        parser.feed(self.source)
+        parser.close()
+        self.assertIsNone(parser.stop_offset)
+
+
+def handling(*names):
+    # an EventCollector that only overrides the handlers in names
+    methods = {name: vars(EventCollector)[name] for name in names}
+    methods.update(
+        __init__=EventCollector.__init__, get_events=EventCollector.get_events
+    )
+    return type("Collector", (Htp,), methods)
+
+
+class HandledEventsTestCase(TestCaseBase):
+    # events without an overridden handler are skipped, which must not change
+    # the events of the others
+    source = (
+        "<div class=a>text &amp; {{ b }}<br/>{% if c -%}<script>{{ d }}<p>"
+        "</script>{# e #}<!-- f -->{{#each g}}{{{ h }}}{{/each}}{% endif %}"
+        "<textarea>{% i %}&lt;</textarea>{% comment %}j{% endcomment %}</div>"
+    )
+
+    def test_subsets(self):
+        full = EventCollector(convert_charrefs=False)
+        full.feed(self.source)
+        full.close()
+        for names, kinds in (
+            (["handle_starttag_curly_perc"], ["starttag_curly_perc"]),
+            (["handle_data"], ["data"]),
+            (
+                ["handle_starttag", "handle_startendtag", "handle_endtag"],
+                ["starttag", "startendtag", "endtag"],
+            ),
+            (["handle_comment", "handle_curly_two"], ["comment", "curly_two"]),
+        ):
+            with self.subTest(names=names):
+                parser = handling(*names)(convert_charrefs=False)
+                parser.feed(self.source)
+                parser.close()
+                self.assertEqual(
+                    parser.events,
+                    [event for event in full.events if event[0] in kinds],
+                )
+
+    def test_arguments_not_built(self):
+        # only the three {% %} tags get props, and the parsers of the other
+        # constructs are never called
+        with mock.patch.object(
+            Htp, "parse_curly_two", side_effect=AssertionError("curly_two parsed")
+        ):
+            parser = handling("handle_starttag_curly_perc")()
+            # pylint: disable=protected-access
+            props = parser._props = mock.Mock(wraps=parser._props)
+            parser.feed(self.source)
+            parser.close()
+        self.assertEqual(
+            parser.events,
+            [
+                ("starttag_curly_perc", "if", "c", ["spaceless-right-dash"]),
+                ("starttag_curly_perc", "i", "", []),
+            ],
+        )
+        self.assertEqual(props.call_count, 3)
+
+    def test_default_startendtag(self):
+        # the default handle_startendtag calls handle_starttag and handle_endtag
+        parser = handling("handle_endtag")()
+        parser.feed("<p><br/></p>")
+        parser.close()
+        self.assertEqual(parser.events, [("endtag", "br"), ("endtag", "p")])
+
 
 class AttributesTestCase(TestCaseBase):
     # no attribute parsing happens here. all should be matching the input string.
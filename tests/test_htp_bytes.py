@@ -0,0 +1,211 @@
+"""Tests for Htp with bytes input."""
+# pylint: disable=C0115
+
+import mmap
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from HtmlTemplateParser import Htp, LazyData, TokenKind
+
+SOURCE = (
+    '<div title="café">{% if voilà %}日本 &amp; 😀{{ à|f }}'
+    "{% endif %}<br/>{# ç #}</div>\n"
+)
+
+
+class Collector(Htp):
+    def __init__(self, **kw):
+        self.events = []
+        Htp.__init__(self, **kw)
+
+    def handle_starttag(self, tag, attrs, props):
+        self.events.append(("starttag", tag, attrs, self.get_element_text()))
+
+    def handle_starttag_curly_perc(self, tag, attrs, props):
+        self.events.append(("starttag_curly_perc", tag, attrs, self.getpos()))
+
+    def handle_curly_two(self, data, attrs, props):
+        self.events.append(("curly_two", data, attrs, self.get_element_span()))
+
+    def handle_data(self, data):
+        self.events.append(("data", data))
+
+
+class BytesInputTestCase(unittest.TestCase):
+    def test_tokens_match_text(self):
+        encoded = SOURCE.encode()
+        for chunk_size in (1, 7, 65536):
+            text_tokens = list(Htp.iter_tokens(SOURCE))
+            byte_tokens = list(Htp.iter_tokens(encoded, chunk_size=chunk_size))
+            self.assertEqual(len(text_tokens), len(byte_tokens))
+            for text_token, byte_token in zip(text_tokens, byte_tokens):
+                self.assertEqual(text_token.kind, byte_token.kind)
+                self.assertEqual(text_token.tag, byte_token.tag)
+                self.assertEqual(text_token.attrs, byte_token.attrs)
+                self.assertEqual(text_token.props, byte_token.props)
+                self.assertEqual(
+                    encoded[byte_token.start : byte_token.end].decode(),
+                    SOURCE[text_token.start : text_token.end],
+                )
+
+    def test_handlers(self):
+        parser = Collector()
+        for chunk in (SOURCE[:30].encode(), SOURCE[30:].encode()):
+            parser.feed(memoryview(chunk))
+        parser.close()
+        self.assertEqual(parser.input_encoding, "utf-8")
+        self.assertEqual(
+            parser.events,
+            [
+                ("starttag", "div", 'title="café"', '<div title="café">'),
+                ("starttag_curly_perc", "if", "voilà", (1, 19)),
+                ("data", "日本 & 😀"),
+                ("curly_two", "à", "|f", (51, 61)),
+                ("starttag", "br", "", "<br/>"),
+                ("data", "\n"),
+            ],
+        )
+
+    def test_handler_calling_handler(self):
+        class Parser(Collector):
+            def handle_startendtag(self, tag, attrs, props):
+                self.events.append(("startendtag", attrs))
+                super().handle_startendtag(tag, attrs, props)
+
+        parser = Parser()
+        parser.feed('<b é="è"/>'.encode())
+        parser.close()
+        self.assertEqual(
+            parser.events,
+            [("startendtag", 'é="è"'), ("starttag", "b", 'é="è"', '<b é="è"/>')],
+        )
+
+    def test_lazy_data(self):
+        parser = Collector(lazy_data=True, encoding="cp1252")
+        parser.feed("a &amp; é<b>".encode("cp1252"))
+        parser.close()
+        data = parser.events[0][1]
+        self.assertIsInstance(data, LazyData)
+        self.assertEqual(data.raw, "a &amp; é".encode("cp1252"))
+        self.assertEqual(str(data), "a & é")
+
+    def test_byte_order_mark(self):
+        tokens = list(Htp.iter_tokens(b"\xef\xbb\xbf<p>\xc3\xa9"))
+        self.assertEqual(tokens[0].span, (3, 6))
+        self.assertEqual(tokens[1].tag, "é")
+
+        with self.assertRaises(ValueError):
+            list(Htp.iter_tokens("<p>".encode("utf-16")))
+
+    def test_meta_charset(self):
+        for meta, text, encoding in (
+            ('<meta charset="iso-8859-1">', "é", "iso8859-1"),
+            (
+                '<meta http-equiv="Content-Type" '
+                'content="text/html; charset=windows-1252">',
+                "é€",
+                "cp1252",
+            ),
+            # a document that can be read as ASCII is not UTF-16
+            ('<meta charset="utf-16">', "é€", "utf-8"),
+        ):
+            parser = Collector()
+            parser.feed((meta + "<p>" + text).encode(encoding))
+            parser.close()
+            self.assertEqual(parser.input_encoding, encoding)
+            self.assertEqual(parser.events[-1], ("data", text))
+
+    def test_encoding(self):
+        parser = Collector(encoding="latin-1")
+        parser.feed("<p>é".encode("latin-1"))
+        self.assertEqual(parser.input_encoding, "iso8859-1")
+        parser.close()
+        self.assertEqual(parser.events[-1], ("data", "é"))
+
+        with self.assertRaises(ValueError):
+            Htp(encoding="shift_jis")
+        with self.assertRaises(LookupError):
+            Htp(encoding="no-such-encoding")
+
+    def test_sniffing_waits_for_meta(self):
+        parser = Collector()
+        parser.feed(b"<p>")
+        self.assertEqual(parser.events, [])
+        parser.feed('<meta charset="latin-1">é'.encode("latin-1"))
+        parser.close()
+        self.assertEqual(parser.input_encoding, "iso8859-1")
+        self.assertEqual(parser.events[-1], ("data", "é"))
+
+    def test_mixed_input(self):
+        parser = Htp()
+        parser.feed(b"<p>")
+        with self.assertRaises(TypeError):
+            parser.feed("<p>")
+        parser.reset()
+        parser.feed("<p>")
+        with self.assertRaises(TypeError):
+            parser.feed(b"<p>")
+
+    def test_ascii_whitespace(self):
+        # U+00A0 is a space in text, but its bytes are not ASCII spaces
+        tokens = list(Htp.iter_tokens("{{ à\u00a0}}".encode()))
+        self.assertEqual(tokens[0].kind, TokenKind.CURLY_TWO)
+        self.assertEqual(tokens[0].tag, "à\u00a0")
+
+
+class ParseFileTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "page.html")
+
+    def _write(self, data):
+        with open(self.path, "wb") as file:
+            file.write(data)
+
+    def test_same_as_feed(self):
+        data = (SOURCE * 20).encode()
+        self._write(data)
+        for options in ({}, {"streaming": True}, {"lazy_data": True}):
+            parser = Collector(**options)
+            parser.parse_file(self.path, chunk_size=7)
+            expected = Collector(**options)
+            expected.feed(data)
+            expected.close()
+            self.assertEqual(parser.events, expected.events)
+
+    def test_fed_in_chunks(self):
+        # a parser that is not streaming gets the file in chunks as well,
+        # including the tags split between them
+        data = ("{{ }}{ }}-" + SOURCE * 20).encode()
+        self._write(data)
+        parser = Collector()
+        with mock.patch.object(parser, "feed", wraps=parser.feed) as feed:
+            parser.parse_file(self.path, chunk_size=64)
+        self.assertEqual(max(len(args[0]) for args, _ in feed.call_args_list), 64)
+        self.assertFalse(parser.streaming)
+        expected = Collector()
+        expected.feed(data)
+        expected.close()
+        self.assertEqual(parser.events, expected.events)
+
+    def test_empty_file(self):
+        self._write(b"")
+        parser = Collector()
+        parser.parse_file(self.path)
+        self.assertEqual(parser.events, [])
+
+    def test_tokens_from_mapping(self):
+        self._write(SOURCE.encode())
+        with open(self.path, "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapping:
+            tokens = list(Htp.iter_tokens(mapping, chunk_size=5))
+        self.assertEqual(tokens, list(Htp.iter_tokens(SOURCE.encode())))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,6 +12,7 @@ https://github.com/python/cpython/blob/f4c03484da59049eb62a9bf7777b963e2267d187/
 
 import pprint
 import unittest
+from unittest import mock
 
 from HtmlTemplateParser import Htp
 
@@ -230,6 +231,95 @@ text
             ],
         )
 
+    def test_element_span(self):
+        source = '<p class="a">x &amp; y{% if b %}{{ c }}</p>\n{# d #}<br/>'
+        spans = []
+
+        class SpanCollector(Htp):
+            def handle_starttag(self, *args):
+                spans.append((self.get_element_span(), self.get_element_text()))
+
+            handle_data = handle_endtag = handle_entityref = handle_starttag
+            handle_curly_two = handle_comment_curly_hash = handle_starttag
+            handle_starttag_curly_perc = handle_startendtag = handle_starttag
+
+        parser = SpanCollector()
+        for i in range(0, len(source), 5):
+            parser.feed(source[i : i + 5])
+        parser.close()
+
+        self.assertEqual(
+            [source[start:end] for (start, end), _ in spans],
+            [text for _, text in spans],
+        )
+        self.assertEqual("".join(text for _, text in spans), source)
+
+    def test_getpos_offset(self):
+        source = "<p>\nab{% if x %}\n\n{{ y }}</p>"
+        ends = []
+
+        class EndCollector(Htp):
+            def handle_curly_two(self, *args):
+                ends.append(self.getpos(self.get_element_span()[1]))
+
+            handle_starttag = handle_starttag_curly_perc = handle_curly_two
+
+        parser = EndCollector()
+        for char in source:
+            parser.feed(char)
+        parser.close()
+
+        self.assertEqual(ends, [(1, 3), (2, 12), (4, 7)])
+        self.assertEqual(parser.getpos(0), (1, 0))
+        self.assertEqual(parser.getpos(4), (2, 0))
+        self.assertEqual(parser.getpos(), (4, 11))
+
+    def test_untracked_positions(self):
+        parser = Htp(track_positions=False)
+        parser.feed("<p>\na</p>")
+        parser.close()
+        with self.assertRaises(RuntimeError):
+            parser.getpos()
+
+        # no line index is built or fed, for str or bytes input
+        target = "HtmlTemplateParser.html_template_parser.LineIndex"
+        with mock.patch(target, side_effect=AssertionError("LineIndex built")):
+            for source in ("<p>\na</p>\n" * 50, b"<p>\na</p>\n" * 50):
+                parser = Htp(track_positions=False)
+                parser.feed(source)
+                parser.close()
+                parser.reset()
+
+    def test_position_units(self):
+        class PositionCollector(Htp):
+            def reset(self):
+                super().reset()
+                self.positions = []
+
+            def handle_starttag(self, *args):
+                self.positions.append(self.getpos())
+
+            handle_endtag = handle_curly_two = handle_starttag
+
+        source = "<p>\U0001f600é</p>\n中<b>{{ x }}"
+        for unit, expected in (
+            ("codepoint", [(1, 0), (1, 5), (2, 1), (2, 4)]),
+            ("utf-16", [(1, 0), (1, 6), (2, 1), (2, 4)]),
+            ("utf-8", [(1, 0), (1, 9), (2, 3), (2, 6)]),
+        ):
+            with self.subTest(unit=unit):
+                parser = PositionCollector(position_unit=unit)
+                for char in source:
+                    parser.feed(char)
+                parser.close()
+
+                self.assertEqual(parser.positions, expected)
+        self.assertEqual(parser.getoffset(len(source)), len(source.encode("utf-8")))
+
+    def test_unknown_position_unit(self):
+        with self.assertRaises(ValueError):
+            Htp(position_unit="utf-32")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,299 @@
+"""Tests for Htp.iter_tokens, Htp.handle_tokens and Props."""
+# pylint: disable=C0115
+
+import unittest
+
+from HtmlTemplateParser import Htp, Props, Token, TokenKind
+
+SOURCE = (
+    '<div class="a">{% if x -%}text &amp; more{{ y|z }}{% endif %}<br/>'
+    "{# c #}{{/each}}</div>"
+)
+
+
+class IterTokensTestCase(unittest.TestCase):
+    def test_tokens(self):
+        self.assertEqual(
+            list(Htp.iter_tokens(SOURCE, convert_charrefs=False)),
+            [
+                Token(TokenKind.STARTTAG, "div", 'class="a"', (), 0, 15),
+                Token(
+                    TokenKind.STARTTAG_CURLY_PERC,
+                    "if",
+                    "x",
+                    ("spaceless-right-dash",),
+                    15,
+                    26,
+                ),
+                Token(TokenKind.DATA, "text ", start=26, end=31),
+                Token(TokenKind.ENTITYREF, "amp", start=31, end=36),
+                Token(TokenKind.DATA, " more", start=36, end=41),
+                Token(TokenKind.CURLY_TWO, "y", "|z", (), 41, 50),
+                Token(TokenKind.ENDTAG_CURLY_PERC, "if", "", (), 50, 61),
+                Token(TokenKind.STARTENDTAG, "br", "", ("is-selfclosing",), 61, 66),
+                Token(TokenKind.COMMENT_CURLY_HASH, " c ", start=66, end=73),
+                Token(
+                    TokenKind.ENDTAG_CURLY_TWO_SLASH, "each", props=(), start=73, end=82
+                ),
+                Token(TokenKind.ENDTAG, "div", start=82, end=88),
+            ],
+        )
+
+    def test_spans(self):
+        end = 0
+        for token in Htp.iter_tokens(SOURCE):
+            self.assertEqual(token.start, end)
+            end = token.end
+        self.assertEqual(end, len(SOURCE))
+
+    def test_malformed_endtag_span(self):
+        self.assertEqual(
+            list(Htp.iter_tokens("x</a<b>y")),
+            [
+                Token(TokenKind.DATA, "x", start=0, end=1),
+                Token(TokenKind.ENDTAG, "a<b", start=1, end=7),
+                Token(TokenKind.DATA, "y", start=7, end=8),
+            ],
+        )
+
+    def test_chunks(self):
+        expected = list(Htp.iter_tokens(SOURCE))
+        self.assertEqual(list(Htp.iter_tokens(iter(SOURCE))), expected)
+        self.assertEqual(list(Htp.iter_tokens(SOURCE, chunk_size=3)), expected)
+
+    def test_lazy(self):
+        fed = []
+
+        def chunks():
+            for chunk in ("<p>", "a", "</p>", "<b>"):
+                fed.append(chunk)
+                yield chunk
+
+        tokens = Htp.iter_tokens(chunks())
+        self.assertEqual(next(tokens).kind, TokenKind.STARTTAG)
+        self.assertEqual(fed, ["<p>"])
+
+    def test_unpacking(self):
+        token = Token(TokenKind.CURLY_TWO, "y", "|z", (), 41, 50)
+        kind, tag, attrs, props, span = token
+        self.assertEqual(
+            (kind, tag, attrs, props, span),
+            (TokenKind.CURLY_TWO, "y", "|z", (), (41, 50)),
+        )
+        self.assertEqual(kind.name.lower(), "curly_two")
+
+    def test_kinds_cover_handlers(self):
+        handlers = {
+            name[len("handle_") :] for name in dir(Htp) if name.startswith("handle_")
+        }
+        handlers.add("unknown_decl")
+        self.assertEqual({kind.name.lower() for kind in TokenKind}, handlers)
+
+    def test_subclass_rules(self):
+        class Parser(Htp):
+            CDATA_CONTENT_ELEMENTS = ("pre",)
+
+        self.assertEqual(
+            [(token.kind, token.tag) for token in Parser.iter_tokens("<pre><b></pre>")],
+            [
+                (TokenKind.STARTTAG, "pre"),
+                (TokenKind.DATA, "<b>"),
+                (TokenKind.ENDTAG, "pre"),
+            ],
+        )
+
+
+class BatchCollector(Htp):
+    BATCH_SIZE = 4
+
+    def __init__(self, **kwargs):
+        self.batches = []
+        super().__init__(**kwargs)
+
+    def handle_tokens(self, batch):
+        self.batches.append(batch)
+
+
+class HandleTokensTestCase(unittest.TestCase):
+    def test_batches(self):
+        parser = BatchCollector()
+        parser.feed(SOURCE)
+        self.assertEqual([len(batch) for batch in parser.batches], [4, 4])
+        parser.close()
+        self.assertEqual([len(batch) for batch in parser.batches], [4, 4, 1])
+        self.assertEqual(
+            [token for batch in parser.batches for token in batch],
+            list(Htp.iter_tokens(SOURCE)),
+        )
+
+    def test_default_batch_size(self):
+        # a long input comes in full batches of BATCH_SIZE tokens, which are
+        # the tokens iter_tokens() yields, as it feeds in streaming mode
+        source = SOURCE * 300
+        chunks = [source[i : i + 1000] for i in range(0, len(source), 1000)]
+        parser = type("Parser", (BatchCollector,), {"BATCH_SIZE": Htp.BATCH_SIZE})(
+            streaming=True
+        )
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.close()
+        sizes = [len(batch) for batch in parser.batches]
+        self.assertGreater(len(sizes), 2)
+        self.assertEqual(sizes[:-1], [Htp.BATCH_SIZE] * (len(sizes) - 1))
+        self.assertEqual(
+            [token for batch in parser.batches for token in batch],
+            list(Htp.iter_tokens(chunks)),
+        )
+
+    def test_bytes(self):
+        parser = BatchCollector()
+        parser.feed("<p title=ä>{{ ö }}".encode())
+        parser.close()
+        self.assertEqual(
+            parser.batches,
+            [
+                [
+                    Token(TokenKind.STARTTAG, "p", "title=ä", (), 0, 12),
+                    Token(TokenKind.CURLY_TWO, "ö", "", (), 12, 20),
+                ]
+            ],
+        )
+
+    def test_stop(self):
+        class Parser(BatchCollector):
+            def handle_tokens(self, batch):
+                BatchCollector.handle_tokens(self, batch)
+                self.stop()
+
+        parser = Parser()
+        parser.feed(SOURCE)
+        parser.close()
+        self.assertEqual([len(batch) for batch in parser.batches], [4])
+        self.assertEqual(parser.stop_offset, parser.batches[0][-1].end)
+
+    def test_reset(self):
+        parser = BatchCollector()
+        parser.feed("<p>")
+        parser.reset()
+        parser.feed("<b>")
+        parser.close()
+        self.assertEqual(
+            parser.batches, [[Token(TokenKind.STARTTAG, "b", "", (), 0, 3)]]
+        )
+
+    def test_iter_tokens(self):
+        # iter_tokens() of a class with handle_tokens() yields the tokens
+        self.assertEqual(
+            list(BatchCollector.iter_tokens(SOURCE)), list(Htp.iter_tokens(SOURCE))
+        )
+
+    def test_handlers(self):
+        def handler(_self, *_args):
+            pass
+
+        with self.assertRaises(TypeError):
+            type("Parser", (Htp,), {"handle_tokens": handler, "handle_data": handler})
+
+
+MODIFIERS_SOURCE = (
+    "<br/>{%- if a -%}{%+ b +%}{%- endif %}{{~#each c~}}{{#> d }}{{~/each~}}"
+    "{{!-- e --}}{{ f }}{{~ g ~}}{{> h }}{{{{~i~}}}}{{{{~/i~}}}}"
+)
+
+
+class PropsParser(Htp):
+    PROP_FLAGS = True
+
+    def reset(self):
+        super().reset()
+        self.props = []
+
+    def handle_startendtag(self, tag, attrs, props):
+        self.props.append(props)
+
+    def handle_starttag_curly_perc(self, tag, attrs, props):
+        self.props.append(props)
+
+    def handle_endtag_curly_perc(self, tag, attrs, props):
+        self.props.append(props)
+
+    def handle_starttag_curly_two_hash(self, tag, attrs, props):
+        self.props.append(props)
+
+    def handle_endtag_curly_two_slash(self, tag, props):
+        self.props.append(props)
+
+    def handle_starttag_curly_four(self, tag, attrs, props):
+        self.props.append(props)
+
+    def handle_endtag_curly_four_slash(self, tag, attrs, props):
+        self.props.append(props)
+
+    def handle_curly_two(self, data, attrs, props):
+        self.props.append(props)
+
+    def handle_comment_curly_two_exlaim(self, data, props):
+        self.props.append(props)
+
+
+class PropsTestCase(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(Props(0).names(), [])
+        self.assertEqual(
+            (Props.SPACELESS_RIGHT_TILDE | Props.SPACELESS_LEFT_TILDE).names(),
+            ["spaceless-left-tilde", "spaceless-right-tilde"],
+        )
+
+    def test_flags(self):
+        parser = PropsParser()
+        parser.feed(MODIFIERS_SOURCE)
+        parser.close()
+        self.assertEqual(
+            parser.props,
+            [
+                Props.IS_SELFCLOSING,
+                Props.SPACELESS_LEFT_DASH | Props.SPACELESS_RIGHT_DASH,
+                Props.SPACELESS_LEFT_PLUS | Props.SPACELESS_RIGHT_PLUS,
+                Props.SPACELESS_LEFT_DASH,
+                Props.SPACELESS_LEFT_TILDE | Props.SPACELESS_RIGHT_TILDE,
+                Props.PARTIAL,
+                Props.SPACELESS_LEFT_TILDE | Props.SPACELESS_RIGHT_TILDE,
+                Props.SAFE_LEFT | Props.SAFE_RIGHT,
+                Props(0),
+                Props.SPACELESS_LEFT_TILDE | Props.SPACELESS_RIGHT_TILDE,
+                Props.PARTIAL,
+                Props.SPACELESS_LEFT_TILDE | Props.SPACELESS_RIGHT_TILDE,
+                Props.SPACELESS_LEFT_TILDE | Props.SPACELESS_RIGHT_TILDE,
+            ],
+        )
+        for props in parser.props:
+            self.assertIsInstance(props, Props)
+
+    def test_lists(self):
+        # without PROP_FLAGS, handlers get the names of the props in new lists
+        parser = PropsParser()
+        parser.feed(MODIFIERS_SOURCE)
+        parser.close()
+        lists = type("Parser", (PropsParser,), {"PROP_FLAGS": False})()
+        lists.feed(MODIFIERS_SOURCE)
+        lists.close()
+        self.assertEqual(lists.props, [props.names() for props in parser.props])
+        # each handler call gets a list of its own
+        self.assertIsNot(lists.props[4], lists.props[6])
+
+    def test_tokens(self):
+        parser = PropsParser()
+        parser.feed(MODIFIERS_SOURCE)
+        parser.close()
+        tokens = list(Htp.iter_tokens(MODIFIERS_SOURCE))
+        self.assertEqual(
+            [token.props for token in tokens],
+            [tuple(props.names()) for props in parser.props],
+        )
+        # tokens with the same props share their tuple, PROP_FLAGS or not
+        self.assertIs(tokens[4].props, tokens[6].props)
+        self.assertEqual(list(PropsParser.iter_tokens(MODIFIERS_SOURCE)), tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+"""Tests for the budgets and limits of Htp and AttributeParser."""
+# pylint: disable=C0115
+
+import copy
+import time
+import unittest
+
+from HtmlTemplateParser import (
+    AttributeParser,
+    BudgetExceeded,
+    EventBuffer,
+    Htp,
+    LimitExceeded,
+)
+
+SOURCE = (
+    '<div class="a">{% if x -%}text &amp; more{{ y|z }}{% endif %}<br/>'
+    "{# c #}{{/each}}</div>"
+)
+
+ATTRIBUTES = 'class="a {{ b }}" id=x {% if y %}data-z="1"{% endif %} '
+
+
+class SpanParser(Htp):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.spans = []
+
+    def handle_data(self, data):
+        self.spans.append(self.get_element_span())
+
+    def handle_starttag(self, tag, attrs, props):
+        self.spans.append(self.get_element_span())
+
+    def handle_endtag(self, tag):
+        self.spans.append(self.get_element_span())
+
+    def handle_starttag_curly_perc(self, tag, attrs, props):
+        self.spans.append(self.get_element_span())
+
+    def handle_endtag_curly_perc(self, tag, attrs, props):
+        self.spans.append(self.get_element_span())
+
+    def handle_curly_two(self, data, attrs, props):
+        self.spans.append(self.get_element_span())
+
+
+class SpanAttributeParser(AttributeParser):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.spans = []
+
+    def handle_starttag_curly_perc(self, tag, attrs, props):
+        self.spans.append(self.get_element_span())
+
+    def handle_endtag_curly_perc(self, tag, attrs, props):
+        self.spans.append(self.get_element_span())
+
+
+class BudgetTestCase(unittest.TestCase):
+    def test_max_steps(self):
+        parser = SpanParser(max_steps=3)
+        with self.assertRaises(BudgetExceeded) as raised:
+            parser.feed(SOURCE)
+        self.assertEqual(raised.exception.reason, "max_steps")
+        self.assertIsNone(raised.exception.events)
+        self.assertEqual(raised.exception.offset, parser.spans[-1][1])
+        self.assertEqual(raised.exception.offset, 50)
+        self.assertEqual(str(raised.exception), "max_steps ran out at offset 50")
+        self.assertEqual(copy.copy(raised.exception).offset, 50)
+
+    def test_resume(self):
+        # the rest of the input is kept, and parsed once the budget is raised
+        expected = SpanParser()
+        expected.feed(SOURCE)
+        expected.close()
+
+        parser = SpanParser(max_steps=3)
+        with self.assertRaises(BudgetExceeded):
+            parser.feed(SOURCE)
+        parser.max_steps = None
+        parser.close()
+        self.assertEqual(parser.spans, expected.spans)
+
+    def test_steps_from_reset(self):
+        parser = SpanParser(max_steps=60)
+        parser.feed(SOURCE * 5)
+        with self.assertRaises(BudgetExceeded):
+            parser.feed(SOURCE * 5)
+        parser.reset()
+        parser.feed(SOURCE * 5)
+
+    def test_deadline(self):
+        parser = SpanParser(deadline=time.monotonic() - 1)
+        with self.assertRaises(BudgetExceeded) as raised:
+            parser.feed(SOURCE * 100)
+        self.assertEqual(raised.exception.reason, "deadline")
+        self.assertEqual(raised.exception.offset, parser.spans[-1][1])
+        self.assertLess(raised.exception.offset, len(SOURCE * 100))
+
+    def test_no_budget(self):
+        parser = SpanParser(deadline=time.monotonic() + 60, max_steps=1000)
+        parser.feed(SOURCE)
+        parser.close()
+        self.assertEqual(parser.spans[-1][1], len(SOURCE))
+
+    def test_iter_tokens(self):
+        tokens = []
+        with self.assertRaises(BudgetExceeded) as raised:
+            for token in Htp.iter_tokens(SOURCE * 10, chunk_size=50, max_steps=20):
+                tokens.append(token)
+        self.assertEqual(tokens[-1].end, raised.exception.offset)
+        self.assertEqual(tokens, list(Htp.iter_tokens(SOURCE * 10))[: len(tokens)])
+
+    def test_collect(self):
+        buffer = EventBuffer()
+        with self.assertRaises(BudgetExceeded) as raised:
+            buffer.parse(SOURCE * 10, max_steps=20)
+        self.assertIs(raised.exception.events, buffer)
+        self.assertEqual(buffer.ends[-1], raised.exception.offset)
+
+    def test_attribute_parser(self):
+        parser = SpanAttributeParser(max_steps=13)
+        with self.assertRaises(BudgetExceeded) as raised:
+            parser.feed(ATTRIBUTES)
+        self.assertEqual(raised.exception.reason, "max_steps")
+        self.assertEqual(parser.spans, [(23, 33)])
+        self.assertEqual(raised.exception.offset, 33)
+
+        # the budget is for each parse
+        parser = SpanAttributeParser(max_steps=5)
+        parser.feed(ATTRIBUTES[:5])
+        parser.feed(ATTRIBUTES[:5])
+
+
+class LimitTestCase(unittest.TestCase):
+    def _check(self, source, limit, offset, parser=SpanParser, **kwargs):
+        parser = parser(**kwargs)
+        with self.assertRaises(LimitExceeded) as raised:
+            parser.feed(source)
+            parser.close()
+        self.assertEqual(raised.exception.limit, limit)
+        self.assertEqual(raised.exception.value, kwargs[limit])
+        self.assertEqual(raised.exception.offset, offset)
+        self.assertEqual(
+            str(raised.exception),
+            "%s of %d exceeded at offset %d" % (limit, kwargs[limit], offset),
+        )
+        self.assertEqual(copy.copy(raised.exception).limit, limit)
+        return parser
+
+    def test_max_token_length(self):
+        long_tag = '<p><div class="%s">' % ("x" * 50)
+        parser = self._check(long_tag, "max_token_length", 3, max_token_length=20)
+        # the tag is not handled
+        self.assertEqual(parser.spans, [(0, 3)])
+        self.assertEqual(parser.getpos(3), (1, 3))
+
+        self._check(
+            "{%% if %s %%}" % ("x" * 50), "max_token_length", 0, max_token_length=20
+        )
+        self._check(
+            "<!-- %s -->" % ("x" * 50), "max_token_length", 0, max_token_length=20
+        )
+
+        parser = SpanParser(max_token_length=len(long_tag))
+        parser.feed(long_tag)
+        parser.close()
+
+    def test_max_token_length_unterminated(self):
+        # the start of a tag is not kept waiting for its end beyond the limit
+        parser = SpanParser(max_token_length=50, streaming=True)
+        parser.feed("<p>")
+        parser.feed('<div class="')
+        with self.assertRaises(LimitExceeded) as raised:
+            for _ in range(10):
+                parser.feed("x" * 10)
+        self.assertEqual(raised.exception.offset, 3)
+
+    def test_max_token_length_text(self):
+        # text waiting for the next tag is not an element, however it is fed
+        source = "<p>" + "text " * 30 + "</p>"
+        expected = list(Htp.iter_tokens(source, max_token_length=100))
+        self.assertEqual(len(expected), 3)
+        for chunks in (
+            [source],
+            [source[:153], source[153:]],
+            [source[i : i + 7] for i in range(0, len(source), 7)],
+        ):
+            with self.subTest(chunks=len(chunks)):
+                self.assertEqual(
+                    list(Htp.iter_tokens(chunks, max_token_length=100)), expected
+                )
+        text = ["x" * 300, "y" * 300]
+        self.assertEqual(len(list(Htp.iter_tokens(text, max_token_length=100))), 1)
+
+    def test_max_attribute_length(self):
+        long_attrs = "<p><a %s>" % ("b " * 30)
+        self._check(long_attrs, "max_attribute_length", 3, max_attribute_length=10)
+        long_attrs = "{{ x %s }}" % ("y" * 30)
+        self._check(long_attrs, "max_attribute_length", 0, max_attribute_length=10)
+        parser = SpanParser(max_attribute_length=10)
+        parser.feed('<a b="c">{% if d %}{{ e|f }}')
+        parser.close()
+
+    def test_max_tokens(self):
+        self._check(SOURCE * 10, "max_tokens", 103, max_tokens=9)
+        parser = SpanParser(max_tokens=1000)
+        parser.feed(SOURCE * 10)
+        parser.close()
+
+    def test_max_depth(self):
+        source = "{% for a %}{% if b %}{% load c %}x{% endif %}{% endfor %}"
+        parser = SpanParser(max_depth=2)
+        parser.feed(source * 3)
+        parser.close()
+        self._check(source, "max_depth", 11, max_depth=1)
+        self._check("{% for %}{% for %}{% for %}", "max_depth", 18, max_depth=2)
+
+        parser = SpanParser(max_depth=2)
+        parser.feed("{{#a}}{{#b}}{{/b}}{{/a}}{{{{raw}}}}{{{{/raw}}}}")
+        parser.close()
+        self._check("{{#a}}{{#b}}{{/b}}{{/a}}", "max_depth", 6, max_depth=1)
+
+    def test_iter_tokens(self):
+        with self.assertRaises(LimitExceeded):
+            list(Htp.iter_tokens(SOURCE * 10, max_tokens=9))
+
+    def test_attribute_parser(self):
+        self._check(
+            ATTRIBUTES,
+            "max_attribute_length",
+            0,
+            SpanAttributeParser,
+            max_attribute_length=20,
+        )
+        self._check(
+            ATTRIBUTES, "max_token_length", 23, SpanAttributeParser, max_token_length=8
+        )
+        self._check(ATTRIBUTES, "max_tokens", 23, SpanAttributeParser, max_tokens=12)
+        parser = self._check(
+            "{% if a %}{% for b %}{% endfor %}{% endif %}",
+            "max_depth",
+            10,
+            SpanAttributeParser,
+            max_depth=1,
+        )
+        self.assertEqual(parser.spans, [(0, 10)])
+
+
+if __name__ == "__main__":
+    unittest.main()
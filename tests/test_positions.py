@@ -0,0 +1,51 @@
+"""Tests for LineIndex."""
+# pylint: disable=C0115
+
+import random
+import unittest
+
+from HtmlTemplateParser.positions import LineIndex
+
+ENCODINGS = {"codepoint": None, "utf-16": "utf-16-le", "utf-8": "utf-8"}
+
+
+def units(text, unit):
+    encoding = ENCODINGS[unit]
+    if encoding is None:
+        return len(text)
+    return len(text.encode(encoding)) // (2 if unit == "utf-16" else 1)
+
+
+class LineIndexTestCase(unittest.TestCase):
+    def test_against_encoding(self):
+        rand = random.Random(0)
+        for _ in range(100):
+            text = "".join(rand.choice("ab\né中\U0001f600") for _ in range(40))
+            for unit in ENCODINGS:
+                index = LineIndex(unit)
+                start = 0
+                while start < len(text):
+                    size = rand.randint(1, 7)
+                    index.add(text[start : start + size], start)
+                    start += size
+
+                for offset in range(len(text) + 1):
+                    line_start = text.rfind("\n", 0, offset) + 1
+                    self.assertEqual(
+                        index.getpos(offset),
+                        (
+                            text.count("\n", 0, offset) + 1,
+                            units(text[line_start:offset], unit),
+                        ),
+                    )
+                    self.assertEqual(
+                        index.unit_offset(offset), units(text[:offset], unit)
+                    )
+
+    def test_unknown_unit(self):
+        with self.assertRaises(ValueError):
+            LineIndex("utf-32")
+
+
+if __name__ == "__main__":
+    unittest.main()